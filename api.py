@@ -4,17 +4,65 @@ from flask import Flask, request , jsonify , make_response ,abort
 from flask_restful import Resource, Api
 import json
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
 from api_schema.api_schema import request_schema
-from course_sched.course_sched import CourseSched, Course, Curriculum, SchedPartialSolutionSerializer
+from course_sched.course_sched import CourseSched, Course, Curriculum, SchedPartialSolutionSerializer, SchedSolutionStreamer
 from api_util import *
+from api_cache import ResultCache, request_key, body_etag
+from api_jobs import JobManager, JobSolutionSerializer
+from api_executor import SolverPool
+from api_metrics import (
+    REGISTRY,
+    HTTP_REQUESTS,
+    HTTP_REQUEST_DURATION,
+    JOBS,
+    SOLVER_POOL_IDLE_WORKERS,
+    SOLVER_POOL_WAITING,
+    PROCESS_RSS,
+    observe_solve,
+    process_rss_bytes
+)
 
 from schema import SchemaError
 
 app = Flask(__name__)
 api = Api(app)
+result_cache = ResultCache.from_env()
+job_manager = JobManager.from_env()
+solver_pool = SolverPool.from_env()
+
+
+@app.before_request
+def start_timer():
+    request.started_at = time.monotonic()
+
+@app.after_request
+def record_request(response):
+    # requests that don't match a route share one label so that the number of
+    # series stays bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method,
+                      status=str(response.status_code))
+    HTTP_REQUEST_DURATION.observe(time.monotonic() - request.started_at,
+                                  endpoint=endpoint)
+    return response
+
+
+def conditional_response(body):
+    # ETag is the hash of the body; a matching If-None-Match skips the body with 304
+    # (done by hand since werkzeug only does it for GET and HEAD requests)
+    etag = body_etag(body)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 @app.errorhandler(400)
 def not_found(error):
@@ -33,119 +81,169 @@ class Version(Resource):
         return jsonify(resp)
 
 
+def validate_request():
+    # if request is not json, throw an error
+    if not request.json:
+        abort(400 , description="Bad request ; request isn't json")
+
+    try:
+        return request_schema.validate(request.json)
+    except SchemaError:
+        abort(400 , description="Bad request ; request Schema isn't valid")
+
+
 class Scheduler(Resource):
     def post(self):
         periods_per_day = int(os.environ.get("PERIODS_PER_DAY", 27)) 
         n_days = int(os.environ.get("DAYS_PER_WEEK", 5))
+        validated = validate_request()
 
-        # if request is not json, throw an error
-        if not request.json:
-            abort(400 , description="Bad request ; request isn't json")
+        single_mode = os.environ.get("SOLVER_SINGLE_MODE", "portfolio")
+        cache_key = request_key(validated, result_settings())
+        cached_body = result_cache.get(cache_key)
+        if cached_body is not None:
+            return conditional_response(cached_body)
 
-        try:
-            validated = request_schema.validate(request.json)
-        except SchemaError:
-            abort(400 , description="Bad request ; request Schema isn't valid")
-         
-        # for item in request.json:
-        n_solutions = validated['n_solutions']
-        curricula = validated['curricula']
-
-        if 'constraints' in validated:
-            constraints = validated['constraints']
+        if solver_pool:  # solve in a worker process
+            body, stats = solver_pool.solve(validated, n_days, periods_per_day, single_mode)
         else:
-            constraints = []
+            body, stats = solve_request(validated, n_days, periods_per_day, single_mode)
+        observe_solve(stats)
+        result_cache.put(cache_key, body)
+        return conditional_response(body)
 
-        if 'course_locks' in validated:
-            course_locks = validated['course_locks']
-        else:
-            course_locks = []
-
-        if course_locks_contains_duplicates(course_locks):
-            abort(400 , description="Bad request ; duplicate courses in course_Locks")
-
-        if course_locks_and_constraints_overlap(course_locks, constraints):
-            abort(400 , description="Bad request ; course specified in both course_locks and constraints")
-
-        L_curriculums = []
-
-        Cuids = set()
-
-        for curr in curricula: # run through the curriculums
-            curriculum_id = curr['curriculum_id']
-            courses = curr['courses']
-            L_courses = []
-
-            Coids = set()
-
-            for cour in courses: # run through the courses 
-                # what happens if courses ids are similar?
-                course_id = cour['course_id']
-                n_periods = cour['n_periods']
-
-                # validation: check for similar course ids
-                if course_id in Coids:
-                    abort(400 , description="Bad request ; courses with identical ids in a curriculum")
-                Coids.add(course_id)    
-
-                L_courses.append(Course(course_id ,n_periods))  # calling the Course function in the course_sched class
-        
-            # validation: check for similar curriculum ids
-            if curriculum_id in Cuids:
-                abort(400, description="Bad request ; curriculums with identical ids in a curricula")
-            Cuids.add(curriculum_id)
-
-            L_curriculums.append(Curriculum(curriculum_id, L_courses)) # calling the Curriculum function in the course_sched class
-
-        curricula = L_curriculums
-        
-        sched = CourseSched(n_days, periods_per_day, curricula)
-        sched.add_no_overlap_constraints()
-        sched.add_course_len_constraints()
-        sched.add_lecture_len_constraints()
-        sched.add_sync_across_curricula_constraints()
-        sched.add_lecture_symmetry_constraints()
-        
-        D_course_day = {}   # dictionary of course ids as keys and days as values.
-
-        for const in constraints:
-            course_id = const['course_id']
-            day = const['day']
-            intervals = const['intervals']
-            L_intervals = [] 
-            
-            for key , value in D_course_day.items():
-                if course_id in D_course_day and value == day:
-                    abort(400)
-                D_course_day.update(course_id = day)
-
-            for inter in intervals:
-                start = inter['start']
-                end   = inter['end']
-                L_intervals.append((start, end))
-        
-            sched.add_unavailability_constraints(course_id, day, L_intervals)
-        
-        # add some soft constraints
-        sched.add_soft_total_time_constraints(4, 14, 1, 1)
-
-        for course_lock in course_locks:
-            sched.add_course_lock(course_lock['course_id'], course_lock['locks'])
-
-
-        # instantiate sched with class CourseSched 
-        solution_printer = SchedPartialSolutionSerializer(sched.model_vars,
-                                                   sched.curricula,
-                                                   sched.n_days,
-                                                   sched.n_periods,
-                                                   n_solutions)
-        sched.solve(solution_printer)
-
-        schedule_info = solution_printer.solutions
-
-        return jsonify(schedule_info)
+class SchedulerStream(Resource):
+    def post(self):
+        periods_per_day = int(os.environ.get("PERIODS_PER_DAY", 27)) 
+        n_days = int(os.environ.get("DAYS_PER_WEEK", 5))
+        validated = validate_request()
+        single_mode = os.environ.get("SOLVER_SINGLE_MODE", "portfolio")
+        n_solutions = validated['n_solutions']
+        # solved in this process rather than in `solver_pool`: solutions are passed
+        # on while the search runs and a client that goes away stops the search
+        sched = build_sched(validated, n_days, periods_per_day)
+
+        # the solver thread blocks while the queue is full, so at most this many
+        # solutions wait for a slow client
+        lines = queue.Queue(maxsize=int(os.environ.get("API_STREAM_QUEUE_SIZE", 16)))
+        done = object()
+        cancelled = threading.Event()
+        started = time.monotonic()
+        summary = {'n_solutions': 0, 'status': None,
+                   'first_solution_time': None, 'total_time': None}
+
+        def put(item):
+            # returns False if the client went away
+            while not cancelled.is_set():
+                try:
+                    lines.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def emit(solution):
+            if summary['first_solution_time'] is None:
+                summary['first_solution_time'] = time.monotonic() - started
+            return put(json.dumps(solution, separators=(',', ':')) + '\n')
+
+        streamer = SchedSolutionStreamer(sched.model_vars,
+                                         sched.curricula,
+                                         sched.n_days,
+                                         sched.n_periods,
+                                         n_solutions,
+                                         emit)
+
+        def solve():
+            solve_started = time.monotonic()
+            try:
+                status = solve_sched(sched, streamer, n_solutions, single_mode)
+                stats = solve_stats(sched, streamer, solve_started, status)
+                observe_solve(stats)
+                summary['status'] = stats['status']
+                summary['symmetry_classes'] = stats['symmetry_classes']
+                if 'lns_trace' in stats:
+                    summary['lns_trace'] = stats['lns_trace']
+            except Exception as e:
+                summary['status'] = 'error'
+                summary['error'] = str(e)
+            summary['n_solutions'] = streamer.solutions['n_solutions']
+            summary['total_time'] = time.monotonic() - started
+            put(done)
+
+        def generate():
+            solver_thread = threading.Thread(target=solve, daemon=True)
+            solver_thread.start()
+            try:
+                for line in iter(lines.get, done):
+                    yield line
+            finally:  # also when the client goes away
+                cancelled.set()
+                streamer.stop()
+            yield json.dumps(summary, separators=(',', ':')) + '\n'
+
+        return app.response_class(generate(), mimetype='application/x-ndjson')
+
+class JobList(Resource):
+    def post(self):
+        periods_per_day = int(os.environ.get("PERIODS_PER_DAY", 27)) 
+        n_days = int(os.environ.get("DAYS_PER_WEEK", 5))
+        validated = validate_request()
+        single_mode = os.environ.get("SOLVER_SINGLE_MODE", "portfolio")
+        n_solutions = validated['n_solutions']
+        # solved in this process rather than in `solver_pool`: progress is read from
+        # the callback while the search runs and cancelling the job stops the search
+        sched = build_sched(validated, n_days, periods_per_day)
+        callback = JobSolutionSerializer(sched.model_vars,
+                                         sched.curricula,
+                                         sched.n_days,
+                                         sched.n_periods,
+                                         n_solutions)
+
+        def solve(callback):
+            started = time.monotonic()
+            status = solve_sched(sched, callback, n_solutions, single_mode)
+            stats = solve_stats(sched, callback, started, status)
+            observe_solve(stats)
+            return stats
+
+        job = job_manager.submit(solve, callback)
+        if job is None:
+            abort(503, description="Service unavailable ; too many queued jobs")
+        response = jsonify(job.to_dict())
+        response.status_code = 202
+        response.headers['Location'] = f'/jobs/{job.job_id}'
+        return response
+
+
+class Job(Resource):
+    def get(self, job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            abort(404)
+        return jsonify(job.to_dict())
+
+    def delete(self, job_id):
+        job = job_manager.cancel(job_id)
+        if job is None:
+            abort(404)
+        return jsonify(job.to_dict())
+
+@app.route('/metrics')
+def metrics():
+    # gauges are sampled when they are scraped
+    for status, count in job_manager.status_counts().items():
+        JOBS.set(count, status=status)
+    if solver_pool:
+        SOLVER_POOL_IDLE_WORKERS.set(solver_pool.n_idle())
+        SOLVER_POOL_WAITING.set(solver_pool.n_waiting)
+    PROCESS_RSS.set(process_rss_bytes())
+    return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 api.add_resource(Scheduler, "/sched")
+api.add_resource(SchedulerStream, "/sched/stream")
+api.add_resource(JobList, "/jobs")
+api.add_resource(Job, "/jobs/<string:job_id>")
 api.add_resource(Version, "/version")
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def canonical_request(validated, settings) -> dict:
+    """ Returns `validated` request with lists whose order has no meaning sorted.
+
+        Curricula and their courses keep their order since it is the order of the
+        response. `settings` are env-derived values that change the response
+        (e.g. periods per day).
+    """
+    constraints = sorted(({'course_id': const['course_id'],
+                           'day': const['day'],
+                           'intervals': sorted((inter['start'], inter['end'])
+                                               for inter in const['intervals'])}
+                          for const in validated.get('constraints', [])),
+                         key=lambda const: (const['course_id'], const['day'],
+                                            const['intervals']))
+    course_locks = sorted(({'course_id': lock['course_id'],
+                            'locks': sorted((x['day'], x['start'], x['duration'])
+                                            for x in lock['locks'])}
+                           for lock in validated.get('course_locks', [])),
+                          key=lambda lock: (lock['course_id'], lock['locks']))
+    return {'n_solutions': validated['n_solutions'],
+            'curricula': [{'curriculum_id': cur['curriculum_id'],
+                           'courses': [(course['course_id'], course['n_periods'])
+                                       for course in cur['courses']]}
+                          for cur in validated['curricula']],
+            'constraints': constraints,
+            'course_locks': course_locks,
+            'settings': settings}
+
+
+def request_key(validated, settings) -> str:
+    """ Returns hash of the canonical form of `validated` request (see `canonical_request`).
+    """
+    canonical = json.dumps(canonical_request(validated, settings),
+                           sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def body_etag(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def code_version(paths) -> str:
+    """ Returns hash of source files that compute responses, so that cached
+        responses of other versions of the code are never served.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """ Cache of response bodies by request key: in-process LRU with at most
+        `max_size` entries, plus files in `directory` if it is given, which take
+        at most `max_disk_bytes` (oldest files are removed first).
+        Entries older than `ttl` seconds are evicted from both.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: float = 3600, directory: str = None,
+                 max_disk_bytes: int = 256 * 2 ** 20):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (stored at, body)
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """ `SCHED_CACHE_SIZE` (0 disables the in-process cache), `SCHED_CACHE_TTL`
+            (seconds), `SCHED_CACHE_DIR` (optional on-disk store) and
+            `SCHED_CACHE_DIR_MAX_MB` (size limit of the on-disk store).
+        """
+        return cls(max_size=int(os.environ.get('SCHED_CACHE_SIZE', 128)),
+                   ttl=float(os.environ.get('SCHED_CACHE_TTL', 3600)),
+                   directory=os.environ.get('SCHED_CACHE_DIR') or None,
+                   max_disk_bytes=round(float(os.environ.get('SCHED_CACHE_DIR_MAX_MB', 256))
+                                        * 2 ** 20))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key: str) -> bytes:
+        """ Returns the cached body for `key` or None.
+        """
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                stored_at, body = self._entries[key]
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return body
+                del self._entries[key]
+        if not self.directory:
+            return None
+        try:
+            path = self._path(key)
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        self._put_memory(key, stored_at, body)
+        return body
+
+    def put(self, key: str, body: bytes):
+        """ Cache `body` for `key`.
+        """
+        stored_at = time.time()
+        self._put_memory(key, stored_at, body)
+        if not self.directory:
+            return
+        # write to a temporary file first so that readers never see a partial body
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._trim_directory()
+
+    def _trim_directory(self):
+        # removes the oldest files until the directory fits into max_disk_bytes
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:  # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def _put_memory(self, key: str, stored_at: float, body: bytes):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (stored_at, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
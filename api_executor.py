@@ -0,0 +1,161 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+from flask import abort
+from werkzeug.exceptions import HTTPException
+
+from api_metrics import process_rss_bytes
+from api_util import solve_request
+
+
+class SolverWorkerError(Exception):
+    """ Raised when a worker process dies while solving a request.
+    """
+
+
+def _worker_main(conn, max_jobs: int, max_rss_mb: float):
+    """ Worker process of `SolverPool`: solves requests received through `conn`
+        and sends back (recycle, result) where result is one of
+        ('ok', response body, statistics), ('http_error', code, description)
+        or ('error', message).
+        The worker exits after `max_jobs` requests or once its resident memory is
+        more than `max_rss_mb` megabytes after a request (recycle is True then).
+    """
+    n_jobs = 0
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:  # pool is shutting down
+            return
+        try:
+            body, stats = solve_request(*request)
+            stats['worker_rss_bytes'] = process_rss_bytes()
+            result = ('ok', body, stats)
+        except HTTPException as e:
+            result = ('http_error', e.code, e.description)
+        except Exception as e:
+            result = ('error', repr(e))
+        n_jobs += 1
+        recycle = n_jobs >= max_jobs or process_rss_bytes() > max_rss_mb * 2 ** 20
+        conn.send((recycle, result))
+        if recycle:
+            return
+
+
+class SolverPool:
+    """ Pool of `n_workers` worker processes that build and solve validated requests,
+        so that concurrent requests don't share the interpreter of the API process.
+
+        Workers are forked from a server process that has already imported ortools
+        when the first request comes (not at import time, since worker processes
+        import the main module again), and stay up between requests. A worker is
+        replaced by a fresh one after `max_jobs` requests or once its resident memory
+        is more than `max_rss_mb` megabytes after a request.
+    """
+
+    def __init__(self, n_workers: int, max_jobs: int = 100, max_rss_mb: float = 1024):
+        self.n_workers = n_workers
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._ctx = multiprocessing.get_context('forkserver')
+        self._ctx.set_forkserver_preload(['api_util'])
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._started = False
+        self.n_waiting = 0  # requests waiting for an idle worker
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.n_workers):
+                self._idle.put(self._start_worker())
+            atexit.register(self.shutdown)
+            self._started = True
+
+    @classmethod
+    def from_env(cls):
+        """ Returns None if `SOLVER_POOL_WORKERS` is 0 (solve in the API process).
+        """
+        n_workers = int(os.environ.get('SOLVER_POOL_WORKERS', 0))
+        if n_workers <= 0:
+            return None
+        return cls(n_workers,
+                   max_jobs=int(os.environ.get('SOLVER_POOL_MAX_JOBS', 100)),
+                   max_rss_mb=float(os.environ.get('SOLVER_POOL_MAX_RSS_MB', 1024)))
+
+    def _start_worker(self):
+        conn, child_conn = self._ctx.Pipe()
+        # not a daemon: workers start their own worker processes (e.g. solve_partitioned)
+        process = self._ctx.Process(target=_worker_main,
+                                    args=(child_conn, self.max_jobs, self.max_rss_mb))
+        process.start()
+        child_conn.close()
+        self._workers.add(process)
+        return process, conn
+
+    def _replace_worker(self, process, conn):
+        conn.close()
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+        self._workers.discard(process)
+        self._idle.put(self._start_worker())
+
+    def solve(self, validated, n_days, periods_per_day, single_mode):
+        """ Solves a validated request in the next idle worker (see `solve_request`).
+            Returns the JSON response body and statistics of the search (with RSS
+            of the worker after the search); aborts if the request is invalid.
+        """
+        self.start()
+        with self._lock:
+            self.n_waiting += 1
+        try:
+            process, conn = self._idle.get()
+        finally:
+            with self._lock:
+                self.n_waiting -= 1
+        try:
+            conn.send((validated, n_days, periods_per_day, single_mode))
+            recycle, result = conn.recv()
+        except (EOFError, OSError):
+            self._replace_worker(process, conn)
+            raise SolverWorkerError(f'solver worker {process.pid} died')
+        if recycle:
+            self._replace_worker(process, conn)
+        else:
+            self._idle.put((process, conn))
+
+        if result[0] == 'http_error':
+            abort(result[1], description=result[2])
+        if result[0] == 'error':
+            raise SolverWorkerError(result[1])
+        return result[1], result[2]
+
+    def n_idle(self) -> int:
+        return self._idle.qsize()
+
+    def shutdown(self):
+        while True:
+            try:
+                process, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+            process.join(timeout=5)
+            self._workers.discard(process)
+        for process in self._workers:  # busy workers
+            process.kill()
+        self._workers.clear()
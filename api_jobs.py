@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+from course_sched.course_sched import SchedPartialSolutionSerializer
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class JobSolutionSerializer(SchedPartialSolutionSerializer):
+    """ Serializer that keeps the best objective value (also of solutions added
+        with `add_solution`); the search is stopped with `stop` once the job is
+        cancelled.
+    """
+
+    def on_solution_callback(self):
+        if self.search_stop.is_set() and not self._replay_value:
+            self.StopSearch()  # stopped right before the search started
+        if self._objective is not None:
+            self._objective_kept(round(self.Value(self._objective)))
+        SchedPartialSolutionSerializer.on_solution_callback(self)
+
+
+class Job:
+
+    def __init__(self, callback: JobSolutionSerializer):
+        self.job_id = uuid.uuid4().hex
+        self.callback = callback
+        self.status = QUEUED
+        self.error = None
+        self.stats = None  # statistics of the finished search (see `JobManager.submit`)
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        resp = {'job_id': self.job_id,
+                'status': self.status,
+                'progress': {'n_solutions': self.callback.solutions['n_solutions'],
+                             'best_objective': self.callback.best_objective}}
+        if self.status in (DONE, CANCELLED):
+            resp['result'] = self.callback.solutions
+        if self.stats is not None:
+            resp['stats'] = self.stats
+        if self.error:
+            resp['error'] = self.error
+        return resp
+
+
+class JobManager:
+    """ Runs solver jobs in a pool of `n_workers` threads. At most `max_queued`
+        jobs wait for a worker. Finished jobs are dropped `ttl` seconds after
+        they finish.
+    """
+
+    def __init__(self, n_workers: int = 2, max_queued: int = 32, ttl: float = 3600):
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(n_workers=int(os.environ.get('JOB_WORKERS', 2)),
+                   max_queued=int(os.environ.get('JOB_MAX_QUEUED', 32)),
+                   ttl=float(os.environ.get('JOB_TTL', 3600)))
+
+    def submit(self, solve, callback: JobSolutionSerializer) -> Job:
+        """ Queues `solve(callback)`, which may return statistics of the search
+            (e.g. `api_util.solve_stats`). Returns None if the queue is full.
+        """
+        job = Job(callback)
+        with self._lock:
+            self._expire()
+            n_queued = sum(1 for queued in self._jobs.values() if queued.status == QUEUED)
+            if n_queued >= self.max_queued:
+                return None
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job, solve)
+        return job
+
+    def _run(self, job: Job, solve):
+        with self._lock:
+            if job.status == CANCELLED:  # cancelled while queued
+                return
+            job.status = RUNNING
+        try:
+            job.stats = solve(job.callback)
+            status = CANCELLED if job.callback.search_stop.is_set() else DONE
+        except Exception as e:
+            status = FAILED
+            job.error = str(e)
+        with self._lock:
+            job.status = status
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job:
+        """ Stops the search of a running job; a queued job never runs.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            if job.status == RUNNING:
+                job.callback.stop()
+            return job
+
+    def status_counts(self) -> dict:
+        """ Returns the number of jobs by status.
+        """
+        with self._lock:
+            self._expire()
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, CANCELLED, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
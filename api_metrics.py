@@ -0,0 +1,181 @@
+import os
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+MODEL_SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+SOLUTION_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 999)
+RSS_BUCKETS = tuple(mb * 2 ** 20 for mb in (64, 128, 256, 512, 1024, 2048, 4096))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in
+             list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ Metric with a value per combination of `label_names` values.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels) -> tuple:
+        assert set(labels) == set(self.label_names), labels
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self):
+        """ Yields (name suffix, label values, extra labels, value).
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}',
+                 f'# TYPE {self.name} {self.type}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}'
+                         f'{_format_labels(self.label_names, key, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', key, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), cumulative
+
+
+class Registry:
+    """ In-process registry of metrics rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'sched_http_requests_total', 'HTTP requests by endpoint, method and status code.',
+    ['endpoint', 'method', 'status']))
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'sched_http_request_duration_seconds',
+    'Time until the response starts (streamed bodies are not included).', ['endpoint']))
+MODEL_VARIABLES = REGISTRY.register(Histogram(
+    'sched_model_variables', 'Number of variables of the model of a request.',
+    buckets=MODEL_SIZE_BUCKETS))
+MODEL_CONSTRAINTS = REGISTRY.register(Histogram(
+    'sched_model_constraints', 'Number of constraints of the model of a request.',
+    buckets=MODEL_SIZE_BUCKETS))
+SOLVE_DURATION = REGISTRY.register(Histogram(
+    'sched_solve_duration_seconds', 'Wall time of the search for solutions.'))
+FIRST_SOLUTION_DURATION = REGISTRY.register(Histogram(
+    'sched_first_solution_seconds', 'Wall time until the first solution is found.'))
+SOLUTIONS = REGISTRY.register(Histogram(
+    'sched_solutions_found', 'Number of solutions found for a request.',
+    buckets=SOLUTION_BUCKETS))
+SOLVER_STATUS = REGISTRY.register(Counter(
+    'sched_solver_status_total',
+    'Searches by solver status (UNKNOWN: timed out without a solution).', ['status']))
+JOBS = REGISTRY.register(Gauge(
+    'sched_jobs', 'Asynchronous jobs by status.', ['status']))
+SOLVER_POOL_IDLE_WORKERS = REGISTRY.register(Gauge(
+    'sched_solver_pool_idle_workers', 'Idle solver worker processes.'))
+SOLVER_POOL_WAITING = REGISTRY.register(Gauge(
+    'sched_solver_pool_waiting_requests', 'Requests waiting for a solver worker process.'))
+SOLVER_WORKER_RSS = REGISTRY.register(Histogram(
+    'sched_solver_worker_rss_bytes',
+    'Resident memory of a solver worker process after a request.', buckets=RSS_BUCKETS))
+PROCESS_RSS = REGISTRY.register(Gauge(
+    'sched_process_resident_memory_bytes', 'Resident memory of the API process.'))
+
+
+def observe_solve(stats: dict):
+    """ Records statistics of a solved request (see `api_util.solve_stats`).
+    """
+    MODEL_VARIABLES.observe(stats['n_variables'])
+    MODEL_CONSTRAINTS.observe(stats['n_constraints'])
+    SOLVE_DURATION.observe(stats['solve_seconds'])
+    if stats['first_solution_seconds'] is not None:
+        FIRST_SOLUTION_DURATION.observe(stats['first_solution_seconds'])
+    SOLUTIONS.observe(stats['n_solutions'])
+    SOLVER_STATUS.inc(status=stats['status'])
+    if 'worker_rss_bytes' in stats:
+        SOLVER_WORKER_RSS.observe(stats['worker_rss_bytes'])
+
+
+def process_rss_bytes() -> int:
+    """ Returns current resident memory of this process (0 if unknown).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
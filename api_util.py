@@ -1,7 +1,27 @@
 import os
+import time
+from flask import abort
+from ortools.sat import cp_model_pb2
+from ortools.sat.python import cp_model
 from dotenv import load_dotenv
 load_dotenv()
 
+from course_sched.course_sched import CourseSched, Course, Curriculum, SchedBulkSolutionCollector
+from api_cache import code_version
+
+# env settings that change responses of /sched
+RESULT_SETTINGS = ('PERIODS_PER_DAY', 'DAYS_PER_WEEK', 'SOLVER_SINGLE_MODE',
+                   'SOLVER_SYMMETRY_BREAKING', 'SOLVER_CANONICAL', 'SOLVER_LECTURE_PATTERNS',
+                   'SOLVER_SHARE_COURSE_VARS', 'SOLVER_COMPILE_UNAVAILABILITY',
+                   'SOLVER_OPTIONAL_INTERVALS', 'SOLVER_NUM_WORKERS', 'SOLVER_LNS_TIME',
+                   'SOLVER_TWO_STAGE_TIME', 'SOLVER_COARSE_TO_FINE_TIME',
+                   'SOLVER_SHARED_FIRST_MAX_ITERATIONS', 'API_PARTITION_MIN_N_SOLUTIONS',
+                   'VERSION')
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+CODE_VERSION = code_version([os.path.join(_ROOT, 'api_util.py'),
+                             os.path.join(_ROOT, 'course_sched', 'course_sched.py'),
+                             os.path.join(_ROOT, 'api_schema', 'api_schema.py')])
+
 def course_locks_contains_duplicates(course_locks) -> bool:
     course_lock_ids = {lock['course_id'] for lock in course_locks}
     return len(course_lock_ids) != len(course_locks)
@@ -10,3 +30,192 @@ def course_locks_and_constraints_overlap(course_locks, constraints) -> bool:
     course_lock_ids = {lock['course_id'] for lock in course_locks}
     constraints_course_ids = {constraint['course_id'] for constraint in constraints}
     return not course_lock_ids.isdisjoint(constraints_course_ids)
+
+def result_settings() -> dict:
+    # settings in the cache key of a request (see api_cache.request_key)
+    settings = {name: os.environ.get(name) for name in RESULT_SETTINGS}
+    settings['code_version'] = CODE_VERSION
+    return settings
+
+def build_sched(validated, n_days, periods_per_day):
+    # builds the model of a validated request; aborts if the request is invalid
+    curricula = validated['curricula']
+
+    if 'constraints' in validated:
+        constraints = validated['constraints']
+    else:
+        constraints = []
+
+    if 'course_locks' in validated:
+        course_locks = validated['course_locks']
+    else:
+        course_locks = []
+
+    if course_locks_contains_duplicates(course_locks):
+        abort(400 , description="Bad request ; duplicate courses in course_Locks")
+
+    if course_locks_and_constraints_overlap(course_locks, constraints):
+        abort(400 , description="Bad request ; course specified in both course_locks and constraints")
+
+    L_curriculums = []
+
+    Cuids = set()
+
+    for curr in curricula: # run through the curriculums
+        curriculum_id = curr['curriculum_id']
+        courses = curr['courses']
+        L_courses = []
+
+        Coids = set()
+
+        for cour in courses: # run through the courses 
+            # what happens if courses ids are similar?
+            course_id = cour['course_id']
+            n_periods = cour['n_periods']
+
+            # validation: check for similar course ids
+            if course_id in Coids:
+                abort(400 , description="Bad request ; courses with identical ids in a curriculum")
+            Coids.add(course_id)    
+
+            L_courses.append(Course(course_id ,n_periods))  # calling the Course function in the course_sched class
+
+        # validation: check for similar curriculum ids
+        if curriculum_id in Cuids:
+            abort(400, description="Bad request ; curriculums with identical ids in a curricula")
+        Cuids.add(curriculum_id)
+
+        L_curriculums.append(Curriculum(curriculum_id, L_courses)) # calling the Curriculum function in the course_sched class
+
+    curricula = L_curriculums
+
+    # model encodings (see CourseSched); by default the original model is built,
+    # canonical mode only removes duplicates of its timetables
+    def enabled(name, default="0"):
+        return os.environ.get(name, default) == "1"
+
+    lecture_patterns = enabled("SOLVER_LECTURE_PATTERNS")
+    sched = CourseSched(n_days, periods_per_day, curricula,
+                        canonical=enabled("SOLVER_CANONICAL", "1"),
+                        share_course_vars=enabled("SOLVER_SHARE_COURSE_VARS"),
+                        compile_unavailability=enabled("SOLVER_COMPILE_UNAVAILABILITY"),
+                        optional_intervals=enabled("SOLVER_OPTIONAL_INTERVALS"),
+                        course_locks={course_lock['course_id']: course_lock['locks']
+                                      for course_lock in course_locks})
+    sched.add_no_overlap_constraints()
+    if lecture_patterns:
+        sched.add_lecture_pattern_constraints()
+    else:
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+    sched.add_sync_across_curricula_constraints()
+    if not lecture_patterns:
+        sched.add_lecture_symmetry_constraints()
+
+    D_course_day = {}   # dictionary of course ids as keys and days as values.
+
+    for const in constraints:
+        course_id = const['course_id']
+        day = const['day']
+        intervals = const['intervals']
+        L_intervals = [] 
+
+        for key , value in D_course_day.items():
+            if course_id in D_course_day and value == day:
+                abort(400)
+            D_course_day.update(course_id = day)
+
+        for inter in intervals:
+            start = inter['start']
+            end   = inter['end']
+            L_intervals.append((start, end))
+
+        sched.add_unavailability_constraints(course_id, day, L_intervals)
+
+    # don't return permutations of interchangeable courses
+    if os.environ.get("SOLVER_SYMMETRY_BREAKING", "1") == "1":
+        sched.add_symmetry_breaking_constraints()
+
+    # add some soft constraints
+    sched.add_soft_total_time_constraints(4, 14, 1, 1)
+
+    return sched
+
+def solve_sched(sched, callback, n_solutions, single_mode) -> int:
+    # searches for solutions with the solver that suits the request and returns
+    # solver status; single solution modes other than portfolio take precedence
+    # over the decomposition into independent groups of curricula (they search
+    # the whole model); models that two_stage doesn't solve (e.g. with soft
+    # constraints) are solved like portfolio
+    if n_solutions == 1 and single_mode == "two_stage" and sched.solves_two_stage():
+        return sched.solve_two_stage(callback,
+                                     max_time=int(os.environ.get("SOLVER_TWO_STAGE_TIME", 30)))
+    if n_solutions == 1 and single_mode == "shared_first":
+        return sched.solve_shared_first(callback, max_iterations=int(
+            os.environ.get("SOLVER_SHARED_FIRST_MAX_ITERATIONS", 100)))
+    if n_solutions == 1 and single_mode == "coarse_to_fine":
+        num_search_workers = int(os.environ.get("SOLVER_NUM_WORKERS", 8))
+        return sched.solve_coarse_to_fine(callback,
+                                          max_time=int(os.environ.get("SOLVER_COARSE_TO_FINE_TIME", 30)),
+                                          num_search_workers=num_search_workers)
+    if n_solutions == 1 and single_mode == "lns":
+        num_search_workers = int(os.environ.get("SOLVER_NUM_WORKERS", 8))
+        status, _ = sched.improve_lns(callback,
+                                      max_time=int(os.environ.get("SOLVER_LNS_TIME", 30)),
+                                      num_search_workers=num_search_workers)
+        return status
+    if len(sched.connected_components()) > 1:
+        return sched.solve_decomposed(callback)
+    if n_solutions == 1:
+        num_search_workers = int(os.environ.get("SOLVER_NUM_WORKERS", 8))
+        return sched.solve_single(callback,
+                                  num_search_workers=num_search_workers)
+    if n_solutions >= int(os.environ.get("API_PARTITION_MIN_N_SOLUTIONS", 500)):
+        return sched.solve_partitioned(callback)
+    return sched.solve(callback)
+
+def solver_status(status, callback) -> str:
+    # status name of a search that returned `status` (see solve_sched); UNKNOWN
+    # means that it timed out without a solution
+    if callback.solution_count():
+        name = cp_model_pb2.CpSolverStatus.Name(status)
+        return name if name in ('OPTIMAL', 'FEASIBLE') else 'FEASIBLE'
+    return 'INFEASIBLE' if status == cp_model.INFEASIBLE else 'UNKNOWN'
+
+def solve_stats(sched, callback, started, status) -> dict:
+    # statistics of a search that started at `started` (time.monotonic()) and
+    # returned `status`; `symmetry_classes` are the classes of interchangeable courses
+    # ordered by symmetry breaking, `lns_trace` is [elapsed seconds, objective value]
+    # of every solution accepted by the lns single mode
+    proto = sched.model.Proto()
+    first_solution_at = callback.first_solution_at
+    stats = {'n_variables': len(proto.variables),
+             'n_constraints': len(proto.constraints),
+             'solve_seconds': time.monotonic() - started,
+             'first_solution_seconds': first_solution_at - started
+                                       if first_solution_at is not None else None,
+             'n_solutions': callback.solution_count(),
+             'status': solver_status(status, callback),
+             'symmetry_classes': [list(c_ids) for c_ids in sched.symmetry_classes]}
+    if sched.lns_trace is not None:
+        stats['lns_trace'] = [list(point) for point in sched.lns_trace]
+    return stats
+
+def solve_request(validated, n_days, periods_per_day, single_mode):
+    # solves a validated request; returns the JSON response body of /sched
+    # and statistics of the search (see solve_stats)
+    n_solutions = validated['n_solutions']
+    sched = build_sched(validated, n_days, periods_per_day)
+    # instantiate sched with class CourseSched 
+    solution_printer = SchedBulkSolutionCollector(sched.model_vars,
+                                                  sched.curricula,
+                                                  sched.n_days,
+                                                  sched.n_periods,
+                                                  n_solutions)
+    started = time.monotonic()
+    status = solve_sched(sched, solution_printer, n_solutions, single_mode)
+    stats = solve_stats(sched, solution_printer, started, status)
+    try:
+        return solution_printer.dumps(), stats
+    finally:
+        solution_printer.store.close()
@@ -0,0 +1,107 @@
+import random
+from dataclasses import dataclass, asdict
+
+from course_sched.course_sched import lecture_pattern_catalog
+
+WEEK_N_PERIODS = (4, 6)
+MAX_LECTURE_LEN = {4: 2, 6: 6}  # see `Course`
+
+
+@dataclass
+class InstanceParams:
+    """ Parameters of a synthetic scheduling request (see `generate_request`).
+    """
+    n_curricula: int = 4
+    courses_per_curriculum: int = 6
+    sharing_ratio: float = 0.2  # probability that a course is taken from another curriculum
+    six_period_ratio: float = 0.5  # probability that a new course has 6 periods per week
+    unavailability_density: float = 0.1  # probability that a course-day has an unavailable interval
+    lock_ratio: float = 0.0  # probability that a course is locked
+    n_solutions: int = 100
+    n_days: int = 5
+    n_periods: int = 27
+    seed: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _new_course_id(rng: random.Random) -> str:
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+                   for _ in range(16))
+
+
+def _random_lock(rng: random.Random, n_periods: int, course_curricula, occupied,
+                 params: InstanceParams):
+    """ Returns locks of a course (list of {'day', 'start', 'duration'}) that don't
+        overlap lectures of courses locked before in the same curricula, or None.
+        `occupied`: mapping from (curriculum id, day) to set of occupied periods
+    """
+    patterns = lecture_pattern_catalog(n_periods, MAX_LECTURE_LEN[n_periods],
+                                       params.n_days)
+    for _ in range(20):
+        pattern = rng.choice(patterns)
+        duration = max(pattern)
+        start = rng.randrange(params.n_periods - duration + 1)
+        periods = set(range(start, start + duration))
+        days = [d for d, x in enumerate(pattern) if x]
+        if all(periods.isdisjoint(occupied[cur_id, d])
+               for cur_id in course_curricula for d in days):
+            for cur_id in course_curricula:
+                for d in days:
+                    occupied[cur_id, d] |= periods
+            return [{'day': d, 'start': start, 'duration': duration} for d in days]
+    return None
+
+
+def generate_request(params: InstanceParams) -> dict:
+    """ Returns a `/sched` request (see `api_schema.request_schema`) generated from
+        `params`; the same parameters (including `seed`) give the same request.
+    """
+    rng = random.Random(params.seed)
+    curricula = []
+    courses = {}  # course id -> n_periods
+    course_curricula = {}  # course id -> curriculum ids
+    for cur_idx in range(params.n_curricula):
+        cur_id = f'curriculum{cur_idx}'
+        cur_courses = []
+        for _ in range(params.courses_per_curriculum):
+            shared = [c_id for c_id in courses if c_id not in cur_courses]
+            if shared and rng.random() < params.sharing_ratio:
+                c_id = rng.choice(shared)
+            else:
+                c_id = _new_course_id(rng)
+                courses[c_id] = 6 if rng.random() < params.six_period_ratio else 4
+                course_curricula[c_id] = []
+            cur_courses.append(c_id)
+            course_curricula[c_id].append(cur_id)
+        curricula.append({'curriculum_id': cur_id,
+                          'courses': [{'course_id': c_id, 'n_periods': courses[c_id]}
+                                      for c_id in cur_courses]})
+
+    course_locks = []
+    occupied = {(cur['curriculum_id'], d): set() for cur in curricula
+                for d in range(params.n_days)}
+    for c_id, n_periods in courses.items():
+        if rng.random() < params.lock_ratio:
+            locks = _random_lock(rng, n_periods, course_curricula[c_id], occupied,
+                                 params)
+            if locks:
+                course_locks.append({'course_id': c_id, 'locks': locks})
+
+    constraints = []
+    locked = {lock['course_id'] for lock in course_locks}
+    for c_id in courses:
+        if c_id in locked:
+            continue  # courses can't be both locked and constrained
+        for d in range(params.n_days):
+            if rng.random() < params.unavailability_density:
+                start = rng.randrange(params.n_periods)
+                end = min(params.n_periods - 1, start + rng.randrange(6))
+                constraints.append({'course_id': c_id, 'day': d,
+                                    'intervals': [{'start': start, 'end': end}]})
+
+    return {'n_solutions': params.n_solutions,
+            'curricula': curricula,
+            'constraints': constraints,
+            'course_locks': course_locks}
@@ -0,0 +1,184 @@
+""" Times model construction, constraint families, solve and serialization of
+    synthetic requests (see `generator.py`) and the winter 2020 example.
+
+    python -m benchmark.runner --suite default --out bench_results.json
+    python -m benchmark.runner --suite quick --compare bench_results.json
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from ortools import __version__ as ortools_version
+
+from api_schema.api_schema import request_schema
+from api_util import build_sched, result_settings, solve_sched
+from course_sched.course_sched import CourseSched, SchedBulkSolutionCollector
+from benchmark.generator import InstanceParams, generate_request
+
+WINTER2020 = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'examples', 'winter2020_sched_request.json')
+
+SUITES = {
+    'quick': [InstanceParams(n_curricula=2, courses_per_curriculum=4, n_solutions=10)],
+    'default': (
+        # number of curricula
+        [InstanceParams(n_curricula=n) for n in (2, 4, 8)] +
+        # courses per curriculum
+        [InstanceParams(courses_per_curriculum=n) for n in (4, 8, 10)] +
+        # sharing, period mix, unavailability and locks
+        [InstanceParams(sharing_ratio=x) for x in (0.0, 0.5)] +
+        [InstanceParams(six_period_ratio=x) for x in (0.0, 1.0)] +
+        [InstanceParams(unavailability_density=x) for x in (0.0, 0.5)] +
+        [InstanceParams(lock_ratio=x) for x in (0.2, 0.5)] +
+        # single solution
+        [InstanceParams(n_curricula=8, courses_per_curriculum=8, n_solutions=1)]
+    ),
+}
+
+
+def _timed(timings: dict, name: str, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[name] = timings.get(name, 0) + time.perf_counter() - started
+    return result
+
+
+@contextlib.contextmanager
+def _timed_methods(timings: dict):
+    """ Adds seconds spent in the constructor ('build') and in every `add_*` method
+        of `CourseSched` to `timings` while in the context; calls made from within
+        another timed method count for the outer one only.
+    """
+    names = {'__init__': 'build'}
+    names.update((name, name) for name in vars(CourseSched) if name.startswith('add_'))
+    originals = {name: vars(CourseSched)[name] for name in names}
+    depth = [0]
+
+    def timed(name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if depth[0]:
+                return method(*args, **kwargs)
+            depth[0] += 1
+            try:
+                return _timed(timings, names[name], method, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(CourseSched, name, timed(name, method))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(CourseSched, name, method)
+
+
+def run_request(name: str, request: dict, n_days: int, n_periods: int,
+                single_mode: str = 'portfolio') -> dict:
+    """ Builds and solves `request` with `api_util.build_sched` and `solve_sched`
+        (so with the `SOLVER_*` settings of the environment) and returns seconds
+        spent in every phase.
+    """
+    validated = request_schema.validate(request)
+    timings = {}
+    with _timed_methods(timings):
+        sched = build_sched(validated, n_days, n_periods)
+
+    n_solutions = validated['n_solutions']
+    callback = SchedBulkSolutionCollector(sched.model_vars, sched.curricula,
+                                          sched.n_days, sched.n_periods, n_solutions)
+    _timed(timings, 'solve', solve_sched, sched, callback, n_solutions, single_mode)
+    body = _timed(timings, 'serialize', callback.dumps)
+    callback.store.close()
+
+    proto = sched.model.Proto()
+    return {'name': name,
+            'n_curricula': len(sched.curricula),
+            'n_courses': len(sched.course_to_curricula),
+            'n_variables': len(proto.variables),
+            'n_constraints': len(proto.constraints),
+            'n_solutions': callback.solution_count(),
+            'response_bytes': len(body),
+            'timings': timings}
+
+
+def run_suite(suite: str, single_mode: str = 'portfolio') -> dict:
+    """ Runs every instance of `suite` and the winter 2020 fixture.
+    """
+    results = []
+    for params in SUITES[suite]:
+        name = '-'.join(f'{key}={value}' for key, value in params.to_dict().items()
+                        if value != getattr(InstanceParams, key)) or 'baseline'
+        result = run_request(name, generate_request(params), params.n_days,
+                             params.n_periods, single_mode)
+        result['params'] = params.to_dict()
+        results.append(result)
+    with open(WINTER2020) as f:
+        results.append(run_request('winter2020', json.load(f), 5, 27, single_mode))
+    return {'commit': _git_commit(),
+            'python': platform.python_version(),
+            'ortools': ortools_version,
+            'suite': suite,
+            'single_mode': single_mode,
+            'settings': result_settings(),
+            'results': results}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> str:
+    """ Returns a table of current / baseline time of every phase of instances
+        that are in both results.
+    """
+    baseline_results = {result['name']: result for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        base = baseline_results.get(result['name'])
+        if base is None:
+            continue
+        for phase, seconds in result['timings'].items():
+            if phase in base['timings']:
+                ratio = seconds / base['timings'][phase] if base['timings'][phase] else 0
+                lines.append(f"{result['name']:<40} {phase:<40} "
+                             f"{base['timings'][phase]:9.4f}s {seconds:9.4f}s {ratio:6.2f}x")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', choices=sorted(SUITES), default='default')
+    parser.add_argument('--single-mode', default='portfolio',
+                        help='how single solution instances are solved (see SOLVER_SINGLE_MODE)')
+    parser.add_argument('--out', help='write JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.suite, args.single_mode)
+    out = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out)
+    else:
+        print(out)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
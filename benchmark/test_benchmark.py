@@ -0,0 +1,58 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from api_schema.api_schema import request_schema
+from api_util import build_sched
+from benchmark.generator import InstanceParams, generate_request
+from benchmark.runner import run_request
+from course_sched.course_sched import CourseSched
+
+
+class TestGenerator(unittest.TestCase):
+
+    def test_seeded(self):
+        params = InstanceParams(lock_ratio=0.3, unavailability_density=0.3)
+        self.assertEqual(generate_request(params), generate_request(params))
+        params.seed = 1
+        self.assertNotEqual(generate_request(params), generate_request(InstanceParams()))
+
+    def test_valid_request(self):
+        for params in (InstanceParams(), InstanceParams(lock_ratio=0.5, sharing_ratio=0.5),
+                       InstanceParams(unavailability_density=1.0)):
+            request = generate_request(params)
+            request_schema.validate(request)
+            self.assertEqual(len(request['curricula']), params.n_curricula)
+            locked = {lock['course_id'] for lock in request['course_locks']}
+            constrained = {const['course_id'] for const in request['constraints']}
+            self.assertTrue(locked.isdisjoint(constrained))
+
+    def test_sharing(self):
+        request = generate_request(InstanceParams(sharing_ratio=0.0))
+        course_ids = [course['course_id'] for cur in request['curricula']
+                      for course in cur['courses']]
+        self.assertEqual(len(course_ids), len(set(course_ids)))
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_run_request(self):
+        params = InstanceParams(n_curricula=2, courses_per_curriculum=3, n_solutions=5,
+                                lock_ratio=0.3, unavailability_density=0.3)
+        request = generate_request(params)
+        methods = dict(vars(CourseSched))
+        result = run_request('tiny', request, params.n_days, params.n_periods)
+        self.assertEqual(result['n_solutions'], 5)
+        for phase in ('build', 'add_no_overlap_constraints', 'solve', 'serialize'):
+            self.assertGreaterEqual(result['timings'][phase], 0)
+        self.assertEqual(dict(vars(CourseSched)), methods)  # timed methods are restored
+        # the model of the API
+        proto = build_sched(request_schema.validate(request), params.n_days,
+                            params.n_periods).model.Proto()
+        self.assertEqual(result['n_variables'], len(proto.variables))
+        self.assertEqual(result['n_constraints'], len(proto.constraints))
+
+
+if __name__ == '__main__':
+    unittest.main()
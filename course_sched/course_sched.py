@@ -1,6 +1,18 @@
 import collections
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
-from typing import List, Tuple, NewType, Dict
+import random
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, NewType, Dict, Any, Callable
 from dataclasses import dataclass
 from ortools.sat.python import cp_model
 
@@ -16,6 +28,20 @@ class ModelVar:
     end: cp_model.IntVar
     interval: cp_model.IntervalVar
     duration: cp_model.IntVar
+    present: cp_model.IntVar = None  # true iff the lecture takes place
+    masked_start: cp_model.IntVar = None  # start if present, else n_periods
+
+
+@dataclass
+class SchedSpec:
+    """ Everything that is needed to build an identical `CourseSched`
+        (e.g. in another process). See `CourseSched.spec`.
+    """
+    n_days: int
+    n_periods: int
+    curricula: List['Curriculum']
+    options: Dict[str, Any]                      # keyword args of `CourseSched`
+    calls: List[Tuple[str, Tuple, Dict[str, Any]]]  # recorded method calls
 
 
 class InvalidNumPeriods(Exception):
@@ -64,6 +90,70 @@ class Curriculum:
             self.courses[course._id] = course
 
 
+class SearchStop:
+    """ Stops searches from another thread (e.g. when a job is cancelled).
+
+        Searches of `CourseSched` check the `search_stop` of their callback before
+        they start and register a handler that stops them while they run, also
+        searches of their worker processes (see `_worker_pool`).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._handlers = []
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            handlers = list(self._handlers)
+        for handler in handlers:
+            handler()
+
+    @contextlib.contextmanager
+    def handler(self, handler: Callable[[], None]):
+        """ Calls `handler()` when the stop is set while in the block, or right away
+            if it is already set.
+        """
+        with self._lock:
+            self._handlers.append(handler)
+            is_set = self._event.is_set()
+        if is_set:
+            handler()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._handlers.remove(handler)
+
+    def solve(self, solver: cp_model.CpSolver, model: cp_model.CpModel) -> int:
+        """ Same as `solver.Solve(model)`, but the search is stopped when the stop
+            is set. Returns `cp_model.UNKNOWN` if it was set before the search.
+        """
+        search = _StoppableSearch(self)
+        with self.handler(search.StopSearch):
+            if self.is_set():
+                return cp_model.UNKNOWN
+            return solver.SolveWithSolutionCallback(model, search)
+
+
+class _StoppableSearch(cp_model.CpSolverSolutionCallback):
+    """ Solution callback of `SearchStop.solve`.
+    """
+
+    def __init__(self, search_stop: SearchStop):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self._search_stop = search_stop
+
+    def on_solution_callback(self):
+        # the solver ignores StopSearch calls made right before it starts
+        if self._search_stop.is_set():
+            self.StopSearch()
+
+
 class SolverCallbackUtil(cp_model.CpSolverSolutionCallback):
     """ Solver callback containing methods that are useful for other callbacks.
     """
@@ -78,6 +168,7 @@ class SolverCallbackUtil(cp_model.CpSolverSolutionCallback):
                  n_periods: int,
                  n_solutions: int):
         cp_model.CpSolverSolutionCallback.__init__(self)
+        self.n_solutions = n_solutions
         self._model_vars = model_vars
         self._curricula = curricula
         self._n_days = n_days
@@ -85,6 +176,51 @@ class SolverCallbackUtil(cp_model.CpSolverSolutionCallback):
         self._solutions = set(range(n_solutions))
         self._solution_count = 0
         self._objective = None
+        self._replay_value = None  # set while replaying a solution
+        self.first_solution_at = None  # `time.monotonic()` when the first solution was kept
+        self.best_objective = None  # see `_objective_kept`
+        self.search_stop = SearchStop()  # see `stop`
+
+    def stop(self):
+        """ Stops the search that passes solutions to this callback; it is safe to
+            call it from another thread. Solutions found so far are kept.
+        """
+        self.search_stop.set()
+
+    def _solution_kept(self):
+        if self.first_solution_at is None:
+            self.first_solution_at = time.monotonic()
+
+    def _objective_kept(self, objective: int):
+        """ Keeps the smallest objective value of kept solutions in `best_objective`;
+            `objective` is None if it isn't known.
+        """
+        if objective is not None and (self.best_objective is None or
+                                      objective < self.best_objective):
+            self.best_objective = objective
+
+    def Value(self, expression):
+        if self._replay_value:
+            return self._replay_value(expression)
+        return cp_model.CpSolverSolutionCallback.Value(self, expression)
+
+    def replay(self, value):
+        """ Feeds a solution found without this callback (e.g. by `CpSolver.Solve`)
+            to `on_solution_callback`.
+            `value`: function returning the solution value of a model variable
+        """
+        self._replay_value = value
+        try:
+            self.on_solution_callback()
+        finally:
+            self._replay_value = None
+
+    def is_present(self, model_var: ModelVar) -> bool:
+        """ Returns True if the lecture takes place in the current solution.
+        """
+        if model_var.present is not None:
+            return bool(self.Value(model_var.present))
+        return self.Value(model_var.duration) != 0
 
     def sol_to_str(self):
         out = []
@@ -94,8 +230,11 @@ class SolverCallbackUtil(cp_model.CpSolverSolutionCallback):
                 out.append(f"Curriculum {cur_id}")
                 period_strs = [None] * self._n_periods
                 for c_id in cur.courses.keys():
-                    start = self.Value(self._model_vars[cur_id, d, c_id].start)
-                    end = self.Value(self._model_vars[cur_id, d, c_id].end)
+                    model_var = self._model_vars[cur_id, d, c_id]
+                    if not self.is_present(model_var):
+                        continue
+                    start = self.Value(model_var.start)
+                    end = self.Value(model_var.end)
                     for idx in range(start, end):
                         assert not period_strs[idx]
                         period_strs[idx] = f"Period {idx}: course {c_id}"
@@ -169,15 +308,29 @@ class SchedPartialSolutionSerializer(SolverCallbackUtil):
                               'schedule': []}
                 solution['curricula'][-1]['courses'].append(new_course)
                 for d in range(self._n_days):
-                    start = self.Value(self._model_vars[cur_id, d, c_id].start)
-                    duration = self.Value(
-                        self._model_vars[cur_id, d, c_id].duration)
-                    if duration:
+                    model_var = self._model_vars[cur_id, d, c_id]
+                    if self.is_present(model_var):
+                        start = self.Value(model_var.start)
+                        duration = self.Value(model_var.duration)
                         day_sched = {'day': d,
                                      'start': start,
                                      'duration': duration}
                         solution['curricula'][-1]['courses'][-1]['schedule'].append(
                             day_sched)
+        self._store(solution)
+
+    def add_solution(self, curricula: List[Dict], objective: int = None):
+        """ Adds a solution that was serialized by another serializer
+            (e.g. in another process); `objective` is its objective value if known.
+        """
+        solution = {'solution_id': str(self._solution_count),
+                    'curricula': curricula}
+        self._store(solution)
+        self._objective_kept(objective)
+        self._solution_count += 1
+
+    def _store(self, solution: Dict):
+        self._solution_kept()
         self.solutions["solutions"].append(solution)
         self.solutions["n_solutions"] += 1
 
@@ -189,18 +342,411 @@ class SchedPartialSolutionSerializer(SolverCallbackUtil):
         self._solution_count += 1
 
 
+class _ObjectiveSolutionSerializer(SchedPartialSolutionSerializer):
+    """ Serializer that adds the objective value (None if there is no objective) to
+        every solution under 'objective' (see `CourseSched._serializer`).
+    """
+
+    def _store(self, solution: Dict):
+        if self._objective is not None:
+            solution['objective'] = round(self.Value(self._objective))
+            self._objective_kept(solution['objective'])
+        else:
+            solution['objective'] = None
+        SchedPartialSolutionSerializer._store(self, solution)
+
+
+class SchedSolutionStreamer(SchedPartialSolutionSerializer):
+    """ Serializer that passes every solution to `emit` as soon as it is found
+        instead of keeping it; only the number of solutions is kept in `solutions`.
+    """
+
+    def __init__(self,
+                 model_vars: Dict[Tuple[str,
+                                        int,
+                                        str],
+                                  ModelVar],
+                 curricula: Dict[str,
+                                 Curriculum],
+                 n_days: int,
+                 n_periods: int,
+                 n_solutions: int,
+                 emit: Callable[[Dict], bool]):
+        """ `emit`: function taking a serialized solution; the search is stopped
+                   if it returns False (e.g. the consumer went away)
+        """
+        SchedPartialSolutionSerializer.__init__(
+            self, model_vars, curricula, n_days, n_periods, n_solutions)
+        self._emit = emit
+
+    def _store(self, solution: Dict):
+        self._solution_kept()
+        self.solutions["n_solutions"] += 1
+        if not self._emit(solution):
+            self._solutions.clear()  # skip remaining solutions
+            if not self._replay_value:  # inside a search
+                self.StopSearch()
+
+
+class SolutionStore:
+    """ Columnar store of schedules: a row per solution with start and duration
+        of the lecture of every slot (curriculum id, course id, day) in `slots`;
+        duration 0 means that there is no lecture. Rows are kept in an array of
+        `typecode` (see `array.array`) until it has `spill_bytes` bytes and are
+        moved to a temporary file then. Duplicate rows are not added.
+    """
+
+    def __init__(self, slots: List[Tuple[str, str, int]], typecode: str = 'b',
+                 spill_bytes: int = 64 * 2 ** 20):
+        self.slots = slots
+        self.row_len = 2 * len(slots)
+        self.typecode = typecode
+        self.spill_bytes = spill_bytes
+        self._rows = array(typecode)
+        self._row_bytes = self.row_len * self._rows.itemsize
+        self._n_spilled = 0  # rows in the temporary file
+        self._file = None
+        self._digests = set()
+
+    def __len__(self) -> int:
+        return self._n_spilled + len(self._rows) // self.row_len
+
+    def add(self, row: List[int]) -> bool:
+        """ Adds a row of `row_len` values; returns False if the row is a duplicate.
+        """
+        row = array(self.typecode, row)
+        digest = hashlib.blake2b(row.tobytes(), digest_size=16).digest()
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        self._rows.extend(row)
+        if len(self._rows) * self._rows.itemsize >= self.spill_bytes:
+            self._spill()
+        return True
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, os.SEEK_END)
+        self._rows.tofile(self._file)
+        self._n_spilled += len(self._rows) // self.row_len
+        self._rows = array(self.typecode)
+
+    def __getitem__(self, idx: int) -> array:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('solution index out of range')
+        if idx < self._n_spilled:
+            self._file.seek(idx * self._row_bytes)
+            row = array(self.typecode)
+            row.frombytes(self._file.read(self._row_bytes))
+            return row
+        idx -= self._n_spilled
+        return self._rows[idx * self.row_len:(idx + 1) * self.row_len]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SchedSolutionStoreSerializer(SolverCallbackUtil):
+    """ Serializer that keeps solutions in a `SolutionStore` instead of nested dicts.
+        JSON is only built when it is written (see `dumps`). Solutions with the
+        same schedule as an earlier one are skipped.
+    """
+
+    def __init__(self,
+                 model_vars: Dict[Tuple[str,
+                                        int,
+                                        str],
+                                  ModelVar],
+                 curricula: Dict[str,
+                                 Curriculum],
+                 n_days: int,
+                 n_periods: int,
+                 n_solutions: int,
+                 spill_bytes: int = 64 * 2 ** 20):
+        SolverCallbackUtil.__init__(
+            self, model_vars, curricula, n_days, n_periods, n_solutions)
+        slots = [(cur_id, c_id, d) for cur_id, cur in curricula.items()
+                 for c_id in cur.courses for d in range(n_days)]
+        self.store = SolutionStore(slots, 'b' if n_periods <= 127 else 'h', spill_bytes)
+        self._slot_idx = {slot: idx for idx, slot in enumerate(slots)}
+        # shared model vars are read once per solution
+        unique_vars = {}
+        self._slot_var_idx = [
+            unique_vars.setdefault(id(model_vars[cur_id, d, c_id]),
+                                   (len(unique_vars), model_vars[cur_id, d, c_id]))[0]
+            for cur_id, c_id, d in slots]
+        self._unique_vars = [model_var for _, model_var in unique_vars.values()]
+
+    @property
+    def solutions(self) -> Dict:
+        """ Solutions in the format of `SchedPartialSolutionSerializer.solutions`.
+        """
+        return {'n_solutions': len(self.store),
+                'solutions': list(self.iter_solutions())}
+
+    def on_solution_callback(self):
+        if len(self.store) >= self.n_solutions:
+            self.StopSearch()
+            return
+        values = []
+        for model_var in self._unique_vars:
+            if self.is_present(model_var):
+                values.append((self.Value(model_var.start), self.Value(model_var.duration)))
+            else:
+                values.append((0, 0))
+        row = [x for idx in self._slot_var_idx for x in values[idx]]
+        if self.store.add(row):
+            self._solution_kept()
+            self._solution_count += 1
+
+    def add_solution(self, curricula: List[Dict], objective: int = None):
+        """ Adds a solution that was serialized by another serializer
+            (e.g. in another process); `objective` is its objective value if known.
+        """
+        row = [0] * self.store.row_len
+        for cur in curricula:
+            for course in cur['courses']:
+                for day_sched in course['schedule']:
+                    idx = self._slot_idx[cur['curriculum_id'], course['course_id'],
+                                         day_sched['day']]
+                    row[2 * idx] = day_sched['start']
+                    row[2 * idx + 1] = day_sched['duration']
+        if self.store.add(row):
+            self._solution_kept()
+            self._objective_kept(objective)
+            self._solution_count += 1
+
+    def iter_solutions(self):
+        """ Yields solutions in the format of `SchedPartialSolutionSerializer`.
+        """
+        for sol_idx, row in enumerate(self.store):
+            solution = {'solution_id': str(sol_idx),
+                        'curricula': []}
+            idx = 0
+            for cur_id, cur in self._curricula.items():
+                courses = []
+                solution['curricula'].append({'curriculum_id': cur_id,
+                                              'courses': courses})
+                for c_id in cur.courses.keys():
+                    schedule = []
+                    for d in range(self._n_days):
+                        if row[2 * idx + 1]:
+                            schedule.append({'day': d,
+                                             'start': row[2 * idx],
+                                             'duration': row[2 * idx + 1]})
+                        idx += 1
+                    courses.append({'course_id': c_id, 'schedule': schedule})
+            yield solution
+
+    def dumps(self) -> bytes:
+        """ Returns JSON of `solutions` (compact, with sorted keys like `flask.jsonify`)
+            built one solution at a time.
+        """
+        parts = [json.dumps(solution, sort_keys=True, separators=(',', ':'))
+                 for solution in self.iter_solutions()]
+        return ('{"n_solutions":%d,"solutions":[%s]}\n'
+                % (len(self.store), ','.join(parts))).encode()
+
+
+class SchedBulkSolutionCollector(SchedSolutionStoreSerializer):
+    """ Store serializer that reads the values of a solution with a single call to
+        the solver (`Response`) instead of a `Value` call per variable. Schedules
+        are collected in batches of `batch_size` and moved to the store together.
+        Stops the search after `n_solutions` distinct schedules like
+        `SchedSolutionStoreSerializer`.
+    """
+
+    def __init__(self,
+                 model_vars: Dict[Tuple[str,
+                                        int,
+                                        str],
+                                  ModelVar],
+                 curricula: Dict[str,
+                                 Curriculum],
+                 n_days: int,
+                 n_periods: int,
+                 n_solutions: int,
+                 spill_bytes: int = 64 * 2 ** 20,
+                 batch_size: int = 256):
+        SchedSolutionStoreSerializer.__init__(
+            self, model_vars, curricula, n_days, n_periods, n_solutions, spill_bytes)
+        self.batch_size = batch_size
+        # (present, start, duration) variable indices of every unique model var;
+        # the duration tells if the lecture takes place if there is no present var
+        self._var_indices = [
+            ((model_var.present if model_var.present is not None
+              else model_var.duration).Index(),
+             model_var.start.Index(), model_var.duration.Index())
+            for model_var in self._unique_vars]
+        self._batch = []  # (start, duration) of every unique model var
+        self._digests = set()
+
+    def on_solution_callback(self):
+        if self._replay_value:  # a solution found by `CpSolver.Solve`
+            self._flush()
+            SchedSolutionStoreSerializer.on_solution_callback(self)
+            return
+        if self._solution_count >= self.n_solutions:
+            self.StopSearch()
+            return
+        values = self.Response().solution
+        lectures = array(self.store.typecode)
+        for present, start, duration in self._var_indices:
+            if values[present]:
+                lectures.append(values[start])
+                lectures.append(values[duration])
+            else:
+                lectures.extend((0, 0))
+        digest = hashlib.blake2b(lectures.tobytes(), digest_size=16).digest()
+        if digest in self._digests:
+            return
+        self._digests.add(digest)
+        self._batch.append(lectures)
+        self._solution_kept()
+        self._solution_count += 1
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """ Moves collected schedules to the store.
+        """
+        for lectures in self._batch:
+            if not self.store.add([x for idx in self._slot_var_idx
+                                   for x in lectures[2 * idx:2 * idx + 2]]):
+                self._solution_count -= 1  # added by `add_solution` in the meantime
+        self._batch = []
+
+    @property
+    def solutions(self) -> Dict:
+        self._flush()
+        return SchedSolutionStoreSerializer.solutions.fget(self)
+
+    def add_solution(self, curricula: List[Dict], objective: int = None):
+        self._flush()
+        SchedSolutionStoreSerializer.add_solution(self, curricula, objective)
+
+    def iter_solutions(self):
+        self._flush()
+        return SchedSolutionStoreSerializer.iter_solutions(self)
+
+    def dumps(self) -> bytes:
+        self._flush()
+        return SchedSolutionStoreSerializer.dumps(self)
+
+
 COURSE_GRANULARITY = [2, 3, 6]           # possible course lenghts in periods
 MIN_COURSE_LEN = min(COURSE_GRANULARITY)  # minimum course length in periods
 MAX_COURSE_LEN = max(COURSE_GRANULARITY)  # maximum course length in periods
 
 
+def lecture_pattern_catalog(n_periods: int, max_lecture_len: int,
+                            n_days: int) -> List[Tuple[int, ...]]:
+    """ Returns valid weekly lecture patterns of a course that has `n_periods` periods
+        per week. Each pattern is a tuple of lecture durations for every day of the week.
+
+        A course either has one lecture on any day of the week or several lectures of
+        the same length on alternate days starting on the first or second day
+        of the week (e.g. Mon/Wed/Fri, Mon/Wed or Tue/Thu).
+        All lectures of a course start at the same time.
+    """
+    catalog = []
+    for n_lectures in range(1, n_days + 1):
+        lecture_len, remainder = divmod(n_periods, n_lectures)
+        if remainder or lecture_len not in COURSE_GRANULARITY or \
+                lecture_len > max_lecture_len:
+            continue
+        first_days = range(n_days) if n_lectures == 1 else range(2)
+        for first_day in first_days:
+            days = range(first_day, first_day + 2 * n_lectures, 2)
+            if days[-1] >= n_days:
+                continue
+            catalog.append(tuple(lecture_len if d in days else 0
+                                 for d in range(n_days)))
+    return catalog
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """ Returns sorted list of disjoint intervals that cover the same periods
+        as `intervals`. Overlapping and adjacent intervals are merged.
+
+        Intervals are inclusive, e.g. [(5, 8), (0, 2), (3, 3), (7, 10)] -> [(0, 3), (5, 10)]
+    """
+    merged = []
+    for start, end in sorted(tuple(interval) for interval in intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+_COURSE_CALLS = {'add_unavailability_constraints', 'add_course_lock'}  # take `c_id`
+# constraints solved by `CourseSched.solve_two_stage`
+_TWO_STAGE_CALLS = {'add_no_overlap_constraints', 'add_lecture_pattern_constraints',
+                    'add_sync_across_curricula_constraints'} | _COURSE_CALLS
+
+
+def recorded(method):
+    """ Records calls of a `CourseSched` method that adds constraints to the model,
+        so that the model can be built again from `CourseSched.spec`.
+
+        Calls made from within another recorded method are not recorded.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._recording_depth:
+            self._calls.append((method.__name__, args, kwargs))
+        self._recording_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._recording_depth -= 1
+    return wrapper
+
+
 class CourseSched:
 
     def __init__(self, n_days: int, n_periods: int,
-                 curricula: List[Curriculum]):
+                 curricula: List[Curriculum],
+                 canonical: bool = False,
+                 share_course_vars: bool = False,
+                 compile_unavailability: bool = False,
+                 course_locks: Dict[str, List[Dict]] = None,
+                 optional_intervals: bool = False):
         """ Initializes Course Scheduler.
             `n_days`: number of days per week
             `n_periods`: number of periods per day (1 period is a 30-min block)
+            `canonical`: enumerate every distinct timetable exactly once; lectures
+                         that don't take place get `start == 0` and every auxiliary
+                         boolean variable is fully reified (i.e. it is determined
+                         by the start and duration variables)
+            `share_course_vars`: courses shared across curricula have one set of model
+                                 variables per day that is used by all of their
+                                 curricula (instead of copies kept in sync by
+                                 `add_sync_across_curricula_constraints`)
+            `compile_unavailability`: unavailable intervals of a course are merged and
+                                      compiled into a table of feasible (start, duration)
+                                      placements of each lecture (instead of a NoOverlap
+                                      constraint with fixed intervals per call of
+                                      `add_unavailability_constraints`)
+            `course_locks`: mapping from course id to the list of its lectures
+                            (dicts with `day`, `start` and `duration` keys);
+                            model variables of locked courses are constants and
+                            constraints on them are checked when they are added
+                            (see `add_course_lock` for locks added to the model)
+            `optional_intervals`: lectures are optional intervals with a presence
+                                  literal (`present`) that constraints use instead
+                                  of reifying `duration == 0`; lectures that don't
+                                  take place have `start == end == duration == 0`
             `model`: CP-SAT model
             `model_vars`: mapping from (`course_id`, `day`) tuple to `ModelVar` which contains:
                               * `start` model integer variable (IntVar)
@@ -208,22 +754,121 @@ class CourseSched:
                               * `duration` model integer variable (IntVar)
                               * `interval` model interval variable created from
                                 the three integer variables above (IntervalVar)
+                              * `present` literal that is true iff the lecture takes
+                                place (only in canonical and optional intervals modes)
             `day_to_intervals` - mapping from `day` to list of interval variables for that day.
         """
         self.n_days = n_days             # num of days per week
         self.n_periods = n_periods       # num 30-min periods per day
+        self.canonical = canonical
+        self.share_course_vars = share_course_vars
+        self.compile_unavailability = compile_unavailability
+        self.optional_intervals = optional_intervals
+        self._options = {'canonical': canonical,
+                         'share_course_vars': share_course_vars,
+                         'compile_unavailability': compile_unavailability,
+                         'course_locks': course_locks,
+                         'optional_intervals': optional_intervals}
+        self._calls = []  # see `recorded`
+        self._recording_depth = 0
         self.model = cp_model.CpModel()
         self.model_vars = {}  # defined in _init_model_vars()
         self.cur_day_to_intervals = collections.defaultdict(list)
+        self.pattern_vars = {}  # defined in add_lecture_pattern_constraints()
+        self.day_spans = {}  # defined in _day_span()
+        self.symmetry_classes = []  # defined in add_symmetry_breaking_constraints()
+        # mapping from (`course_id`, `day`) to merged unavailable intervals
+        self.unavailability = collections.defaultdict(list)
+        self._uncompiled_unavailability = set()  # see _compile_unavailability()
         self.course_to_curricula = collections.defaultdict(list)
         self.curricula = {}  # mapping from curriculum id to `Curriculum`
+        # mapping from locked course id to mapping from day to (start, duration)
+        self.course_locks = self._parse_course_locks(course_locks or {})
         self._init_model_vars(curricula)  # initializes model vars
         self.solver = None  # defined in solve()
+        self.lns_trace = None  # defined in improve_lns()
         self.obj_int_vars = []
         self.obj_int_coeffs = []
         self.is_optimization = False  # optimize using soft constraints or search all feasible
         self.obj = None
 
+    def spec(self) -> SchedSpec:
+        """ Returns the specification of this scheduler: constructor arguments and
+            calls of methods that added constraints to the model.
+        """
+        return SchedSpec(n_days=self.n_days,
+                         n_periods=self.n_periods,
+                         curricula=list(self.curricula.values()),
+                         options=dict(self._options),
+                         calls=list(self._calls))
+
+    def connected_components(self) -> List[List[str]]:
+        """ Returns ids of curricula of every connected component of the graph where
+            curricula are connected if they share a course.
+
+            Components are independent subproblems (see `solve_decomposed`).
+        """
+        component_of = {cur_id: cur_id for cur_id in self.curricula}
+
+        def find(cur_id):
+            while component_of[cur_id] != cur_id:
+                cur_id = component_of[cur_id]
+            return cur_id
+
+        for cur_ids in self.course_to_curricula.values():
+            for cur_id in cur_ids[1:]:
+                component_of[find(cur_id)] = find(cur_ids[0])
+        components = collections.defaultdict(list)
+        for cur_id in self.curricula:
+            components[find(cur_id)].append(cur_id)
+        return list(components.values())
+
+    def _sub_spec(self, cur_ids: List[str], c_ids: List[str] = None,
+                  course_locks: Dict[str, List[Dict]] = None) -> SchedSpec:
+        """ Returns the specification of the subproblem of curricula `cur_ids`
+            (e.g. a connected component, see `connected_components`).
+            `c_ids`: if set, curricula only have these courses (curricula without
+                     any of them are left out)
+            `course_locks`: locks of courses in addition to locks of this scheduler
+
+            Calls that add constraints on courses that are not part of the subproblem
+            are left out.
+        """
+        spec = self.spec()
+        curricula = []
+        for cur_id in cur_ids:
+            cur = self.curricula[cur_id]
+            if c_ids is not None:
+                cur = Curriculum(cur_id, [c for c_id, c in cur.courses.items()
+                                          if c_id in c_ids])
+            if cur.courses:
+                curricula.append(cur)
+        sub_c_ids = {c_id for cur in curricula for c_id in cur.courses}
+        options = dict(spec.options)
+        locks = dict(options['course_locks'] or {}, **(course_locks or {}))
+        options['course_locks'] = {c_id: day_locks for c_id, day_locks in locks.items()
+                                   if c_id in sub_c_ids} or None
+        calls = [(name, args, kwargs) for name, args, kwargs in spec.calls
+                 if name not in _COURSE_CALLS or
+                 kwargs.get('c_id', args[0] if args else None) in sub_c_ids]
+        return SchedSpec(n_days=spec.n_days,
+                         n_periods=spec.n_periods,
+                         curricula=curricula,
+                         options=options,
+                         calls=calls)
+
+    @classmethod
+    def from_spec(cls, spec: SchedSpec):
+        """ Builds a scheduler with the same model as the scheduler that returned `spec`.
+
+            Model variables are created in the same order, so they have the same
+            indices in both models.
+        """
+        sched = cls(spec.n_days, spec.n_periods, spec.curricula, **spec.options)
+        for name, args, kwargs in spec.calls:
+            getattr(sched, name)(*args, **kwargs)
+        return sched
+
     def _add_curricula(self, curricula: List[Curriculum]):
         """ Creates mapping from curricula ids to corresponding curricula.
         """
@@ -239,6 +884,55 @@ class CourseSched:
             for c_id, c in cur.courses.items():
                 self.course_to_curricula[c_id].append(cur_id)
 
+    def _parse_course_locks(self, course_locks: Dict[str, List[Dict]]
+                            ) -> Dict[str, Dict[int, Tuple[int, int]]]:
+        """ Returns mapping from day to (start, duration) of every locked course.
+        """
+        parsed = {}
+        for c_id, locks in course_locks.items():
+            day_locks = {}
+            for day_lock in locks:
+                day = day_lock['day']
+                assert day not in day_locks and 0 <= day < self.n_days
+                day_locks[day] = day_lock['start'], day_lock['duration']
+            parsed[c_id] = day_locks
+        return parsed
+
+    def _locked_schedule(self, c_id: str) -> Tuple[List[int], List[int]]:
+        """ Returns lecture durations and starts of a locked course for every day.
+            Start of a lecture that doesn't take place is 0.
+        """
+        day_locks = self.course_locks[c_id]
+        durations = [day_locks.get(d, (0, 0))[1] for d in range(self.n_days)]
+        starts = [day_locks.get(d, (0, 0))[0] for d in range(self.n_days)]
+        return durations, starts
+
+    def _check_lock(self, holds: bool):
+        """ Makes the model infeasible if a constraint doesn't hold for a locked course.
+        """
+        if not holds:
+            self.model.AddBoolOr([])
+
+    def _new_locked_model_var(self, c_id: str, day: int, suffix: str) -> ModelVar:
+        """ Returns model variables of a locked course lecture fixed to constants.
+        """
+        start, duration = self.course_locks[c_id].get(day, (0, 0))
+        self._check_lock(start + duration <= self.n_periods)
+        start_var = self.model.NewIntVar(start, start, 'start' + suffix)
+        end_var = self.model.NewIntVar(start + duration, start + duration,
+                                       'end' + suffix)
+        duration_var = self.model.NewIntVar(duration, duration,
+                                            'duration' + suffix)
+        interval_var = self.model.NewIntervalVar(
+            start_var, duration_var, end_var, 'interval' + suffix)
+        model_var = ModelVar(start=start_var, end=end_var,
+                             interval=interval_var, duration=duration_var)
+        if self.canonical or self.optional_intervals:
+            present = int(duration > 0)
+            model_var.present = self.model.NewIntVar(present, present,
+                                                     'present' + suffix)
+        return model_var
+
     def _init_model_vars(self, curricula: List[Curriculum]):
         """ Initializes model variables and adds them to
             `model_vars` and `day_to_intervals`.
@@ -246,24 +940,124 @@ class CourseSched:
             This method has to be called before any constraint is added to the model.
         """
         self._add_curricula(curricula)
+        for c_id in self.course_locks:
+            assert c_id in self.course_to_curricula  # check that course id exists
         for d in range(self.n_days):
             for cur_id, cur in self.curricula.items():
                 for c_id, c in cur.courses.items():
-                    suffix = f'_cur{cur_id}d{d}c{c_id}'
+                    copy_cur_ids = self._course_copies(c_id)
+                    if cur_id not in copy_cur_ids:  # shared model variables
+                        model_var = self.model_vars[copy_cur_ids[0], d, c_id]
+                        self.model_vars[cur_id, d, c_id] = model_var
+                        self.cur_day_to_intervals[cur_id, d].append(
+                            model_var.interval)
+                        continue
+
+                    if self.share_course_vars:
+                        suffix = f'_d{d}c{c_id}'
+                    else:
+                        suffix = f'_cur{cur_id}d{d}c{c_id}'
+                    if c_id in self.course_locks:
+                        model_var = self._new_locked_model_var(c_id, d, suffix)
+                        self.model_vars[cur_id, d, c_id] = model_var
+                        self.cur_day_to_intervals[cur_id, d].append(
+                            model_var.interval)
+                        continue
                     start_var = self.model.NewIntVar(
                         0, self.n_periods - MIN_COURSE_LEN, 'start' + suffix)
                     end_var = self.model.NewIntVar(0, self.n_periods,
                                                    'end' + suffix)
                     duration_var = self.model.NewIntVar(0, c.max_lecture_len,
                                                         'duration' + suffix)
-                    interval_var = self.model.NewIntervalVar(
-                        start_var, duration_var, end_var, 'interval' + suffix)
+                    if self.optional_intervals:
+                        present_var = self.model.NewBoolVar('present' + suffix)
+                        interval_var = self.model.NewOptionalIntervalVar(
+                            start_var, duration_var, end_var, present_var,
+                            'interval' + suffix)
+                    else:
+                        interval_var = self.model.NewIntervalVar(
+                            start_var, duration_var, end_var, 'interval' + suffix)
                     self.model_vars[cur_id, d, c_id] = ModelVar(start=start_var,
                                                                 end=end_var,
                                                                 interval=interval_var,
                                                                 duration=duration_var)
                     self.cur_day_to_intervals[cur_id, d].append(interval_var)
+                    if self.optional_intervals:
+                        self._add_presence_literal(
+                            self.model_vars[cur_id, d, c_id], suffix, present_var)
+                    elif self.canonical:
+                        self._add_presence_literal(
+                            self.model_vars[cur_id, d, c_id], suffix)
+
+    def _course_copies(self, c_id: str) -> List[str]:
+        """ Returns ids of curricula that have their own copy of model variables
+            of a course.
+        """
+        cur_ids = self.course_to_curricula[c_id]
+        if self.share_course_vars:
+            return cur_ids[:1]
+        return cur_ids
+
+    def _add_presence_literal(self, model_var: ModelVar, suffix: str,
+                              present: cp_model.IntVar = None):
+        """ Adds a literal (`present` or a new one) that is true iff the lecture
+            takes place.
+
+            Lectures that don't take place are pinned to `start == 0`, so that
+            solutions can't differ only in the position of absent lectures.
+            Such lectures never conflict with other intervals since their end is 0
+            (optional intervals don't relate `end` to `start` and `duration` when they
+            are absent, so their `end` is pinned too).
+        """
+        if present is None:
+            present = self.model.NewBoolVar('present' + suffix)
+        else:
+            self.model.Add(model_var.end == 0).OnlyEnforceIf(present.Not())
+        self.model.Add(model_var.duration != 0).OnlyEnforceIf(present)
+        self.model.Add(model_var.duration == 0).OnlyEnforceIf(present.Not())
+        self.model.Add(model_var.start == 0).OnlyEnforceIf(present.Not())
+        model_var.present = present
+
+    def _presence_literal(self, model_var: ModelVar, present: bool, name: str):
+        """ Returns a literal that implies that the lecture takes place (if `present`)
+            or doesn't take place (otherwise).
+
+            This is `present` literal of the lecture (or its negation) if the model
+            has presence literals, otherwise a new literal enforcing `duration != 0`
+            (or `duration == 0`, see `_add_enforced`).
+        """
+        if model_var.present is not None:
+            return model_var.present if present else model_var.present.Not()
+        literal = self.model.NewBoolVar(name)
+        if present:
+            self._add_enforced(model_var.duration != 0, model_var.duration == 0,
+                               literal)
+        else:
+            self._add_enforced(model_var.duration == 0, model_var.duration != 0,
+                               literal)
+        return literal
+
+    def _add_enforced(self, constraint, negation, literal):
+        """ Enforces `constraint` if `literal` is true.
+
+            In canonical mode `negation` is enforced otherwise, so that `literal`
+            has exactly one value in every solution.
+        """
+        self.model.Add(constraint).OnlyEnforceIf(literal)
+        if self.canonical:
+            self.model.Add(negation).OnlyEnforceIf(literal.Not())
+
+    def _add_enforced_bool_and(self, literals: List, literal):
+        """ Enforces conjunction of `literals` if `literal` is true.
+
+            In canonical mode `literal` is the conjunction (see `_add_enforced`).
+        """
+        self.model.AddBoolAnd(literals).OnlyEnforceIf(literal)
+        if self.canonical:
+            self.model.AddBoolOr([lit.Not() for lit in literals]).OnlyEnforceIf(
+                literal.Not())
 
+    @recorded
     def add_no_overlap_constraints(self):
         """ Ensures that courses on the same day do not overlap.
         """
@@ -271,6 +1065,62 @@ class CourseSched:
             for cur_id in self.curricula.keys():
                 self.model.AddNoOverlap(self.cur_day_to_intervals[cur_id, d])
 
+    def interchangeable_courses(self) -> List[List[str]]:
+        """ Returns classes (of at least two courses) of courses that have the same
+            number of periods, belong to the same curricula and have no unavailability
+            constraints or locks. Swapping two courses of a class in a solution gives
+            another solution.
+        """
+        constrained = {c_id for (c_id, _), intervals in self.unavailability.items()
+                       if intervals} | set(self.course_locks)
+        classes = collections.defaultdict(list)
+        seen = set()
+        for cur in self.curricula.values():
+            for c_id, c in cur.courses.items():
+                if c_id in constrained or c_id in seen:
+                    continue
+                seen.add(c_id)
+                key = (c.n_periods, tuple(self.course_to_curricula[c_id]))
+                classes[key].append(c_id)
+        return [c_ids for c_ids in classes.values() if len(c_ids) > 1]
+
+    def _weekly_schedule_key(self, c_id: str, n_days: int) -> cp_model.LinearExpr:
+        """ Returns an expression that orders weekly schedules of a course
+            lexicographically by (duration, start) of its lectures on the first
+            `n_days` days.
+        """
+        cur_id = self.course_to_curricula[c_id][0]
+        day_base = (MAX_COURSE_LEN + 1) * (self.n_periods + 1)
+        terms, coeffs = [], []
+        for d in range(n_days):
+            model_var = self.model_vars[cur_id, d, c_id]
+            day_coeff = day_base ** (n_days - 1 - d)
+            terms += [model_var.duration, model_var.start]
+            coeffs += [day_coeff * (self.n_periods + 1), day_coeff]
+        return cp_model.LinearExpr.ScalProd(terms, coeffs)
+
+    @recorded
+    def add_symmetry_breaking_constraints(self):
+        """ Ensures that weekly schedules of interchangeable courses
+            (see `interchangeable_courses`) are in lexicographic order, so that
+            solutions that only differ by a permutation of such courses are
+            found once. Classes are kept in `symmetry_classes`.
+
+            Must be called after all unavailability constraints and locks are added.
+        """
+        assert self.model_vars  # check that model variables are initialized
+        self.symmetry_classes = self.interchangeable_courses()
+        # compare as many days as the keys fit in 62 bits; ties are allowed
+        day_base = (MAX_COURSE_LEN + 1) * (self.n_periods + 1)
+        n_days = self.n_days
+        while n_days > 1 and day_base ** n_days >= 2 ** 62:
+            n_days -= 1
+        for c_ids in self.symmetry_classes:
+            keys = [self._weekly_schedule_key(c_id, n_days) for c_id in c_ids]
+            for key, next_key in zip(keys, keys[1:]):
+                self.model.Add(key <= next_key)
+
+    @recorded
     def add_sync_across_curricula_constraints(self):
         """ Ensures that courses shared across multiple curricula happen at the same time.
 
@@ -284,12 +1134,23 @@ class CourseSched:
             OR
             # course happens in the same interval in all curricula (conjunction B)
             (A.start == B.start AND A.end == B.end AND B.start == C.start AND B.end == C.end)
+
+            If lectures that don't take place are pinned to zero (canonical and
+            optional intervals modes), this reduces to equal starts and durations.
         """
         assert self.model_vars  # check that model variables are initialized
         prefix = 'sync_across_cur'
-        for c_id, cur_ids in self.course_to_curricula.items():
-            if len(cur_ids) > 1:
+        for c_id in self.course_to_curricula.keys():
+            cur_ids = self._course_copies(c_id)  # nothing to sync if vars are shared
+            if len(cur_ids) > 1 and c_id not in self.course_locks:  # locks are equal
                 for d in range(self.n_days):
+                    if self.canonical or self.optional_intervals:
+                        first = self.model_vars[cur_ids[0], d, c_id]
+                        for cur_id in cur_ids[1:]:
+                            model_var = self.model_vars[cur_id, d, c_id]
+                            self.model.Add(model_var.start == first.start)
+                            self.model.Add(model_var.duration == first.duration)
+                        continue
 
                     conjunction_a = []
                     conjunction_a_bool = self.model.NewBoolVar(
@@ -298,10 +1159,10 @@ class CourseSched:
                         duration = self.model_vars[cur_id, d, c_id].duration
                         bool_a = self.model.NewBoolVar(
                             prefix + f'_a_cur{cur_id}d{d}c{c_id}')
-                        self.model.Add(duration == 0).OnlyEnforceIf(bool_a)
+                        self._add_enforced(duration == 0, duration != 0, bool_a)
                         conjunction_a.append(bool_a)
-                    self.model.AddBoolAnd(conjunction_a).OnlyEnforceIf(
-                        conjunction_a_bool)
+                    self._add_enforced_bool_and(conjunction_a,
+                                                conjunction_a_bool)
 
                     conjunction_b = []
                     conjunction_b_bool = self.model.NewBoolVar(
@@ -315,32 +1176,40 @@ class CourseSched:
                                                      d, c_id].start
                         bool_b_start = self.model.NewBoolVar(
                             prefix + f'_b_start_cur{cur_id}d{d}c{c_id}')
-                        self.model.Add(prev_start == next_start).OnlyEnforceIf(
-                            bool_b_start)
+                        self._add_enforced(prev_start == next_start,
+                                           prev_start != next_start,
+                                           bool_b_start)
                         conjunction_b.append(bool_b_start)
 
                         prev_end = self.model_vars[prev_cur_id, d, c_id].end
                         next_end = self.model_vars[next_cur_id, d, c_id].end
                         bool_b_end = self.model.NewBoolVar(
                             prefix + f'_b_end_cur{cur_id}d{d}c{c_id}')
-                        self.model.Add(
-                            prev_end == next_end).OnlyEnforceIf(bool_b_end)
+                        self._add_enforced(prev_end == next_end,
+                                           prev_end != next_end,
+                                           bool_b_end)
                         conjunction_b.append(bool_b_end)
 
-                    self.model.AddBoolAnd(conjunction_b).OnlyEnforceIf(
-                        conjunction_b_bool)
+                    self._add_enforced_bool_and(conjunction_b,
+                                                conjunction_b_bool)
 
                     self.model.AddBoolOr(
                         [conjunction_a_bool, conjunction_b_bool])
 
+    @recorded
     def add_course_len_constraints(self):
         """ Ensures that each course happens exactly `course.n_periods` periods per week.
         """
         for cur_id, cur in self.curricula.items():
             for c_id, c in cur.courses.items():
+                if c_id in self.course_locks:
+                    durations, _ = self._locked_schedule(c_id)
+                    self._check_lock(sum(durations) == c.n_periods)
+                    continue
                 self.model.Add(sum(self.model_vars[cur_id, d, c_id].duration for d in
                                    range(self.n_days)) == c.n_periods)
 
+    @recorded
     def add_unavailability_constraints(
             self, c_id: str, day: int, intervals: List[Interval]):
         """ Marks certain `intervals` of a particular `day` unavailable for scheduling for a
@@ -349,19 +1218,69 @@ class CourseSched:
             Intervals are inclusive.
         """
         assert c_id in self.course_to_curricula  # check that course id exists
-        interval_vars = []
         for interval in intervals:
             assert len(interval) == 2
-            start, end = interval
+        self.unavailability[c_id, day] = merge_intervals(
+            self.unavailability[c_id, day] + list(intervals))
+        if c_id in self.course_locks:
+            start, duration = self.course_locks[c_id].get(day, (0, 0))
+            end = start + duration - 1
+            self._check_lock(duration == 0 or all(
+                end < b_start or start > b_end for b_start, b_end in intervals))
+            return
+        if self.compile_unavailability:
+            self._uncompiled_unavailability.add((c_id, day))
+            return
+
+        interval_vars = []
+        for start, end in merge_intervals(intervals):  # fixed intervals can't overlap
             suffix = f'_d{day}c{c_id}interval-{start}_{end}'
             interval_var = self.model.NewIntervalVar(
                 start, end - start + 1, end + 1, 'unavail_interval' + suffix)
             interval_vars.append(interval_var)
 
-        for cur_id in self.course_to_curricula[c_id]:
-            interval_vars.append(self.model_vars[cur_id, day, c_id].interval)
+        # copies of a shared course overlap each other, so each gets its own NoOverlap
+        for cur_id in self._course_copies(c_id):
+            self.model.AddNoOverlap(
+                interval_vars + [self.model_vars[cur_id, day, c_id].interval])
+
+    def _feasible_placements(self, c_id: str, day: int) -> List[Tuple[int, int]]:
+        """ Returns all (start, duration) placements of a lecture of a course on a day
+            that don't overlap unavailable intervals of the course.
 
-        self.model.AddNoOverlap(interval_vars)
+            Lectures that don't take place (duration 0) can start at any period.
+        """
+        course = self.curricula[self.course_to_curricula[c_id][0]].courses[c_id]
+        blocked = self.unavailability[c_id, day]
+        starts = range(self.n_periods - MIN_COURSE_LEN + 1)  # domain of start vars
+        placements = [(start, 0) for start in starts]
+        for lecture_len in COURSE_GRANULARITY:
+            if lecture_len > course.max_lecture_len:
+                continue
+            for start in starts:
+                end = start + lecture_len - 1
+                if end < self.n_periods and all(
+                        end < b_start or start > b_end for b_start, b_end in blocked):
+                    placements.append((start, lecture_len))
+        return placements
+
+    def _compile_unavailability(self):
+        """ Restricts lectures of courses with unavailable intervals to their
+            feasible placements (see `compile_unavailability` in `__init__`).
+
+            Called before the search, so that each (course, day) gets one table no
+            matter how many times `add_unavailability_constraints` was called for it.
+        """
+        for c_id, day in sorted(self._uncompiled_unavailability):
+            placements = self._feasible_placements(c_id, day)
+            for cur_id in self._course_copies(c_id):
+                model_var = self.model_vars[cur_id, day, c_id]
+                if all(duration == 0 for _, duration in placements):
+                    self.model.Add(model_var.duration == 0)
+                else:
+                    self.model.AddAllowedAssignments(
+                        [model_var.start, model_var.duration], placements)
+        self._uncompiled_unavailability.clear()
 
     def _invert_interval(self, interval: Interval) -> List[Interval]:
         """ Return all intervals outside of the input interval.
@@ -381,9 +1300,16 @@ class CourseSched:
             intervals.append((end + 1, last_period))
         return intervals
 
+    @recorded
     def add_course_lock(self, c_id: int, locks: List[Dict]):
         """ Ensure that a course is scheduled at a specific time with no exceptions.
+
+            Courses locked in `__init__` only check that `locks` match their schedule.
         """
+        if c_id in self.course_locks:
+            day_locks = self._parse_course_locks({c_id: locks})[c_id]
+            self._check_lock(day_locks == self.course_locks[c_id])
+            return
         days_without_lock = {x for x in range(self.n_days)}
         for day_lock in locks:
             day = day_lock['day']
@@ -396,6 +1322,7 @@ class CourseSched:
             self.add_unavailability_constraints(
                 c_id, day, [(0, self.n_periods - 1)])
 
+    @recorded
     def add_lecture_len_constraints(self):
         """ Ensures that each course takes up consecutive number of periods per day:
               * If a course has 6 periods per week, it can take up 2, 3, 6 periods.
@@ -404,6 +1331,23 @@ class CourseSched:
         for cur_id, cur in self.curricula.items():
             for d in range(self.n_days):
                 for c_id, c in cur.courses.items():
+                    if cur_id not in self._course_copies(c_id):
+                        continue  # shared model variables are already constrained
+                    if c_id in self.course_locks:
+                        duration = self.course_locks[c_id].get(d, (0, 0))[1]
+                        self._check_lock(duration == 0 or (
+                            duration in COURSE_GRANULARITY and
+                            duration <= c.max_lecture_len))
+                        continue
+                    if self.optional_intervals:
+                        model_var = self.model_vars[cur_id, d, c_id]
+                        lecture_lens = [x for x in COURSE_GRANULARITY
+                                        if x <= c.max_lecture_len]
+                        self.model.AddLinearExpressionInDomain(
+                            model_var.duration,
+                            cp_model.Domain.FromValues(lecture_lens)).OnlyEnforceIf(
+                                model_var.present)
+                        continue
 
                     lecture_constraint_disjunction = []
 
@@ -434,6 +1378,7 @@ class CourseSched:
 
                     self.model.AddBoolOr(lecture_constraint_disjunction)
 
+    @recorded
     def add_lecture_symmetry_constraints(self):
         """ Ensures that lectures scheduled on Tuesday are scheduled at the
             same time on Thursday.
@@ -462,8 +1407,11 @@ class CourseSched:
         # Fri
 
         assert self.n_days == 5
-        for c_id, cur_ids in self.course_to_curricula.items():
-            for cur_id in cur_ids:
+        for c_id in self.course_to_curricula.keys():
+            if c_id in self.course_locks:
+                self._check_lock(self._lecture_symmetry_holds(c_id))
+                continue
+            for cur_id in self._course_copies(c_id):
 
                 mon_duration = self.model_vars[cur_id, 0, c_id].duration
                 tue_duration = self.model_vars[cur_id, 1, c_id].duration
@@ -481,79 +1429,87 @@ class CourseSched:
                 # C has one 3-hour lecture
                 mon_lec = self.model.NewBoolVar(
                     prefix + f'_mon_lec_cur{cur_id}c{c_id}')
-                self.model.Add(mon_duration == 6).OnlyEnforceIf(mon_lec)
+                self._add_enforced(mon_duration == 6, mon_duration != 6,
+                                   mon_lec)
                 tue_lec = self.model.NewBoolVar(
                     prefix + f'_tue_lec_cur{cur_id}c{c_id}')
-                self.model.Add(tue_duration == 6).OnlyEnforceIf(tue_lec)
+                self._add_enforced(tue_duration == 6, tue_duration != 6,
+                                   tue_lec)
                 wed_lec = self.model.NewBoolVar(
                     prefix + f'_wed_lec_cur{cur_id}c{c_id}')
-                self.model.Add(wed_duration == 6).OnlyEnforceIf(wed_lec)
+                self._add_enforced(wed_duration == 6, wed_duration != 6,
+                                   wed_lec)
                 thu_lec = self.model.NewBoolVar(
                     prefix + f'_thu_lec_cur{cur_id}c{c_id}')
-                self.model.Add(thu_duration == 6).OnlyEnforceIf(thu_lec)
+                self._add_enforced(thu_duration == 6, thu_duration != 6,
+                                   thu_lec)
                 fri_lec = self.model.NewBoolVar(
                     prefix + f'_fri_lec_cur{cur_id}c{c_id}')
-                self.model.Add(fri_duration == 6).OnlyEnforceIf(fri_lec)
+                self._add_enforced(fri_duration == 6, fri_duration != 6,
+                                   fri_lec)
 
                 # Conjunction A
                 tue_thu_start = self.model.NewBoolVar(
                     prefix + f'_tue_thu_start{cur_id}c{c_id}')
-                self.model.Add(tue_start == thu_start).OnlyEnforceIf(
-                    tue_thu_start)
+                self._add_enforced(tue_start == thu_start,
+                                   tue_start != thu_start,
+                                   tue_thu_start)
                 tue_thu_duration = self.model.NewBoolVar(
                     prefix + f'_tue_thu_duration{cur_id}c{c_id}')
-                self.model.Add(tue_duration == thu_duration).OnlyEnforceIf(
-                    tue_thu_duration)
-                tue_nonzero_duration = self.model.NewBoolVar(
+                self._add_enforced(tue_duration == thu_duration,
+                                   tue_duration != thu_duration,
+                                   tue_thu_duration)
+                tue_nonzero_duration = self._presence_literal(
+                    self.model_vars[cur_id, 1, c_id], True,
                     prefix + f'_tue_nonzero_duration{cur_id}c{c_id}')
-                self.model.Add(tue_duration != 0).OnlyEnforceIf(
-                    tue_nonzero_duration)
                 conjunction_a = self.model.NewBoolVar(
                     prefix + f'_conjunction_a_{cur_id}c{c_id}')
-                self.model.AddBoolAnd([tue_thu_start,
-                                       tue_thu_duration,
-                                       tue_nonzero_duration]).OnlyEnforceIf(conjunction_a)
+                self._add_enforced_bool_and([tue_thu_start,
+                                             tue_thu_duration,
+                                             tue_nonzero_duration], conjunction_a)
 
                 # Conjunction B
                 mon_wed_start = self.model.NewBoolVar(
                     prefix + f'_mon_wed_start{cur_id}c{c_id}')
-                self.model.Add(mon_start == wed_start).OnlyEnforceIf(
-                    mon_wed_start)
+                self._add_enforced(mon_start == wed_start,
+                                   mon_start != wed_start,
+                                   mon_wed_start)
                 mon_wed_duration = self.model.NewBoolVar(
                     prefix + f'_mon_wed_duration{cur_id}c{c_id}')
-                self.model.Add(mon_duration == wed_duration).OnlyEnforceIf(
-                    mon_wed_duration)
+                self._add_enforced(mon_duration == wed_duration,
+                                   mon_duration != wed_duration,
+                                   mon_wed_duration)
                 wed_fri_start = self.model.NewBoolVar(
                     prefix + f'_wed_fri_start{cur_id}c{c_id}')
-                self.model.Add(wed_start == fri_start).OnlyEnforceIf(
-                    wed_fri_start)
+                self._add_enforced(wed_start == fri_start,
+                                   wed_start != fri_start,
+                                   wed_fri_start)
                 wed_fri_duration = self.model.NewBoolVar(
                     prefix + f'_wed_fri_duration{cur_id}c{c_id}')
-                self.model.Add(wed_duration == fri_duration).OnlyEnforceIf(
-                    wed_fri_duration)
-                mon_nonzero_duration = self.model.NewBoolVar(
+                self._add_enforced(wed_duration == fri_duration,
+                                   wed_duration != fri_duration,
+                                   wed_fri_duration)
+                mon_nonzero_duration = self._presence_literal(
+                    self.model_vars[cur_id, 0, c_id], True,
                     prefix + f'_mon_nonzero_duration{cur_id}c{c_id}')
-                self.model.Add(mon_duration != 0).OnlyEnforceIf(
-                    mon_nonzero_duration)
                 conjunction_b = self.model.NewBoolVar(
                     prefix + f'_conjunction_b_{cur_id}c{c_id}')
-                self.model.AddBoolAnd([mon_wed_start,
-                                       mon_wed_duration,
-                                       wed_fri_start,
-                                       wed_fri_duration,
-                                       mon_nonzero_duration]).OnlyEnforceIf(conjunction_b)
+                self._add_enforced_bool_and([mon_wed_start,
+                                             mon_wed_duration,
+                                             wed_fri_start,
+                                             wed_fri_duration,
+                                             mon_nonzero_duration], conjunction_b)
 
                 # Conjunction C
-                fri_zero_duration = self.model.NewBoolVar(
+                fri_zero_duration = self._presence_literal(
+                    self.model_vars[cur_id, 4, c_id], False,
                     prefix + f'_fri_zero_duration{cur_id}c{c_id}')
-                self.model.Add(fri_duration == 0).OnlyEnforceIf(
-                    fri_zero_duration)
                 conjunction_c = self.model.NewBoolVar(
                     prefix + f'_conjunction_c_{cur_id}c{c_id}')
-                self.model.AddBoolAnd([mon_wed_start,
-                                       mon_wed_duration,
-                                       fri_zero_duration,
-                                       mon_nonzero_duration]).OnlyEnforceIf(conjunction_c)
+                self._add_enforced_bool_and([mon_wed_start,
+                                             mon_wed_duration,
+                                             fri_zero_duration,
+                                             mon_nonzero_duration], conjunction_c)
                 # XOR
                 self.model.AddBoolXOr([mon_lec,
                                        tue_lec,
@@ -564,11 +1520,138 @@ class CourseSched:
                                        conjunction_b,
                                        conjunction_c])
 
+    def _lecture_symmetry_holds(self, c_id: str) -> bool:
+        """ Returns True if schedule of a locked course satisfies
+            `add_lecture_symmetry_constraints`.
+        """
+        durations, starts = self._locked_schedule(c_id)
+        mon, tue, wed, thu, fri = durations
+        literals = [duration == 6 for duration in durations]
+        literals.append(starts[1] == starts[3] and tue == thu and tue != 0)
+        literals.append(starts[0] == starts[2] and mon == wed and
+                        starts[2] == starts[4] and wed == fri and mon != 0)
+        literals.append(starts[0] == starts[2] and mon == wed and
+                        fri == 0 and mon != 0)
+        if self.canonical:  # literals are fully reified
+            return sum(literals) % 2 == 1
+        return any(literals)  # literals can be false even if their constraints hold
+
+    @recorded
+    def add_lecture_pattern_constraints(self):
+        """ Ensures that each course is scheduled according to one of its weekly
+            lecture patterns (see `lecture_pattern_catalog`).
+
+            This is a compact alternative to `add_course_len_constraints`,
+            `add_lecture_len_constraints` and `add_lecture_symmetry_constraints`
+            that works for any number of days per week. Each course is modelled as
+            a choice of pattern (element constraints map it to daily durations) and
+            a start time shared by all lectures of the course.
+        """
+        prefix = 'lecture_pattern'
+        for c_id in self.course_to_curricula.keys():
+            for cur_id in self._course_copies(c_id):
+                course = self.curricula[cur_id].courses[c_id]
+                catalog = lecture_pattern_catalog(course.n_periods,
+                                                  course.max_lecture_len,
+                                                  self.n_days)
+                if c_id in self.course_locks:
+                    durations, starts = self._locked_schedule(c_id)
+                    self._check_lock(tuple(durations) in catalog and len(
+                        {start for start, x in zip(starts, durations) if x}) == 1)
+                    break  # all copies have the same schedule
+                if not catalog:  # course can't be scheduled
+                    self.model.AddBoolOr([])
+                    continue
+
+                suffix = f'_cur{cur_id}c{c_id}'
+                pattern = self.model.NewIntVar(0, len(catalog) - 1,
+                                               prefix + '_id' + suffix)
+                start = self.model.NewIntVar(0, self.n_periods - MIN_COURSE_LEN,
+                                             prefix + '_start' + suffix)
+                self.pattern_vars[cur_id, c_id] = pattern
+
+                for d in range(self.n_days):
+                    model_var = self.model_vars[cur_id, d, c_id]
+                    durations = [p[d] for p in catalog]
+                    self.model.AddElement(pattern, durations, model_var.duration)
+                    if all(durations):
+                        self.model.Add(model_var.start == start)
+                    elif any(durations):
+                        present = model_var.present
+                        if present is None:
+                            present = self.model.NewBoolVar(
+                                prefix + f'_present_cur{cur_id}d{d}c{c_id}')
+                            self.model.AddElement(pattern,
+                                                  [int(x > 0) for x in durations],
+                                                  present)
+                        self.model.Add(model_var.start == start).OnlyEnforceIf(
+                            present)
+
+    def _lecture_presence(self, cur_id: str, day: int, c_id: str):
+        """ Returns the presence literal of a lecture (see `ModelVar.present`).
+
+            The literal is created if the model doesn't have presence literals yet;
+            this also pins lectures that don't take place to `start == 0`.
+        """
+        model_var = self.model_vars[cur_id, day, c_id]
+        if model_var.present is None:
+            if cur_id not in self._course_copies(c_id):
+                cur_id = self._course_copies(c_id)[0]
+            self._add_presence_literal(model_var, f'_cur{cur_id}d{day}c{c_id}')
+        return model_var.present
+
+    def _day_span(self, cur_id: str, day: int) -> Tuple:
+        """ Returns (`first_start`, `last_end`, `has_lectures`) variables of the
+            lectures of a curriculum on a day that take place:
+                * `first_start` is the start of the first lecture (`n_periods` if
+                  there are no lectures)
+                * `last_end` is the end of the last lecture (0 if there are no lectures)
+                * `has_lectures` is true iff at least one lecture takes place
+
+            Variables are created once per curriculum and day and shared by
+            soft constraints.
+        """
+        if (cur_id, day) in self.day_spans:
+            return self.day_spans[cur_id, day]
+        suffix = f'_cur{cur_id}d{day}'
+        presents, masked_starts, ends = [], [], []
+        for c_id in self.curricula[cur_id].courses:
+            model_var = self.model_vars[cur_id, day, c_id]
+            present = self._lecture_presence(cur_id, day, c_id)
+            if model_var.masked_start is None:
+                # min equality only takes variables, so absent lectures are masked
+                masked_start = self.model.NewIntVar(
+                    0, self.n_periods, 'masked_start' + suffix + f'c{c_id}')
+                self.model.Add(masked_start == model_var.start).OnlyEnforceIf(present)
+                self.model.Add(masked_start == self.n_periods).OnlyEnforceIf(
+                    present.Not())
+                model_var.masked_start = masked_start
+            presents.append(present)
+            masked_starts.append(model_var.masked_start)
+            ends.append(model_var.end)  # end of absent lectures is 0
+
+        first_start = self.model.NewIntVar(0, self.n_periods, 'first_start' + suffix)
+        self.model.AddMinEquality(first_start, masked_starts)
+        last_end = self.model.NewIntVar(0, self.n_periods, 'last_end' + suffix)
+        self.model.AddMaxEquality(last_end, ends)
+        has_lectures = self.model.NewBoolVar('has_lectures' + suffix)
+        self.model.AddMaxEquality(has_lectures, presents)
+        self.day_spans[cur_id, day] = first_start, last_end, has_lectures
+        return self.day_spans[cur_id, day]
+
+    @recorded
     def add_soft_total_time_constraints(self, soft_min: int,
                                         soft_max: int,
                                         max_cost: int,
                                         min_cost: int):
-
+        """ Add soft constraints on the daily load of each curriculum:
+                * total duration of lectures on a day that has lectures should be
+                  at least `soft_min` periods
+                * time between the start of the first lecture and the end of the last
+                  lecture of a day should be at most `soft_max` periods
+            Each period below `soft_min` costs `min_cost` and each period above
+            `soft_max` costs `max_cost`.
+        """
         assert soft_min >= 0 and soft_max < self.n_periods
         assert max_cost >= 0 and max_cost < self.n_periods
 
@@ -578,70 +1661,47 @@ class CourseSched:
 
         for d in range(self.n_days):
             for cur_id, cur in self.curricula.items():
-
-                intervals_dictionary = {}  # key map of start_of_lecture -> end_of_lecture
-                sum_durations_low = 0
-
-                for c_id, c in cur.courses.items():
-
-                    # calulate sum_durations_low i.e sum of durations of lectures of all courses of a particular curriculum on a particular day
-
-                    lecture_duration = self.model_vars[cur_id,
-                                                       d, c_id].duration
-                    sum_durations_low = sum_durations_low + lecture_duration
-
-                    # calulate sum_durations_high i.e total time (i.e. end of last course - start of first course)
-
-                    start_of_lecture = self.model_vars[cur_id, d, c_id].start
-                    end_of_lecture = self.model_vars[cur_id, d, c_id].end
-                    #interval_of_lecture = self.model_vars[cur_id, d, c_id].interval
-                    if lecture_duration:
-                        intervals_dictionary[start_of_lecture] = end_of_lecture
-
-                    # MOVE OUT OF THE course LOOP
-
-                # penalize if total time of lectures scheduled is too low but if it's zero, that is good so delta should be zero.
-                delta = self.model.NewIntVar(-self.n_periods,
-                                             self.n_periods, '')
-
-                if sum_durations_low == 0:
-                    # delta is negative when sum_durations_low is 0
-                    self.model.Add(delta == sum_durations_low - soft_min)
-                else:
-                    # delta is positive when sum_durations_low is < soft min
-                    self.model.Add(delta == soft_min - sum_durations_low)
-
+                suffix = f'_cur{cur_id}d{d}'
+                first_start, last_end, has_lectures = self._day_span(cur_id, d)
+
+                # penalize if total time of lectures scheduled is too low
+                # but if it's zero, that is good so delta should be zero
+                total_duration = sum(self.model_vars[cur_id, d, c_id].duration
+                                     for c_id in cur.courses)
+                delta = self.model.NewIntVar(-self.n_periods, self.n_periods,
+                                             prefix + '_under_delta' + suffix)
+                self.model.Add(delta == soft_min - total_duration).OnlyEnforceIf(
+                    has_lectures)
+                self.model.Add(delta == 0).OnlyEnforceIf(has_lectures.Not())
                 excess = self.model.NewIntVar(
-                    0, self.n_periods, prefix + '_under_sum')
+                    0, self.n_periods, prefix + '_under_sum' + suffix)
                 self.model.AddMaxEquality(excess, [delta, 0])
                 self.obj_int_vars.append(excess)
                 self.obj_int_coeffs.append(min_cost)
 
-                # penalize if total time(i.e. end of last course - start of first course) is too wide apart
-                delta = self.model.NewIntVar(-self.n_periods,
-                                             self.n_periods, '')
-
-                end_of_last_lecture = max(intervals_dictionary.values())
-                start_of_first_lecture = min(intervals_dictionary.keys())
-                sum_durations_high = end_of_last_lecture - start_of_first_lecture
-
-                # delta is positive when sum_durations_high is > soft max
-                self.model.Add(delta == sum_durations_high - soft_max)
-
+                # penalize if total time (i.e. end of last lecture - start of first
+                # lecture) is too wide apart
+                delta = self.model.NewIntVar(-self.n_periods, self.n_periods,
+                                             prefix + '_over_delta' + suffix)
+                self.model.Add(delta == last_end - first_start - soft_max).OnlyEnforceIf(
+                    has_lectures)
+                self.model.Add(delta == 0).OnlyEnforceIf(has_lectures.Not())
                 excess = self.model.NewIntVar(
-                    0, self.n_periods, prefix + '_over_sum')
+                    0, self.n_periods, prefix + '_over_sum' + suffix)
                 self.model.AddMaxEquality(excess, [delta, 0])
                 self.obj_int_vars.append(excess)
                 self.obj_int_coeffs.append(max_cost)
 
+    @recorded
     def add_soft_start_time_constraints(self, soft_min: int,
                                         soft_max: int,
                                         max_cost: int,
                                         min_cost: int):
         """ Add soft constraints on how early the first class of the day takes place and
             how late the last class finishes.
-            Create delta variables (diff between class start and soft constrain value)
-            and their coefficients.
+            Each period that the first lecture of a curriculum-day starts before `soft_min`
+            costs `min_cost` and each period that the last lecture ends after `soft_max`
+            costs `max_cost`. Lectures that don't take place are not considered.
         """
         assert min_cost >= 0 and min_cost < self.n_periods
         assert max_cost >= 0 and max_cost < self.n_periods
@@ -651,32 +1711,34 @@ class CourseSched:
         prefix = 'soft_start_end'
 
         for d in range(self.n_days):
-            for cur_id, cur in self.curricula.items():
-                for c_id, c in cur.courses.items():
+            for cur_id in self.curricula.keys():
+                suffix = f'_cur{cur_id}d{d}'
+                first_start, last_end, has_lectures = self._day_span(cur_id, d)
+
+                # penalize days that start too early
+                delta = self.model.NewIntVar(-self.n_periods, self.n_periods,
+                                             prefix + '_under_delta' + suffix)
+                # delta is positive when first lecture start time is < soft min
+                self.model.Add(delta == soft_min - first_start).OnlyEnforceIf(
+                    has_lectures)
+                self.model.Add(delta == 0).OnlyEnforceIf(has_lectures.Not())
+                excess = self.model.NewIntVar(
+                    0, self.n_periods, prefix + '_under_sum' + suffix)
+                self.model.AddMaxEquality(excess, [delta, 0])
+                self.obj_int_vars.append(excess)
+                self.obj_int_coeffs.append(min_cost)
 
-                    # penalize lectures that start too early
-                    delta = self.model.NewIntVar(-self.n_periods,
-                                                 self.n_periods, '')
-                    start = self.model_vars[cur_id, d, c_id].start
-                    # delta is positive when lecture start time is < soft min
-                    self.model.Add(delta == soft_min - start)
-                    excess = self.model.NewIntVar(
-                        0, self.n_periods, prefix + '_under_sum')
-                    self.model.AddMaxEquality(excess, [delta, 0])
-                    self.obj_int_vars.append(excess)
-                    self.obj_int_coeffs.append(min_cost)
-
-                    end = self.model_vars[cur_id, d, c_id].end
-                    # penalize lectures that ends too late
-                    delta = self.model.NewIntVar(-self.n_periods,
-                                                 self.n_periods, '')
-                    # delta is positive when lecture end time is > soft max
-                    self.model.Add(delta == end - soft_max)
-                    excess = self.model.NewIntVar(
-                        0, self.n_periods, prefix + '_over_sum')
-                    self.model.AddMaxEquality(excess, [delta, 0])
-                    self.obj_int_vars.append(excess)
-                    self.obj_int_coeffs.append(max_cost)
+                # penalize days that end too late
+                delta = self.model.NewIntVar(-self.n_periods, self.n_periods,
+                                             prefix + '_over_delta' + suffix)
+                # delta is positive when last lecture end time is > soft max
+                # (it's 0 if there are no lectures)
+                self.model.Add(delta == last_end - soft_max)
+                excess = self.model.NewIntVar(
+                    0, self.n_periods, prefix + '_over_sum' + suffix)
+                self.model.AddMaxEquality(excess, [delta, 0])
+                self.obj_int_vars.append(excess)
+                self.obj_int_coeffs.append(max_cost)
 
     def _set_obj(self):
         """ Set objective of the model to minimize the sum of cost vars multiplied by
@@ -695,50 +1757,730 @@ class CourseSched:
         assert self.obj
         self.model.Proto().ClearField('objective')
 
-    def _add_obj_bound_proximity_constraint(self, delta: int):
+    def _add_solution_hint(self, solver: cp_model.CpSolver):
+        """ Hint the values of model variables in the solution found by `solver`.
+        """
+        self.model.Proto().ClearField('solution_hint')
+        for model_var in self._unique_model_vars():
+            for var in (model_var.start, model_var.end, model_var.duration,
+                        model_var.present):
+                if var is not None:
+                    self.model.AddHint(var, solver.Value(var))
+
+    def _add_obj_bound_proximity_constraint(self, delta: int,
+                                            max_time: int = None,
+                                            search_stop: SearchStop = None):
         """ Add a constraint such that all solutions must
             have objective function value that is "close" to
-            the best objective function value (i.e. objective bound).
+            the best objective function value found.
 
-            To achieve this, we first need to find the objective bound.
+            To achieve this, we first search for the best solution using parallel
+            search workers (phase 1). The search is limited to `max_time` seconds.
 
             We then add a constraint such that the value of the model objective
-            is within some delta of the objective bound.
+            is within some delta of the objective value of the best solution (incumbent).
+            The best solution is kept as a solution hint for the search for
+            all solutions (phase 2).
 
+            Returns the objective limit, or None if phase 1 doesn't find any solution
+            (no constraint is added in that case). Phase 1 is stopped by `search_stop`.
         """
-        assert self.solver
+        solver = cp_model.CpSolver()
+        solver.parameters.linearization_level = 0
+        solver.parameters.num_search_workers = 8  # speed up this search
+        if max_time:
+            solver.parameters.max_time_in_seconds = max_time
 
-        # find the objective bound (best solution objective value)
         self._set_obj()  # set model minimization objective
-        self.solver.parameters.num_search_workers = 8  # speed up this search
-        self.solver.Solve(self.model)
-        obj_bound = round(self.solver.BestObjectiveBound()
-                          )  # get objective bound
+        status = (search_stop or SearchStop()).solve(solver, self.model)
         self._unset_obj()  # unset model minimization objective
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return None
 
-        # add objective bound constraint
-        self.model.Add(self.obj <= obj_bound + delta)
+        # add objective proximity constraint and start phase 2 from the incumbent
+        obj_limit = round(solver.ObjectiveValue()) + delta
+        self.model.Add(self.obj <= obj_limit)
+        self._add_solution_hint(solver)
+        return obj_limit
 
     def solve(self, callback: cp_model.CpSolverSolutionCallback,
               max_time: int = None,
-              obj_proximity_delta: int = 0):
+              obj_proximity_delta: int = 0,
+              obj_search_time: int = None):
         """ Create CP model solver and search for solutions for the model.
             `callback`: a class implementing `cp_model.CpSolverSolutionCallback`
             `max_time`: solution search timeout in seconds
             `obj_proximity_delta`: used if this is an optimization problem;
                                    allows to search for all solutions that
                                    have objective value that are within this
-                                   delta of the best possible objective value.
+                                   delta of the best objective value found.
+            `obj_search_time`: used if this is an optimization problem;
+                               timeout in seconds of the search for the best
+                               objective value (not included in `max_time`)
+
+            Returns solver status (`cp_model.OPTIMAL` if all solutions were found).
         """
+        self._compile_unavailability()
         self.solver = cp_model.CpSolver()
         self.solver.parameters.linearization_level = 0
         if max_time:
             self.solver.parameters.max_time_in_seconds = max_time
         if self.is_optimization:
-            self._add_obj_bound_proximity_constraint(obj_proximity_delta)
+            self._add_obj_bound_proximity_constraint(obj_proximity_delta,
+                                                     obj_search_time,
+                                                     callback.search_stop)
             callback.set_objective(self.obj)  # add objective value to callback
         self.solver.parameters.num_search_workers = 1  # search for all can use only 1
-        self.solver.SearchForAllSolutions(self.model, callback)
+        with callback.search_stop.handler(callback.StopSearch):
+            if callback.search_stop.is_set():
+                return cp_model.UNKNOWN
+            return self.solver.SearchForAllSolutions(self.model, callback)
+
+    def solve_single(self, callback: cp_model.CpSolverSolutionCallback,
+                     max_time: int = None,
+                     num_search_workers: int = 8,
+                     first_solution: bool = False):
+        """ Search for a single solution using a portfolio of parallel search workers.
+
+            If this is an optimization problem, the best solution found within `max_time`
+            is returned; otherwise the search stops at the first feasible solution.
+            The solution is passed to `callback` (see `SolverCallbackUtil.replay`).
+            `callback`: a class implementing `SolverCallbackUtil`
+            `max_time`: solution search timeout in seconds
+            `num_search_workers`: number of parallel search workers
+            `first_solution`: stop at the first feasible solution also if this is an
+                              optimization problem
+
+            Returns solver status.
+        """
+        self._compile_unavailability()
+        self.solver = cp_model.CpSolver()
+        self.solver.parameters.linearization_level = 0
+        if max_time:
+            self.solver.parameters.max_time_in_seconds = max_time
+        self.solver.parameters.num_search_workers = num_search_workers
+        self.solver.parameters.stop_after_first_solution = first_solution
+        if self.is_optimization:
+            self._set_obj()
+            callback.set_objective(self.obj)
+        status = callback.search_stop.solve(self.solver, self.model)
+        if self.is_optimization:
+            self._unset_obj()
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            callback.replay(self.solver.Value)
+        return status
+
+    def _unique_model_vars(self) -> List[ModelVar]:
+        """ Returns model variables of every lecture (shared model vars only once).
+        """
+        return list({id(model_var): model_var
+                     for model_var in self.model_vars.values()}.values())
+
+    def _serializer(self, n_solutions: int,
+                    search_stop: SearchStop) -> 'SchedPartialSolutionSerializer':
+        """ Returns a serializer of solutions of this scheduler whose searches are
+            stopped by `search_stop` (e.g. the one of the callback of the caller);
+            solutions carry their objective value (see `add_solution`).
+        """
+        serializer = _ObjectiveSolutionSerializer(self.model_vars,
+                                                  self.curricula,
+                                                  self.n_days,
+                                                  self.n_periods,
+                                                  n_solutions)
+        serializer.search_stop = search_stop
+        return serializer
+
+    def solve_coarse_to_fine(self, callback: SolverCallbackUtil,
+                             max_time: int = None,
+                             window: int = 2,
+                             num_search_workers: int = 8):
+        """ Search for a single solution at hour resolution first (lectures start at
+            even periods), then at period resolution.
+
+            The coarse search stops at its first solution, which is also a solution of
+            the whole model. Lecture durations keep period resolution (3-period
+            lectures don't fit whole hours), so only start domains are coarser.
+            The fine search is hinted with the coarse solution and starts of lectures
+            that take place in the coarse solution are limited to `window` periods
+            around their coarse start. If the fine search doesn't find a solution in
+            time, the coarse solution is passed on; if the coarse search fails, the
+            whole model is searched. The solution is passed to `callback` (see
+            `solve_single`).
+            `callback`: a class implementing `SolverCallbackUtil`
+            `max_time`: solution search timeout in seconds (at most half of it is
+                        used by the coarse search)
+            `window`: maximum distance in periods between coarse and fine start
+            `num_search_workers`: number of parallel search workers
+
+            Returns solver status.
+        """
+        deadline = time.monotonic() + max_time if max_time else None
+
+        def remaining_time():  # `solve_single` has no time limit if it's 0
+            return max(deadline - time.monotonic(), 1e-3) if deadline else None
+
+        # schedulers built from spec have the same variable indices as this one,
+        # so their solutions can be passed to callbacks of this scheduler
+        spec = self.spec()
+        coarse = CourseSched.from_spec(spec)
+        hours = cp_model.Domain.FromValues(list(range(0, self.n_periods, 2)))
+        for model_var in coarse._unique_model_vars():
+            coarse.model.AddLinearExpressionInDomain(model_var.start, hours)
+        status = coarse.solve_single(coarse._serializer(1, callback.search_stop),
+                                     max_time=max_time / 2 if max_time else None,
+                                     num_search_workers=num_search_workers,
+                                     first_solution=True)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return self.solve_single(callback, max_time=remaining_time(),
+                                     num_search_workers=num_search_workers)
+
+        fine = CourseSched.from_spec(spec)
+        fine._add_solution_hint(coarse.solver)
+        for model_var in fine._unique_model_vars():
+            if coarse.solver.Value(model_var.duration):
+                coarse_start = coarse.solver.Value(model_var.start)
+                fine.model.Add(model_var.start >= coarse_start - window)
+                fine.model.Add(model_var.start <= coarse_start + window)
+        status = fine.solve_single(callback, max_time=remaining_time(),
+                                   num_search_workers=num_search_workers)
+        self.solver = fine.solver
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return status
+
+        # the fine model contains the coarse solution, so the fine search timed out
+        callback.replay(coarse.solver.Value)
+        self.solver = coarse.solver
+        return cp_model.FEASIBLE
+
+    def _solution_vars(self) -> List[Tuple[str, ModelVar]]:
+        """ Returns (`course_id`, model variables) of every lecture (shared model vars
+            only once) in the order used by solution vectors (see `improve_lns`).
+        """
+        solution_vars = {}
+        for (_, _, c_id), model_var in self.model_vars.items():
+            solution_vars.setdefault(id(model_var), (c_id, model_var))
+        return list(solution_vars.values())
+
+    def _solution_vector(self, solver: cp_model.CpSolver) -> List[Tuple[int, int]]:
+        """ Returns (start, duration) of every lecture in the solution found by `solver`.
+        """
+        return [(solver.Value(model_var.start), solver.Value(model_var.duration))
+                for _, model_var in self._solution_vars()]
+
+    def _fix_solution(self, solution: List[Tuple[int, int]], free_c_ids=()):
+        """ Fixes lectures of courses that are not in `free_c_ids` to their start and
+            duration in `solution` (see `_solution_vector`); other lectures are hinted.
+        """
+        self.model.Proto().ClearField('solution_hint')
+        for (c_id, model_var), (start, duration) in zip(self._solution_vars(), solution):
+            if c_id in free_c_ids:
+                self.model.AddHint(model_var.start, start)
+                self.model.AddHint(model_var.duration, duration)
+            else:
+                self.model.Add(model_var.start == start)
+                self.model.Add(model_var.duration == duration)
+
+    def improve_lns(self, callback: SolverCallbackUtil,
+                    max_time: int = 30,
+                    initial_time: int = None,
+                    round_time: int = 2,
+                    neighbourhood_size: int = 1,
+                    num_search_workers: int = 8,
+                    max_workers: int = None,
+                    seed: int = 0) -> Tuple[int, List[Tuple[float, int]]]:
+        """ Search for a good solution of an optimization problem using large
+            neighbourhood search.
+
+            Starts from the first solution found by parallel search workers.
+            In every round, worker processes re-optimize different neighbourhoods of the
+            current solution: `neighbourhood_size` random curricula whose courses are
+            free while all other lectures are fixed. The best improvement is accepted.
+            The final solution is passed to `callback` (see `solve_single`).
+            `callback`: a class implementing `SolverCallbackUtil`
+            `max_time`: wall-clock budget in seconds
+            `initial_time`: timeout in seconds of the search for the initial solution
+                            (default is `max_time`)
+            `round_time`: timeout in seconds of a neighbourhood search
+            `neighbourhood_size`: number of curricula freed in a neighbourhood
+            `num_search_workers`: number of parallel search workers of the search for
+                                  the initial solution
+            `max_workers`: number of worker processes (default is number of CPUs)
+            `seed`: seed of the random choice of neighbourhoods
+
+            Returns solver status (`cp_model.OPTIMAL` if the objective value is proven
+            to be the best, e.g. it is 0) and progress of the search: list of (elapsed
+            seconds, objective value) of every accepted solution; empty if no solution
+            was found or this is not an optimization problem. The progress is also kept
+            in `lns_trace`.
+        """
+        started = time.monotonic()
+        deadline = started + max_time
+        self.lns_trace = []
+        if not self.is_optimization:  # nothing to improve
+            return self.solve_single(callback, max_time=max_time,
+                                     num_search_workers=num_search_workers), []
+        self._compile_unavailability()
+        self.solver = cp_model.CpSolver()
+        self.solver.parameters.linearization_level = 0
+        self.solver.parameters.max_time_in_seconds = initial_time or max_time
+        self.solver.parameters.num_search_workers = num_search_workers
+        self.solver.parameters.stop_after_first_solution = True
+        self._set_obj()
+        status = callback.search_stop.solve(self.solver, self.model)
+        self._unset_obj()
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return status, []
+        if status == cp_model.OPTIMAL:
+            callback.set_objective(self.obj)
+            callback.replay(self.solver.Value)
+            self.lns_trace = [(time.monotonic() - started,
+                               round(self.solver.ObjectiveValue()))]
+            return status, self.lns_trace
+
+        solution = self._solution_vector(self.solver)
+        objective = round(self.solver.ObjectiveValue())
+        trace = self.lns_trace = [(time.monotonic() - started, objective)]
+        spec = self.spec()
+        rng = random.Random(seed)
+        cur_ids = list(self.curricula)
+        n_workers = max_workers or os.cpu_count()
+        with _worker_pool(callback.search_stop, n_workers) as pool:
+            while (objective > 0 and time.monotonic() + 1e-3 < deadline and
+                   not callback.search_stop.is_set()):
+                remaining = deadline - time.monotonic()
+                futures = []
+                for _ in range(n_workers):
+                    free_cur_ids = rng.sample(cur_ids, min(neighbourhood_size,
+                                                           len(cur_ids)))
+                    free_c_ids = {c_id for cur_id in free_cur_ids
+                                  for c_id in self.curricula[cur_id].courses}
+                    futures.append(pool.submit(_improve_neighbourhood, spec, solution,
+                                               free_c_ids, min(round_time, remaining)))
+                for future in futures:
+                    improved = future.result()
+                    if improved and improved[0] < objective:
+                        objective, solution = improved
+                if objective < trace[-1][1]:
+                    trace.append((time.monotonic() - started, objective))
+
+        # the best solution is passed on also if the search was stopped; its
+        # lectures are fixed, so only the soft constraint variables are solved
+        final = CourseSched.from_spec(spec)  # same variable indices as this scheduler
+        final._fix_solution(solution)
+        status = final.solve_single(final._serializer(1, SearchStop()),
+                                    max_time=round_time, num_search_workers=1)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return status, trace
+        callback.set_objective(self.obj)
+        callback.replay(final.solver.Value)
+        self.solver = final.solver
+        return (cp_model.OPTIMAL if objective == 0 else cp_model.FEASIBLE), trace
+
+    def _pivot_course_durations(self) -> Tuple[List, List[Tuple[int, ...]]]:
+        """ Returns weekly duration variables of the pivot course (the unlocked course
+            shared by most curricula) and all vectors of its weekly lecture durations that satisfy
+            lecture and course length constraints.
+        """
+        c_id = max(self.course_to_curricula,
+                   key=lambda c_id: (c_id not in self.course_locks,
+                                     len(self.course_to_curricula[c_id])))
+        cur_id = self.course_to_curricula[c_id][0]
+        course = self.curricula[cur_id].courses[c_id]
+        lecture_lens = [0] + [x for x in COURSE_GRANULARITY
+                              if x <= course.max_lecture_len]
+        durations = [self.model_vars[cur_id, d, c_id].duration
+                     for d in range(self.n_days)]
+        vectors = [vector for vector in itertools.product(lecture_lens,
+                                                          repeat=self.n_days)
+                   if sum(vector) == course.n_periods]
+        return durations, vectors
+
+    def _n_cubes(self) -> int:
+        """ Returns the number of cubes of the search space partition (see
+            `_add_cube_constraints`). The last cube is left out if the model only
+            allows weekly lecture durations returned by `_pivot_course_durations`
+            (course and lecture length, or lecture pattern constraints), since it
+            has no solutions then.
+        """
+        calls = {name for name, _, _ in self._calls}
+        covered = ('add_lecture_pattern_constraints' in calls or
+                   {'add_course_len_constraints', 'add_lecture_len_constraints'} <= calls)
+        return len(self._pivot_course_durations()[1]) + (0 if covered else 1)
+
+    def _add_cube_constraints(self, cube: int):
+        """ Restricts the model to one cube of the search space partition.
+
+            Cube `i` fixes weekly lecture durations of the pivot course to the `i`-th
+            vector returned by `_pivot_course_durations`. The last cube
+            (`i == len(vectors)`) contains all the other solutions, so cubes are
+            disjoint and cover the whole search space.
+        """
+        durations, vectors = self._pivot_course_durations()
+        if cube < len(vectors):
+            self.model.AddAllowedAssignments(durations, [vectors[cube]])
+        else:
+            self.model.AddForbiddenAssignments(durations, vectors)
+
+    def solve_partitioned(self, callback: SchedPartialSolutionSerializer,
+                          max_time: int = None,
+                          obj_proximity_delta: int = 0,
+                          obj_search_time: int = None,
+                          max_workers: int = None):
+        """ Search for solutions for the model in parallel.
+
+            The search space is split into disjoint cubes (see `_add_cube_constraints`)
+            and every cube is enumerated in its own worker process. Solutions are
+            merged in the order of cubes, so the result is deterministic, and the
+            number of solutions is capped at `callback.n_solutions`. At most one cube
+            per worker is in progress, and a cube is only asked for the number of
+            solutions that are still missing when it is started.
+            `callback`: serializer that receives merged solutions
+            `max_time`: solution search timeout in seconds (per cube)
+            `obj_proximity_delta`, `obj_search_time`: see `solve`
+            `max_workers`: number of worker processes (default is number of CPUs)
+
+            Returns solver status: `cp_model.OPTIMAL` if all solutions were found,
+            `cp_model.INFEASIBLE` if every cube is infeasible.
+        """
+        self._compile_unavailability()
+        obj_limit = None
+        if self.is_optimization:
+            obj_limit = self._add_obj_bound_proximity_constraint(
+                obj_proximity_delta, obj_search_time, callback.search_stop)
+        spec = self.spec()
+        n_cubes = self._n_cubes()
+        n_workers = max_workers or os.cpu_count()
+        statuses = []
+        with _worker_pool(callback.search_stop, n_workers) as pool:
+            futures = collections.deque()
+            next_cube = 0
+            while True:
+                n_missing = callback.n_solutions - callback.solution_count()
+                while n_missing > 0 and next_cube < n_cubes and len(futures) < n_workers:
+                    futures.append(pool.submit(_enumerate_cube, spec, next_cube, n_missing,
+                                               max_time, obj_limit))
+                    next_cube += 1
+                if n_missing <= 0 or not futures:
+                    break
+                status, solutions = futures.popleft().result()
+                if len(solutions) > n_missing:
+                    status = cp_model.FEASIBLE
+                statuses.append(status)
+                for solution in solutions[:n_missing]:
+                    callback.add_solution(solution['curricula'], solution['objective'])
+            for future in futures:
+                future.cancel()
+            # cubes that were not enumerated
+            statuses += [cp_model.FEASIBLE] * (len(futures) + n_cubes - next_cube)
+
+        if all(status == cp_model.INFEASIBLE for status in statuses):
+            return cp_model.INFEASIBLE
+        if all(status in (cp_model.OPTIMAL, cp_model.INFEASIBLE) for status in statuses):
+            return cp_model.OPTIMAL
+        return cp_model.FEASIBLE if callback.solution_count() else cp_model.UNKNOWN
+
+    def solve_decomposed(self, callback: SchedPartialSolutionSerializer,
+                         max_time: int = None,
+                         obj_proximity_delta: int = 0,
+                         obj_search_time: int = None,
+                         max_workers: int = None):
+        """ Search for solutions for every connected component of curricula
+            (see `connected_components`) in its own worker process.
+
+            Solutions are combinations of component solutions (product of
+            component solutions taken lazily up to `callback.n_solutions`) with
+            curricula in the original order. If this is an optimization problem,
+            objective proximity applies to each component separately.
+            `callback`: serializer that receives combined solutions
+            `max_time`: solution search timeout in seconds (per component)
+            `obj_proximity_delta`, `obj_search_time`: see `solve`
+            `max_workers`: number of worker processes (default is number of CPUs)
+
+            Returns solver status: `cp_model.INFEASIBLE` if any component is
+            infeasible, `cp_model.OPTIMAL` if all solutions of every component were
+            found.
+        """
+        components = self.connected_components()
+        with _worker_pool(callback.search_stop, max_workers) as pool:
+            futures = [pool.submit(_solve_component, self._sub_spec(cur_ids),
+                                   callback.n_solutions, max_time,
+                                   obj_proximity_delta, obj_search_time)
+                       for cur_ids in components]
+            statuses, component_solutions = zip(*(future.result() for future in futures))
+
+        cur_order = {cur_id: i for i, cur_id in enumerate(self.curricula)}
+        combinations = itertools.product(*component_solutions)
+        for combination in itertools.islice(combinations, callback.n_solutions):
+            curricula = [cur for solution in combination for cur in solution['curricula']]
+            curricula.sort(key=lambda cur: cur_order[cur['curriculum_id']])
+            callback.add_solution(curricula, _sum_objectives(combination))
+
+        if cp_model.INFEASIBLE in statuses:
+            return cp_model.INFEASIBLE
+        if not all(status in (cp_model.OPTIMAL, cp_model.FEASIBLE) for status in statuses):
+            return cp_model.UNKNOWN
+        if all(status == cp_model.OPTIMAL for status in statuses):
+            return cp_model.OPTIMAL
+        return cp_model.FEASIBLE
+
+    def _lecture_starts(self, c_id: str, day: int, duration: int) -> List[int]:
+        """ Returns starts of a lecture of a course on a day that has `duration`
+            periods (see `_feasible_placements`).
+        """
+        return [start for start, x in self._feasible_placements(c_id, day)
+                if x == duration]
+
+    def _course_patterns(self, c_id: str) -> List[Tuple[Tuple[int, ...], List[int]]]:
+        """ Returns weekly lecture patterns of a course (see `lecture_pattern_catalog`)
+            that can be placed despite unavailable intervals of the course, with
+            starts that are feasible on every day of the pattern.
+        """
+        course = self.curricula[self.course_to_curricula[c_id][0]].courses[c_id]
+        patterns = []
+        for pattern in lecture_pattern_catalog(course.n_periods,
+                                               course.max_lecture_len,
+                                               self.n_days):
+            starts = None
+            for d, duration in enumerate(pattern):
+                if duration:
+                    day_starts = set(self._lecture_starts(c_id, d, duration))
+                    starts = day_starts if starts is None else starts & day_starts
+            if starts:
+                patterns.append((pattern, sorted(starts)))
+        return patterns
+
+    def solves_two_stage(self) -> bool:
+        """ Returns True if `solve_two_stage` solves the model: it has no soft
+            constraints and only the constraints that it encodes.
+        """
+        return (not self.is_optimization and
+                {name for name, _, _ in self._calls} <= _TWO_STAGE_CALLS)
+
+    def solve_two_stage(self, callback: SolverCallbackUtil,
+                        max_time: int = None,
+                        max_workers: int = None):
+        """ Search for a single solution in two stages:
+                1. choose weekly lecture pattern of every course (see
+                   `lecture_pattern_catalog`) such that lectures of every curriculum
+                   fit into every day
+                2. place lectures within days; days that are not connected by patterns
+                   of stage 1 (e.g. Mon/Wed/Fri and Tue/Thu) are placed in parallel
+                   worker processes
+            If a group of days can't be placed, a no-good (the patterns of a smallest
+            set of courses whose lectures on those days can't be placed together, see
+            `_place_day_group`) is added to stage 1 and the search continues.
+
+            Solves the constraints added by `add_no_overlap_constraints`,
+            `add_lecture_pattern_constraints`, `add_sync_across_curricula_constraints`,
+            `add_unavailability_constraints` and course locks; raises `ValueError` if the
+            model has other constraints or soft constraints (see `solves_two_stage`).
+            The solution is passed to `callback` (see `SolverCallbackUtil.replay`).
+            `callback`: a class implementing `SolverCallbackUtil`
+            `max_time`: solution search timeout in seconds (both stages)
+            `max_workers`: number of stage 2 worker processes (default is number of CPUs)
+
+            Returns `cp_model.FEASIBLE`, `cp_model.INFEASIBLE` or `cp_model.UNKNOWN`
+            (time limit).
+        """
+        if not self.solves_two_stage():
+            raise ValueError('solve_two_stage only solves lecture pattern models '
+                             'without soft constraints')
+        deadline = time.monotonic() + max_time if max_time else None
+
+        # stage 1 model: one literal per course and pattern
+        model = cp_model.CpModel()
+        patterns, pattern_literals = {}, {}
+        for c_id in self.course_to_curricula:
+            if c_id in self.course_locks:
+                durations, starts = self._locked_schedule(c_id)
+                patterns[c_id] = [(tuple(durations), starts)]
+            else:
+                patterns[c_id] = self._course_patterns(c_id)
+            pattern_literals[c_id] = [model.NewBoolVar(f'pattern_c{c_id}p{i}')
+                                      for i in range(len(patterns[c_id]))]
+            model.Add(sum(pattern_literals[c_id]) == 1)
+        for cur in self.curricula.values():
+            for d in range(self.n_days):
+                model.Add(sum(literal * pattern[d] for c_id in cur.courses for
+                              literal, (pattern, _) in zip(pattern_literals[c_id],
+                                                           patterns[c_id]))
+                          <= self.n_periods)
+
+        with _worker_pool(callback.search_stop, max_workers) as pool:
+            while True:
+                solver = cp_model.CpSolver()
+                if deadline:
+                    solver.parameters.max_time_in_seconds = max(
+                        deadline - time.monotonic(), 0)
+                status = callback.search_stop.solve(solver, model)
+                if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                    return status
+                chosen = {c_id: next(i for i, literal in enumerate(literals)
+                                     if solver.BooleanValue(literal))
+                          for c_id, literals in pattern_literals.items()}
+
+                # stage 2: groups of days connected by chosen patterns
+                day_groups = {d: {d} for d in range(self.n_days)}
+                for c_id, i in chosen.items():
+                    days = {d for d, x in enumerate(patterns[c_id][i][0]) if x}
+                    group = set().union(*(day_groups[d] for d in days))
+                    for d in group:
+                        day_groups[d] = group
+                groups = {frozenset(group) for group in day_groups.values()}
+                futures = []
+                for group in sorted(groups, key=min):
+                    # course keys are (`c_id`, None), or (`c_id`, `day`) for lectures
+                    # of locked courses since they may start at different times
+                    courses = {}
+                    for c_id, i in chosen.items():
+                        pattern, starts = patterns[c_id][i]
+                        lectures = [(d, x) for d, x in enumerate(pattern)
+                                    if x and d in group]
+                        if c_id in self.course_locks:
+                            for d, x in lectures:
+                                courses[c_id, d] = [(d, x)], [starts[d]]
+                        elif lectures:
+                            courses[c_id, None] = lectures, starts
+                    cur_day_courses = [
+                        (d, [key for key, (lectures, _) in courses.items()
+                             if key[0] in cur.courses and d in dict(lectures)])
+                        for cur in self.curricula.values() for d in sorted(group)]
+                    remaining = max(deadline - time.monotonic(), 0) if deadline else None
+                    futures.append((courses, pool.submit(
+                        _place_day_group, courses, cur_day_courses, self.n_periods,
+                        remaining)))
+
+                starts, failed = {}, False
+                for courses, future in futures:
+                    status, group_starts, conflict = future.result()
+                    if status == cp_model.INFEASIBLE:
+                        failed = True
+                        c_ids = {c_id for c_id, _ in conflict}
+                        model.AddBoolOr([pattern_literals[c_id][chosen[c_id]].Not()
+                                         for c_id in c_ids
+                                         if c_id not in self.course_locks])
+                    elif status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                        return cp_model.UNKNOWN
+                    else:
+                        starts.update(group_starts)
+                if not failed:
+                    break
+
+        values = {}
+        for (cur_id, d, c_id), model_var in self.model_vars.items():
+            duration = patterns[c_id][chosen[c_id]][0][d]
+            start = 0
+            if duration:
+                start = starts[c_id, d if c_id in self.course_locks else None]
+            for var, value in ((model_var.start, start),
+                               (model_var.end, start + duration),
+                               (model_var.duration, duration),
+                               (model_var.present, int(duration > 0))):
+                if var is not None:
+                    values[var.Index()] = value
+        callback.replay(lambda var: values[var.Index()])
+        return cp_model.FEASIBLE
+
+    def solve_shared_first(self, callback: SchedPartialSolutionSerializer,
+                           max_time: int = None,
+                           max_workers: int = None,
+                           max_iterations: int = 100):
+        """ Search for a single solution by scheduling courses shared across curricula
+            first and then the other (private) courses of every curriculum.
+
+            Curricula are first solved with their private courses only; if one of them
+            can't be solved, the model is infeasible. Shared courses are then scheduled
+            with constraints of their curricula (e.g. no overlap and unavailability).
+            They are locked (see `course_locks` in `__init__`) and every curriculum is
+            solved in its own worker process. If a curriculum can't be solved, the
+            assignment of a smallest set of its shared courses that conflicts with its
+            private courses (see `_solve_curriculum`) is forbidden and shared courses
+            are scheduled again.
+            `callback`: serializer that receives the solution
+            `max_time`: solution search timeout in seconds (whole search)
+            `max_workers`: number of worker processes (default is number of CPUs)
+            `max_iterations`: maximum number of times shared courses are scheduled
+
+            Returns `cp_model.FEASIBLE`, `cp_model.INFEASIBLE` or `cp_model.UNKNOWN`
+            (time or iteration limit).
+        """
+        deadline = time.monotonic() + max_time if max_time else None
+
+        def remaining_time():  # `solve_single` has no time limit if it's 0
+            return max(deadline - time.monotonic(), 1e-3) if deadline else None
+
+        shared_c_ids = [c_id for c_id, cur_ids in self.course_to_curricula.items()
+                        if len(cur_ids) > 1]
+        master = None
+        if shared_c_ids:
+            spec = self._sub_spec(list(self.curricula), shared_c_ids)
+            spec.options['canonical'] = True  # assignments differ iff they are cut
+            master = CourseSched.from_spec(spec)
+
+        with _worker_pool(callback.search_stop, max_workers) as pool:
+            if master:
+                futures = []
+                for cur_id, cur in self.curricula.items():
+                    private_c_ids = [c_id for c_id in cur.courses if c_id not in shared_c_ids]
+                    if private_c_ids:
+                        futures.append(pool.submit(
+                            _solve_curriculum, self._sub_spec([cur_id], private_c_ids),
+                            remaining_time(), first_solution=True))
+                for future in futures:
+                    status = future.result()[0]
+                    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                        return status
+
+            for _ in range(max_iterations):
+                shared_locks = {}
+                if master:
+                    status = master.solve_single(master._serializer(1, callback.search_stop),
+                                                 max_time=remaining_time())
+                    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                        return status
+                    for c_id in shared_c_ids:
+                        cur_id = master.course_to_curricula[c_id][0]
+                        model_vars = [master.model_vars[cur_id, d, c_id]
+                                      for d in range(self.n_days)]
+                        shared_locks[c_id] = [
+                            {'day': d,
+                             'start': master.solver.Value(model_var.start),
+                             'duration': master.solver.Value(model_var.duration)}
+                            for d, model_var in enumerate(model_vars)
+                            if master.solver.Value(model_var.duration)]
+
+                futures = [(cur_id, pool.submit(
+                    _solve_curriculum, self._sub_spec([cur_id], course_locks=shared_locks),
+                    remaining_time(), locked_c_ids=[c_id for c_id in shared_c_ids if
+                                                    c_id in self.curricula[cur_id].courses]))
+                           for cur_id in self.curricula]
+                curricula, cur_solutions, failed = [], [], False
+                for cur_id, future in futures:
+                    status, solutions, conflict = future.result()
+                    if status == cp_model.INFEASIBLE:
+                        if not conflict:  # private courses can't be scheduled
+                            return cp_model.INFEASIBLE
+                        failed = True
+                        cut_vars, cut_values = [], []
+                        for c_id in conflict:
+                            for d in range(self.n_days):
+                                model_var = master.model_vars[cur_id, d, c_id]
+                                cut_vars += [model_var.start, model_var.duration]
+                                cut_values += [master.solver.Value(model_var.start),
+                                               master.solver.Value(model_var.duration)]
+                        master.model.AddForbiddenAssignments(cut_vars, [cut_values])
+                    elif status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                        return cp_model.UNKNOWN
+                    else:
+                        curricula += solutions[0]['curricula']
+                        cur_solutions.append(solutions[0])
+                if not failed:
+                    break
+            else:
+                return cp_model.UNKNOWN
+
+        callback.add_solution(curricula, _sum_objectives(cur_solutions))
+        return cp_model.FEASIBLE
 
     def print_statistics(self, callback: cp_model.CpSolverSolutionCallback):
         """ Print solution statistics.
@@ -749,6 +2491,193 @@ class CourseSched:
         print(f'Optimal solution: {self.solver.ResponseStats()}')
 
 
+_worker_stop = SearchStop()  # stops searches of a worker process (see `_worker_pool`)
+
+
+@contextlib.contextmanager
+def _worker_pool(search_stop: SearchStop, max_workers: int = None):
+    """ Returns a process pool whose workers stop their searches (and skip the
+        searches of tasks that are still queued) once `search_stop` is set.
+        `max_workers`: number of worker processes (default is number of CPUs)
+    """
+    stopped = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(stopped,)) as pool:
+        with search_stop.handler(stopped.set):
+            yield pool
+
+
+def _init_worker(stopped):
+    """ Initializer of worker processes of `_worker_pool`: sets `_worker_stop`
+        when `stopped` (a `multiprocessing.Event`) is set.
+    """
+    global _worker_stop
+    _worker_stop = SearchStop()
+
+    def watch(worker_stop):
+        stopped.wait()
+        worker_stop.set()
+
+    threading.Thread(target=watch, args=(_worker_stop,), daemon=True).start()
+
+
+def _place_day_group(courses: Dict[Tuple, Tuple[List[Tuple[int, int]], List[int]]],
+                     cur_day_courses: List[Tuple[int, List[Tuple]]], n_periods: int,
+                     max_time: float) -> Tuple[int, Dict[Tuple, int], List[Tuple]]:
+    """ Worker process of stage 2 of `CourseSched.solve_two_stage`.
+
+        Places lectures of a group of days: every course (key of `courses`) has
+        lectures (list of (`day`, `duration`)) that start at the same time, which
+        is one of its feasible starts. Lectures of courses of a curriculum on a day
+        (list of (`day`, course keys) `cur_day_courses`) must not overlap.
+        Returns solver status, mapping from course key to its start and, if the
+        lectures can't be placed, a conflict: a smallest set of course keys (no
+        course can be left out) whose lectures can't be placed together.
+    """
+    deadline = time.monotonic() + max_time if max_time is not None else None
+
+    def place(keys):
+        model = cp_model.CpModel()
+        start_vars, intervals = {}, {}
+        for key in keys:
+            lectures, starts = courses[key]
+            start_vars[key] = model.NewIntVarFromDomain(
+                cp_model.Domain.FromValues(starts), f'start_c{key[0]}')
+            for d, duration in lectures:
+                end = model.NewIntVar(0, n_periods, f'end_c{key[0]}d{d}')
+                intervals[key, d] = model.NewIntervalVar(
+                    start_vars[key], duration, end, f'interval_c{key[0]}d{d}')
+        for d, day_keys in cur_day_courses:
+            model.AddNoOverlap([intervals[key, d] for key in day_keys if key in start_vars])
+
+        solver = cp_model.CpSolver()
+        if deadline is not None:
+            solver.parameters.max_time_in_seconds = max(deadline - time.monotonic(), 0)
+        status = _worker_stop.solve(solver, model)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return status, {}
+        return status, {key: solver.Value(var) for key, var in start_vars.items()}
+
+    status, starts = place(list(courses))
+    if status != cp_model.INFEASIBLE:
+        return status, starts, []
+    # deletion filter: leave out courses as long as the rest can't be placed
+    conflict = list(courses)
+    for key in list(conflict):
+        rest = [other for other in conflict if other != key]
+        if place(rest)[0] == cp_model.INFEASIBLE:
+            conflict = rest
+    return status, {}, conflict
+
+
+def _sum_objectives(solutions: List[Dict]) -> int:
+    """ Returns the objective value of a solution combined from `solutions` (soft
+        constraints are per curriculum), or None if one of them has no objective.
+    """
+    objectives = [solution['objective'] for solution in solutions]
+    return None if None in objectives else sum(objectives)
+
+
+def _solve_curriculum(spec: SchedSpec, max_time: float, locked_c_ids=(),
+                      first_solution: bool = False) -> Tuple[int, List[Dict], List[str]]:
+    """ Worker process of `CourseSched.solve_shared_first`.
+
+        Returns solver status, serialized solution of one curriculum and, if it can't
+        be solved, a conflict: a smallest set of `locked_c_ids` (courses locked by
+        the caller) that can't be scheduled together with the other courses (empty
+        if the other courses can't be scheduled on their own).
+        `first_solution`: see `CourseSched.solve_single`
+    """
+    if _worker_stop.is_set():
+        return cp_model.UNKNOWN, [], []
+    deadline = time.monotonic() + max_time if max_time else None
+
+    def solve(sched, first_solution):
+        serializer = sched._serializer(1, _worker_stop)
+        remaining = max(deadline - time.monotonic(), 1e-3) if deadline else None
+        status = sched.solve_single(serializer, max_time=remaining,
+                                    first_solution=first_solution)
+        return status, serializer.solutions['solutions']
+
+    sched = CourseSched.from_spec(spec)
+    status, solutions = solve(sched, first_solution)
+    if status != cp_model.INFEASIBLE or not locked_c_ids:
+        return status, solutions, []
+    # deletion filter: leave out locked courses as long as the rest can't be solved
+    (cur_id, cur), = sched.curricula.items()
+    conflict = list(locked_c_ids)
+    for c_id in list(conflict):
+        c_ids = [other for other in cur.courses
+                 if other != c_id and (other not in locked_c_ids or other in conflict)]
+        sub_sched = CourseSched.from_spec(sched._sub_spec([cur_id], c_ids))
+        if solve(sub_sched, True)[0] == cp_model.INFEASIBLE:
+            conflict.remove(c_id)
+    return status, [], conflict
+
+
+def _improve_neighbourhood(spec: SchedSpec, solution: List[Tuple[int, int]],
+                           free_c_ids, max_time: float) -> Tuple[int, List]:
+    """ Worker process of `CourseSched.improve_lns`.
+
+        Returns objective value and solution vector of the best solution of the
+        neighbourhood where lectures of `free_c_ids` courses are free, or None if
+        no solution was found.
+    """
+    if _worker_stop.is_set():
+        return None
+    sched = CourseSched.from_spec(spec)
+    sched._compile_unavailability()
+    sched._fix_solution(solution, free_c_ids)
+    sched._set_obj()
+    solver = cp_model.CpSolver()
+    solver.parameters.linearization_level = 0
+    solver.parameters.max_time_in_seconds = max_time
+    status = _worker_stop.solve(solver, sched.model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+    return round(solver.ObjectiveValue()), sched._solution_vector(solver)
+
+
+def _solve_component(spec: SchedSpec, n_solutions: int, max_time: int,
+                     obj_proximity_delta: int,
+                     obj_search_time: int) -> Tuple[int, List[Dict]]:
+    """ Worker process of `CourseSched.solve_decomposed`.
+
+        Returns solver status and serialized solutions of one connected component.
+    """
+    if _worker_stop.is_set():
+        return cp_model.UNKNOWN, []
+    sched = CourseSched.from_spec(spec)
+    serializer = sched._serializer(n_solutions, _worker_stop)
+    if n_solutions == 1:
+        status = sched.solve_single(serializer, max_time=max_time)
+    else:
+        status = sched.solve(serializer, max_time=max_time,
+                             obj_proximity_delta=obj_proximity_delta,
+                             obj_search_time=obj_search_time)
+    return status, serializer.solutions['solutions']
+
+
+def _enumerate_cube(spec: SchedSpec, cube: int, n_solutions: int,
+                    max_time: int, obj_limit: int) -> Tuple[int, List[Dict]]:
+    """ Worker process of `CourseSched.solve_partitioned`.
+
+        Returns solver status and serialized solutions of one cube of the search space.
+    """
+    if _worker_stop.is_set():
+        return cp_model.UNKNOWN, []
+    sched = CourseSched.from_spec(spec)
+    sched._add_cube_constraints(cube)
+    serializer = sched._serializer(n_solutions, _worker_stop)
+    if obj_limit is not None:
+        obj = cp_model.LinearExpr.ScalProd(sched.obj_int_vars, sched.obj_int_coeffs)
+        sched.model.Add(obj <= obj_limit)
+        sched.is_optimization = False  # objective limit is already known
+        serializer.set_objective(obj)
+    status = sched.solve(serializer, max_time=max_time)
+    return status, serializer.solutions['solutions']
+
+
 def main():
 
     n_periods = 27  # real day has os.getenv("PERIODS_PER_DAY") periods
@@ -1,17 +1,31 @@
 import unittest
+from typing import Dict, List, Tuple
 from course_sched import (
     CourseSched,
     COURSE_GRANULARITY,
     Course,
     Curriculum,
     SolverCallbackUtil,
-    SchedPartialSolutionSerializer
+    SchedPartialSolutionSerializer,
+    SchedSolutionStreamer,
+    SchedSolutionStoreSerializer,
+    SchedBulkSolutionCollector,
+    SolutionStore,
+    lecture_pattern_catalog,
+    merge_intervals,
+    _place_day_group
 )
 import os
 import sys
+import json
+import functools
+import threading
+import time
+from unittest import mock
 from schema import SchemaError
 sys.path.append(os.path.abspath('./api_schema'))
 from api_schema import response_schema
+from ortools.sat.python import cp_model
 
 N_SOL_PER_TEST = 100
 
@@ -321,12 +335,14 @@ class TestSoftTotalTimeConstraintCallback(SolverCallbackUtil):
                         self.success = False
                         self.StopSearch()
 
+                    if not intervals_dictionary:  # no lectures on this day
+                        continue
                     end_of_last_lecture = max(intervals_dictionary.values())
                     start_of_first_lecture = min(intervals_dictionary.keys())
                     sum_durations_high = end_of_last_lecture - start_of_first_lecture
 
-                    if sum_durations_high >= self.soft_max:
-                        self.msg = "courses of a particular curriculum on a particular day are scheduled 7 periods or more apart"
+                    if sum_durations_high > self.soft_max:
+                        self.msg = f"courses of a particular curriculum on a particular day are scheduled more than {self.soft_max} periods apart"
                         self.success = False
                         self.StopSearch()
 
@@ -371,6 +387,122 @@ class TestSoftStartTimeConstraints(SolverCallbackUtil):
         self._solution_count += 1
 
 
+class TestObjectiveCallback(SolverCallbackUtil):
+
+    def __init__(self, model_vars, curricula, n_days, n_periods, n_solutions):
+        SolverCallbackUtil.__init__(
+            self, model_vars, curricula, n_days, n_periods, n_solutions)
+        self.objective_values = []
+        self._solution_count = 0
+
+    def on_solution_callback(self):
+        if self._solution_count in self._solutions:
+            self.objective_values.append(self.Value(self._objective))
+        else:
+            self.StopSearch()
+        self._solution_count += 1
+
+
+class TestDayCostCallback(SolverCallbackUtil):
+
+    def __init__(self, model_vars, curricula, n_days, n_periods,
+                 day_cost, n_solutions):
+        SolverCallbackUtil.__init__(
+            self, model_vars, curricula, n_days, n_periods, n_solutions)
+        self.day_cost = day_cost  # cost of (start, end, duration) of lectures on a day
+        self.costs = []  # (objective value, expected cost) per solution
+        self._solution_count = 0
+
+    def on_solution_callback(self):
+        if self._solution_count in self._solutions:
+            cost = 0
+            for d in range(self._n_days):
+                for cur_id, cur in self._curricula.items():
+                    lectures = [(self.Value(model_var.start), self.Value(model_var.end),
+                                 self.Value(model_var.duration))
+                                for model_var in (self._model_vars[cur_id, d, c_id]
+                                                  for c_id in cur.courses)
+                                if self.is_present(model_var)]
+                    if lectures:
+                        cost += self.day_cost(lectures)
+            self.costs.append((self.Value(self._objective), cost))
+        else:
+            self.StopSearch()
+        self._solution_count += 1
+
+
+def serializer(sched: CourseSched, n_solutions: int) -> SchedPartialSolutionSerializer:
+    return SchedPartialSolutionSerializer(sched.model_vars,
+                                          sched.curricula,
+                                          sched.n_days,
+                                          sched.n_periods,
+                                          n_solutions)
+
+
+def timetables(sched: CourseSched, n_solutions: int = 10 ** 6,
+               solve=CourseSched.solve, **kwargs) -> List[str]:
+    """ Returns curricula of solutions found by `solve(sched, serializer, **kwargs)`
+        as JSON strings in the order they were found.
+    """
+    callback = serializer(sched, n_solutions)
+    solve(sched, callback, **kwargs)
+    solutions = callback.solutions
+    assert solutions['n_solutions'] == len(solutions['solutions'])
+    return [json.dumps(sol['curricula'], sort_keys=True) for sol in solutions['solutions']]
+
+
+def is_solution(sched: CourseSched, timetable: str) -> bool:
+    """ Returns True if a timetable (see `timetables`) is a solution of the model of
+        `sched`; lectures of `sched` are fixed to the timetable.
+    """
+    for cur in json.loads(timetable):
+        for course in cur['courses']:
+            lectures = {x['day']: x for x in course['schedule']}
+            for d in range(sched.n_days):
+                model_var = sched.model_vars[cur['curriculum_id'], d, course['course_id']]
+                lecture = lectures.get(d, {'start': 0, 'duration': 0})
+                sched.model.Add(model_var.start == lecture['start'])
+                sched.model.Add(model_var.duration == lecture['duration'])
+    return len(timetables(sched, 1, CourseSched.solve_single, num_search_workers=1)) == 1
+
+
+def build_sched(curricula: List[Dict[str, int]], n_days: int, n_periods: int,
+                lecture_patterns: bool = True, lecture_symmetry: bool = True,
+                unavailability: List[Tuple[str, int, List[Tuple[int, int]]]] = (),
+                canonical: bool = True, **kwargs) -> CourseSched:
+    """ Returns a scheduler of curricula '0', '1', ... with courses `curricula`
+        (number of periods by course id) and the hard constraints of the API:
+        no overlaps, lecture patterns (or course length, lecture length and, if
+        `lecture_symmetry`, lecture symmetry constraints), sync across curricula and
+        `unavailability` (course id, day, intervals). `kwargs` are passed to
+        `CourseSched`.
+    """
+    sched = CourseSched(n_days, n_periods,
+                        [Curriculum(str(i), [Course(c_id, n) for c_id, n in courses.items()])
+                         for i, courses in enumerate(curricula)],
+                        canonical=canonical, **kwargs)
+    sched.add_no_overlap_constraints()
+    if lecture_patterns:
+        sched.add_lecture_pattern_constraints()
+    else:
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+    sched.add_sync_across_curricula_constraints()
+    if not lecture_patterns and lecture_symmetry:
+        sched.add_lecture_symmetry_constraints()
+    for c_id, day, intervals in unavailability:
+        sched.add_unavailability_constraints(c_id, day, intervals)
+    return sched
+
+
+def start_at_0(c_ids: List[str], n_days: int,
+               n_periods: int) -> List[Tuple[str, int, List[Tuple[int, int]]]]:
+    """ Returns unavailability (see `build_sched`) that allows courses `c_ids`
+        to start only at period 0 (lectures are at least 2 periods long).
+    """
+    return [(c_id, d, [(2, n_periods - 1)]) for c_id in c_ids for d in range(n_days)]
+
+
 class TestCourseSched(unittest.TestCase):
 
     def test_sched_periods_sum(self):
@@ -516,6 +648,44 @@ class TestCourseSched(unittest.TestCase):
         test_msg = test_callback.msg + "\n" + test_callback.sol_to_str()
         self.assertTrue(test_callback.success, msg=test_msg)
 
+    def test_shared_course_vars(self):
+        """ Courses shared across curricula have one set of model variables per day.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 6), Course('2', 4), Course('3', 6)
+        c4, c5, c6, c7 = Course('4', 6), Course(
+            '5', 4), Course('6', 4), Course('7', 4)
+        courses0 = [c0, c1, c2, c3]
+        courses1 = [c4, c5, c6, c7, c0, c1]
+        courses2 = [c0, c5, c6, c3]
+        cur0 = Curriculum('0', courses0)
+        cur1 = Curriculum('1', courses1)
+        cur2 = Curriculum('2', courses2)
+        curricula = [cur0, cur1, cur2]
+        n_days = 5
+        n_periods = 12
+
+        sched = CourseSched(n_days, n_periods, curricula, canonical=True,
+                            share_course_vars=True)
+        sched.add_no_overlap_constraints()
+        sched.add_lecture_pattern_constraints()
+        sched.add_sync_across_curricula_constraints()
+        sched.add_unavailability_constraints('0', 1, [(0, 5)])
+
+        model_vars = {id(model_var) for model_var in sched.model_vars.values()}
+        self.assertEqual(len(model_vars), n_days * len(sched.course_to_curricula))
+
+        test_callback = TestCurriculaSyncCallback(sched.model_vars,
+                                                  sched.curricula,
+                                                  sched.n_days,
+                                                  sched.n_periods,
+                                                  N_SOL_PER_TEST,
+                                                  sched.course_to_curricula)
+        sched.solve(test_callback)
+        test_msg = test_callback.msg + "\n" + test_callback.sol_to_str()
+        self.assertTrue(test_callback._solution_count, msg="Expected to find some solutions")
+        self.assertTrue(test_callback.success, msg=test_msg)
+
     def test_lecture_symmetry(self):
         """ Lectures have to be scheduled symmetrically. I.e. a 1.5 hour lecture at 1PM Tue
             must also be scheduled for 1PM Thu.
@@ -547,6 +717,55 @@ class TestCourseSched(unittest.TestCase):
         test_msg = test_callback.msg + "\n" + test_callback.sol_to_str()
         self.assertTrue(test_callback.success, msg=test_msg)
 
+    def test_lecture_pattern_catalog(self):
+        """ Weekly lecture patterns are the ones allowed by lecture symmetry constraints.
+        """
+        self.assertEqual(sorted(lecture_pattern_catalog(6, 6, 5)),
+                         sorted([(6, 0, 0, 0, 0), (0, 6, 0, 0, 0), (0, 0, 6, 0, 0),
+                                 (0, 0, 0, 6, 0), (0, 0, 0, 0, 6), (0, 3, 0, 3, 0),
+                                 (3, 0, 3, 0, 0), (2, 0, 2, 0, 2)]))
+        self.assertEqual(sorted(lecture_pattern_catalog(4, 2, 5)),
+                         sorted([(0, 2, 0, 2, 0), (2, 0, 2, 0, 0)]))
+        self.assertIn((0, 2, 0, 2, 0, 2), lecture_pattern_catalog(6, 6, 6))
+        self.assertEqual(lecture_pattern_catalog(4, 2, 2), [])
+
+    def test_lecture_pattern_constraints(self):
+        """ Lecture patterns ensure course length, lecture length and lecture symmetry.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 4), Course('2', 6), Course('3', 6)
+        c4, c5, c6, c7 = Course('4', 6), Course(
+            '5', 4), Course('6', 4), Course('7', 4)
+        courses = [c0, c1, c2, c3, c4, c5, c6, c7]
+        cur = Curriculum('0', courses)
+        curricula = [cur]
+        n_days = 5
+        n_periods = 8
+
+        for canonical in (False, True):
+            sched = CourseSched(n_days, n_periods, curricula, canonical=canonical)
+            sched.add_no_overlap_constraints()
+            sched.add_lecture_pattern_constraints()
+
+            test_callback = TestLectureSymmetryCallback(sched.model_vars,
+                                                        sched.curricula,
+                                                        sched.n_days,
+                                                        sched.n_periods,
+                                                        N_SOL_PER_TEST)
+            sched.solve(test_callback)
+            test_msg = test_callback.msg + "\n" + test_callback.sol_to_str()
+            self.assertTrue(test_callback.success, msg=test_msg)
+
+            expected = {'0': {c._id: c.n_periods for c in courses}}
+            test_callback = TestSchedPeriodSumCallback(sched.model_vars,
+                                                       sched.curricula,
+                                                       sched.n_days,
+                                                       sched.n_periods,
+                                                       N_SOL_PER_TEST,
+                                                       expected)
+            sched.solve(test_callback)
+            self.assertEqual(test_callback.actual, test_callback.expected)
+
     def test_solution_serializer(self):
         """ Test solution serializer used by the API.
         """
@@ -580,6 +799,546 @@ class TestCourseSched(unittest.TestCase):
         except SchemaError as e:
             self.fail(f"Schema validation error: {e}")
 
+    def test_canonical_enumeration(self):
+        """ In canonical mode every enumerated solution must serialize
+            to a different timetable.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 6), Course('2', 4), Course('3', 6)
+        c4, c5 = Course('4', 4), Course('5', 4)
+        courses0 = [c0, c1, c2, c3]
+        courses1 = [c0, c4, c5]
+        cur0 = Curriculum('0', courses0)
+        cur1 = Curriculum('1', courses1)
+        curricula = [cur0, cur1]
+        n_days = 5
+        n_periods = 8
+
+        sched = CourseSched(n_days, n_periods, curricula, canonical=True)
+        sched.add_no_overlap_constraints()
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+        sched.add_sync_across_curricula_constraints()
+        sched.add_lecture_symmetry_constraints()
+
+        serializer_callback = SchedPartialSolutionSerializer(sched.model_vars,
+                                                             sched.curricula,
+                                                             sched.n_days,
+                                                             sched.n_periods,
+                                                             N_SOL_PER_TEST)
+
+        sched.solve(serializer_callback)
+        timetables = [json.dumps(sol['curricula'], sort_keys=True)
+                      for sol in serializer_callback.solutions['solutions']]
+        self.assertEqual(len(timetables), N_SOL_PER_TEST)
+        self.assertEqual(len(set(timetables)), len(timetables))
+
+    def test_canonical_timetables(self):
+        """ Canonical mode finds the timetables of the default mode.
+        """
+        build = functools.partial(build_sched, [{'0': 4, '1': 4}, {'0': 4}], 5, 4,
+                                  lecture_patterns=False, unavailability=[('1', 1, [(0, 1)])])
+        canonical = timetables(build(canonical=True))
+        self.assertTrue(canonical)
+        for timetable in canonical:
+            self.assertTrue(is_solution(build(canonical=False), timetable))
+        # the default mode enumerates every timetable many times
+        self.assertLessEqual(set(timetables(build(canonical=False), N_SOL_PER_TEST)),
+                             set(canonical))
+
+    def test_solution_streamer(self):
+        """ Solutions are passed to `emit` as they are found and not kept;
+            the search stops when `emit` returns False.
+        """
+        c0, c1, c2 = Course('0', 6), Course('1', 4), Course('2', 4)
+        cur0 = Curriculum('0', [c0, c1, c2])
+        n_days = 5
+        n_periods = 12
+
+        sched = CourseSched(n_days, n_periods, [cur0], canonical=True)
+        sched.add_no_overlap_constraints()
+        sched.add_lecture_pattern_constraints()
+        emitted = []
+
+        def emit(solution):
+            emitted.append(solution)
+            return len(emitted) < 3
+
+        streamer = SchedSolutionStreamer(sched.model_vars,
+                                         sched.curricula,
+                                         sched.n_days,
+                                         sched.n_periods,
+                                         N_SOL_PER_TEST,
+                                         emit)
+        sched.solve(streamer)
+        self.assertEqual(len(emitted), 3)
+        self.assertEqual(streamer.solutions, {'n_solutions': 3, 'solutions': []})
+        try:
+            response_schema.validate({'n_solutions': 3, 'solutions': emitted})
+        except SchemaError as e:
+            self.fail(f"Schema validation error: {e}")
+
+    def test_solution_store(self):
+        """ Rows are deduplicated and read back from memory and from the spill file.
+        """
+        store = SolutionStore([('0', '0', 0), ('0', '0', 1)], spill_bytes=8)
+        rows = [[i, 2, 0, 0] for i in range(5)]
+        for row in rows:
+            self.assertTrue(store.add(row))
+        self.assertFalse(store.add(rows[1]))
+        self.assertEqual(len(store), 5)
+        self.assertEqual([list(row) for row in store], rows)  # 4 rows spilled
+        self.assertEqual(list(store[-1]), rows[-1])
+        store.close()
+
+    def test_solution_store_serializer(self):
+        """ Store serializer returns the same solutions and JSON as
+            `SchedPartialSolutionSerializer`.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 4), Course('2', 4), Course('3', 6)
+        cur0 = Curriculum('0', [c0, c1, c2])
+        cur1 = Curriculum('1', [c0, c3])
+        n_days = 5
+        n_periods = 12
+
+        def solve(serializer_class, n_solutions=N_SOL_PER_TEST, **kwargs):
+            sched = CourseSched(n_days, n_periods, [cur0, cur1], canonical=True,
+                                share_course_vars=True)
+            sched.add_no_overlap_constraints()
+            sched.add_lecture_pattern_constraints()
+            sched.add_sync_across_curricula_constraints()
+            callback = serializer_class(sched.model_vars, sched.curricula,
+                                        sched.n_days, sched.n_periods,
+                                        n_solutions, **kwargs)
+            if n_solutions == 1:
+                sched.solve_single(callback, num_search_workers=1)
+            else:
+                sched.solve(callback)
+            return callback
+
+        expected = solve(SchedPartialSolutionSerializer).solutions
+        callback = solve(SchedSolutionStoreSerializer, spill_bytes=1024)
+        self.assertEqual(callback.solutions, expected)
+        self.assertEqual(json.loads(callback.dumps()), expected)
+        # solutions from other processes are deduplicated
+        callback.add_solution(expected['solutions'][0]['curricula'])
+        self.assertEqual(callback.solution_count(), N_SOL_PER_TEST)
+        callback.store.close()
+        # bulk collection gives the same solutions, also with partial batches
+        callback = solve(SchedBulkSolutionCollector, batch_size=7)
+        self.assertEqual(callback.solution_count(), N_SOL_PER_TEST)
+        self.assertEqual(callback.dumps(), json.dumps(
+            expected, sort_keys=True, separators=(',', ':')).encode() + b'\n')
+        callback.store.close()
+        # a solution replayed after `CpSolver.Solve`
+        callback = solve(SchedBulkSolutionCollector, n_solutions=1)
+        self.assertEqual(callback.solutions['n_solutions'], 1)
+        callback.store.close()
+
+    def test_symmetry_breaking(self):
+        """ Interchangeable courses are detected and only one solution of every
+            permutation of them is found.
+        """
+        n_days = 3
+        n_periods = 8
+
+        def count_solutions(symmetry_breaking, unavailable=False):
+            c0, c1, c2, c3 = Course('0', 4), Course(
+                '1', 4), Course('2', 6), Course('3', 4)
+            cur0 = Curriculum('0', [c0, c1, c2, c3])
+            sched = CourseSched(n_days, n_periods, [cur0], canonical=True)
+            sched.add_no_overlap_constraints()
+            sched.add_lecture_pattern_constraints()
+            if unavailable:
+                sched.add_unavailability_constraints('3', 0, [(0, 1)])
+            if symmetry_breaking:
+                sched.add_symmetry_breaking_constraints()
+            callback = SchedSolutionStoreSerializer(sched.model_vars,
+                                                    sched.curricula,
+                                                    sched.n_days,
+                                                    sched.n_periods,
+                                                    10 ** 6)
+            sched.solve(callback)
+            callback.store.close()
+            return sched.symmetry_classes, callback.solution_count()
+
+        classes, n_solutions = count_solutions(True)
+        self.assertEqual(classes, [['0', '1', '3']])
+        self.assertEqual(n_solutions * 6, count_solutions(False)[1])  # 3! permutations
+        classes, n_solutions = count_solutions(True, unavailable=True)
+        self.assertEqual(classes, [['0', '1']])
+        self.assertEqual(n_solutions * 2, count_solutions(False, unavailable=True)[1])
+
+    def test_solve_single(self):
+        """ Single solution search returns one solution in the serializer format.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 6), Course('2', 4), Course('3', 6)
+        c4, c5, c6, c7 = Course('4', 6), Course(
+            '5', 4), Course('6', 4), Course('7', 4)
+        courses0 = [c0, c1, c2, c3]
+        courses1 = [c4, c5, c6, c7, c0]
+        cur0 = Curriculum('0', courses0)
+        cur1 = Curriculum('1', courses1)
+        curricula = [cur0, cur1]
+        n_days = 5
+        n_periods = 27
+
+        sched = CourseSched(n_days, n_periods, curricula, canonical=True)
+        sched.add_no_overlap_constraints()
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+        sched.add_sync_across_curricula_constraints()
+        sched.add_lecture_symmetry_constraints()
+        soft_min, soft_max = 4, 24
+        sched.add_soft_start_time_constraints(soft_min, soft_max, 1, 1)
+
+        serializer_callback = SchedPartialSolutionSerializer(sched.model_vars,
+                                                             sched.curricula,
+                                                             sched.n_days,
+                                                             sched.n_periods,
+                                                             1)
+        sched.solve_single(serializer_callback, num_search_workers=4)
+        solutions = serializer_callback.solutions
+        self.assertEqual(solutions['n_solutions'], 1)
+        try:
+            response_schema.validate(solutions)
+        except SchemaError as e:
+            self.fail(f"Schema validation error: {e}")
+        for cur in solutions['solutions'][0]['curricula']:
+            for course in cur['courses']:
+                for day_sched in course['schedule']:
+                    self.assertGreaterEqual(day_sched['start'], soft_min)
+                    self.assertLessEqual(
+                        day_sched['start'] + day_sched['duration'], soft_max)
+
+    def test_obj_proximity(self):
+        """ All solutions of an optimization problem have objective values within
+            the proximity delta of the best solution, which is hinted to the search.
+        """
+        c0, c1, c2, c3 = Course('0', 6), Course(
+            '1', 6), Course('2', 4), Course('3', 6)
+        c4, c5, c6, c7 = Course('4', 6), Course(
+            '5', 4), Course('6', 4), Course('7', 4)
+        courses0 = [c0, c1, c2, c3]
+        courses1 = [c4, c5, c6, c7]
+        cur0 = Curriculum('0', courses0)
+        cur1 = Curriculum('1', courses1)
+        curricula = [cur0, cur1]
+        n_days = 5
+        n_periods = 27
+
+        sched = CourseSched(n_days, n_periods, curricula, canonical=True)
+        sched.add_no_overlap_constraints()
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+        sched.add_sync_across_curricula_constraints()
+        sched.add_lecture_symmetry_constraints()
+        sched.add_soft_start_time_constraints(8, 20, 1, 2)
+
+        delta = 2
+        test_callback = TestObjectiveCallback(sched.model_vars,
+                                              sched.curricula,
+                                              sched.n_days,
+                                              sched.n_periods,
+                                              N_SOL_PER_TEST)
+        sched.solve(test_callback, obj_proximity_delta=delta, obj_search_time=10)
+        self.assertTrue(sched.model.Proto().solution_hint.vars)
+        self.assertTrue(test_callback.objective_values)
+        best = min(test_callback.objective_values)
+        self.assertLessEqual(max(test_callback.objective_values), best + delta)
+
+    def test_solve_partitioned(self):
+        """ Partitioned search finds the same solutions as sequential search
+            and returns the same solutions every time when the number of solutions is capped.
+        """
+        build = functools.partial(build_sched, [{'0': 6, '1': 4}, {'0': 6, '2': 4}], 5, 5,
+                                  lecture_patterns=False, unavailability=[('1', 1, [(0, 1)])])
+
+        def partitioned(n_solutions):
+            return timetables(build(), n_solutions, CourseSched.solve_partitioned,
+                              max_workers=4)
+
+        all_solutions = 10 ** 6
+        self.assertEqual(sorted(partitioned(all_solutions)), sorted(timetables(build())))
+        capped = partitioned(N_SOL_PER_TEST)
+        self.assertEqual(len(capped), N_SOL_PER_TEST)
+        self.assertEqual(capped, partitioned(N_SOL_PER_TEST))
+        for n_solutions, status in ((all_solutions, cp_model.OPTIMAL),
+                                    (N_SOL_PER_TEST, cp_model.FEASIBLE)):
+            sched = build()
+            self.assertEqual(sched.solve_partitioned(serializer(sched, n_solutions),
+                                                     max_workers=4), status)
+        # length constraints only allow enumerated duration vectors of the pivot
+        # course, so the cube of the other vectors is empty and left out
+        sched = build()
+        n_vectors = len(sched._pivot_course_durations()[1])
+        self.assertEqual(sched._n_cubes(), n_vectors)
+        sched._add_cube_constraints(n_vectors)
+        self.assertEqual(timetables(sched), [])
+
+    def test_solve_decomposed(self):
+        """ Decomposed search combines solutions of independent groups of curricula
+            into the same solutions as search over the whole model.
+        """
+        build = functools.partial(build_sched,
+                                  [{'0': 4, '1': 4}, {'2': 4}, {'0': 4}, {'3': 4, '2': 4}],
+                                  3, 4, lecture_patterns=False, lecture_symmetry=False,
+                                  unavailability=[('3', 0, [(0, 1)])])
+
+        def decomposed(n_solutions):
+            return timetables(build(), n_solutions, CourseSched.solve_decomposed,
+                              max_workers=2)
+
+        self.assertEqual(build().connected_components(), [['0', '2'], ['1', '3']])
+        all_solutions = 10 ** 6
+        self.assertEqual(sorted(decomposed(all_solutions)), sorted(timetables(build())))
+        self.assertEqual(len(decomposed(N_SOL_PER_TEST)), N_SOL_PER_TEST)
+        self.assertEqual(len(decomposed(1)), 1)
+        sched = build()
+        self.assertEqual(sched.solve_decomposed(serializer(sched, all_solutions),
+                                                max_workers=2), cp_model.OPTIMAL)
+
+    def test_solve_two_stage(self):
+        """ Two-stage search finds a solution of the lecture pattern model,
+            or no solution if stage 2 fails for every choice of patterns.
+        """
+        n_days = 5
+        n_periods = 8
+        course_locks = {'3': [{'day': 1, 'duration': 3, 'start': 2},
+                              {'day': 3, 'duration': 3, 'start': 2}]}
+        build = functools.partial(build_sched, n_days=n_days, n_periods=n_periods,
+                                  share_course_vars=True, course_locks=course_locks)
+
+        def solve(sched, two_stage):
+            if two_stage:
+                return timetables(sched, 1, CourseSched.solve_two_stage, max_workers=2)
+            return timetables(sched, 1, CourseSched.solve_single, num_search_workers=1)
+
+        curricula = [{'0': 6, '1': 4, '2': 4}, {'0': 6, '3': 6}]
+        unavailability = [('1', 0, [(0, 4)]), ('0', 2, [(0, 7)])]
+        two_stage_timetables = solve(build(curricula, unavailability=unavailability), True)
+        self.assertEqual(len(two_stage_timetables), 1)
+        self.assertTrue(is_solution(build(curricula, unavailability=unavailability),
+                                    two_stage_timetables[0]))
+
+        # three courses of a curriculum that must start at 0 on alternate days
+        curricula = [{'4': 4, '1': 4, '2': 4}, {'0': 6, '3': 6}]
+        unavailability = start_at_0(['4', '1', '2'], n_days, n_periods)
+        self.assertEqual(solve(build(curricula, unavailability=unavailability), False), [])
+        self.assertEqual(solve(build(curricula, unavailability=unavailability), True), [])
+
+        # soft constraints and constraints that two-stage search doesn't encode
+        self.assertTrue(build(curricula).solves_two_stage())
+        sched = build(curricula)
+        sched.add_soft_start_time_constraints(3, 6, 1, 1)
+        unsupported = [sched, build(curricula, lecture_patterns=False)]
+        for sched in unsupported:
+            self.assertFalse(sched.solves_two_stage())
+            with self.assertRaises(ValueError):
+                solve(sched, True)
+
+    def test_place_day_group(self):
+        """ Lectures of a group of days that can't be placed return a smallest
+            conflicting set of courses.
+        """
+        # courses 0 and 1 start at 0 on day 0, course 2 can start anywhere
+        courses = {('0', None): ([(0, 2), (2, 2)], [0]),
+                   ('1', None): ([(0, 2)], [0]),
+                   ('2', None): ([(0, 2), (2, 2)], list(range(7))),
+                   ('3', None): ([(2, 3)], [0, 1])}
+        cur_day_courses = [(0, [('0', None), ('1', None), ('2', None)]),
+                           (2, [('0', None), ('2', None)]),
+                           (2, [('3', None)])]
+        status, starts, conflict = _place_day_group(courses, cur_day_courses, 8, None)
+        self.assertEqual((starts, sorted(conflict)), ({}, [('0', None), ('1', None)]))
+
+        courses[('1', None)] = ([(0, 2)], [2, 4])
+        status, starts, conflict = _place_day_group(courses, cur_day_courses, 8, None)
+        self.assertEqual(conflict, [])
+        self.assertEqual(set(starts), set(courses))
+
+    def test_solve_shared_first(self):
+        """ Shared courses first search finds a solution of the whole model,
+            or no solution if the model is infeasible.
+        """
+        n_days = 5
+        n_periods = 8
+        curricula = [{'0': 4, '1': 4, '2': 4}, {'0': 4, '3': 6}, {'3': 6, '4': 4}]
+        build = functools.partial(build_sched, curricula, n_days, n_periods,
+                                  share_course_vars=True)
+
+        def solve(sched, shared_first):
+            if shared_first:
+                return timetables(sched, 1, CourseSched.solve_shared_first, max_workers=2)
+            return timetables(sched, 1, CourseSched.solve_single, num_search_workers=1)
+
+        feasible = start_at_0(['1', '2'], n_days, n_periods)
+        shared_first_timetables = solve(build(unavailability=feasible), True)
+        self.assertEqual(len(shared_first_timetables), 1)
+        self.assertEqual([cur['curriculum_id']
+                          for cur in json.loads(shared_first_timetables[0])],
+                         ['0', '1', '2'])
+        self.assertTrue(is_solution(build(unavailability=feasible),
+                                    shared_first_timetables[0]))
+
+        infeasible = start_at_0(['0', '1', '2'], n_days, n_periods)
+        self.assertEqual(solve(build(unavailability=infeasible), False), [])
+        self.assertEqual(solve(build(unavailability=infeasible), True), [])
+
+    def test_solve_shared_first_limit(self):
+        """ Shared courses first search that needs more iterations than allowed
+            stops without a solution; infeasible curricula are found right away.
+        """
+        build = functools.partial(build_sched, [{'0': 4, '1': 4}, {'0': 4, '2': 4}], 3, 8,
+                                  share_course_vars=True)
+
+        def solve(sched, max_iterations):
+            callback = serializer(sched, 1)
+            status = sched.solve_shared_first(callback, max_workers=2,
+                                              max_iterations=max_iterations)
+            self.assertEqual(callback.solution_count(), 0)
+            return status
+
+        # courses 0 and 1 can only start at 0 and take 2 of 3 days: every assignment
+        # of course 0 conflicts with course 1
+        conflicting = start_at_0(['0', '1'], 3, 8)
+        self.assertEqual(solve(build(unavailability=conflicting), 1), cp_model.UNKNOWN)
+        self.assertEqual(solve(build(unavailability=conflicting), 100), cp_model.INFEASIBLE)
+        # private courses of curriculum 0 can't be scheduled
+        sched = build(unavailability=start_at_0(['1'], 3, 8))
+        sched.add_unavailability_constraints('1', 1, [(0, 1)])
+        sched.add_unavailability_constraints('1', 2, [(0, 1)])
+        self.assertEqual(solve(sched, 0), cp_model.INFEASIBLE)
+
+    def test_solve_coarse_to_fine(self):
+        """ Coarse to fine search finds a solution of the whole model, also if
+            lectures can't start at even periods.
+        """
+        n_days = 5
+        n_periods = 12
+
+        build = functools.partial(build_sched, [{'0': 6, '1': 4, '2': 4}, {'0': 6, '3': 6}],
+                                  n_days, n_periods, optional_intervals=True)
+        even_starts = [('1', 1, [(0, 4)])]
+        # course 3 can only start at period 1
+        odd_starts = even_starts + [('3', d, [(0, 0), (4, 11)]) for d in range(n_days)]
+
+        solve_single = CourseSched.solve_single
+
+        def coarse_only(sched, callback, first_solution=False, **kwargs):
+            if first_solution:
+                return solve_single(sched, callback, first_solution=True, **kwargs)
+            return cp_model.UNKNOWN
+
+        def check_solution(unavailability, fine_timeout=False):
+            sched = build(unavailability=unavailability)
+            sched.add_soft_start_time_constraints(3, 9, 1, 1)
+            solve = functools.partial(timetables, sched, 1, CourseSched.solve_coarse_to_fine,
+                                      num_search_workers=2)
+            if fine_timeout:  # only the coarse search finds a solution
+                with mock.patch.object(CourseSched, 'solve_single', autospec=True,
+                                       side_effect=coarse_only):
+                    coarse_to_fine_timetables = solve()
+            else:
+                coarse_to_fine_timetables = solve()
+            self.assertEqual(len(coarse_to_fine_timetables), 1)
+            self.assertTrue(is_solution(build(unavailability=unavailability),
+                                        coarse_to_fine_timetables[0]))
+            return json.loads(coarse_to_fine_timetables[0])
+
+        check_solution(even_starts)
+        check_solution(odd_starts)
+        # the coarse solution is returned if the fine search times out
+        solution = check_solution(even_starts, fine_timeout=True)
+        self.assertTrue(all(day_sched['start'] % 2 == 0
+                            for cur in solution for course in cur['courses']
+                            for day_sched in course['schedule']))
+
+    def test_improve_lns(self):
+        """ Large neighbourhood search reports non-increasing objective values and
+            passes a solution of the whole model with the last objective value.
+        """
+        build = functools.partial(build_sched,
+                                  [{'0': 6, '1': 4, '2': 4}, {'0': 6, '3': 6}, {'2': 4, '3': 6}],
+                                  5, 12, unavailability=[('1', 1, [(0, 4)])],
+                                  optional_intervals=True)
+
+        sched = build()
+        sched.add_soft_start_time_constraints(3, 9, 1, 1)
+        sched.add_soft_total_time_constraints(4, 4, 1, 1)
+        serializer_callback = serializer(sched, 1)
+        status, trace = sched.improve_lns(serializer_callback, max_time=3,
+                                          round_time=1, max_workers=2)
+        self.assertIn(status, (cp_model.OPTIMAL, cp_model.FEASIBLE))
+        self.assertTrue(trace)
+        objectives = [obj for _, obj in trace]
+        self.assertEqual(objectives, sorted(objectives, reverse=True))
+        self.assertEqual(round(sched.solver.ObjectiveValue()), objectives[-1])
+        self.assertEqual(sched.lns_trace, trace)
+        solutions = serializer_callback.solutions['solutions']
+        self.assertEqual(len(solutions), 1)
+        sched = build()
+        sched.add_soft_start_time_constraints(3, 9, 1, 1)
+        sched.add_soft_total_time_constraints(4, 4, 1, 1)
+        self.assertTrue(is_solution(sched, json.dumps(solutions[0]['curricula'])))
+        self.assertEqual(round(sched.solver.ObjectiveValue()), objectives[-1])
+
+    def test_stop(self):
+        """ A stopped search returns right away; searches of worker processes are
+            stopped too and solutions found so far are kept.
+        """
+        curricula = [{'0': 6, '1': 4, '2': 4}, {'0': 6, '3': 6}]
+        methods = {'solve': {}, 'solve_single': {}, 'solve_coarse_to_fine': {},
+                   'solve_partitioned': {'max_workers': 2},
+                   'solve_decomposed': {'max_workers': 2},
+                   'solve_two_stage': {'max_workers': 2},
+                   'solve_shared_first': {'max_workers': 2},
+                   'improve_lns': {'max_workers': 2}}
+        for method, kwargs in methods.items():
+            sched = build_sched(curricula, 5, 12, optional_intervals=True)
+            if method != 'solve_two_stage':  # two-stage search has no objective
+                sched.add_soft_start_time_constraints(3, 9, 1, 1)
+            callback = serializer(sched, 1)
+            callback.stop()
+            status = getattr(sched, method)(callback, **kwargs)
+            if method == 'improve_lns':
+                status, _ = status
+            self.assertEqual(status, cp_model.UNKNOWN, method)
+            self.assertEqual(callback.solution_count(), 0, method)
+
+        # stopped while cubes are enumerated (all solutions take much longer)
+        sched = build_sched(curricula, 5, 27, optional_intervals=True)
+        sched.add_soft_start_time_constraints(3, 9, 1, 1)
+        callback = serializer(sched, 10 ** 6)
+        timer = threading.Timer(2, callback.stop)
+        timer.start()
+        started = time.monotonic()
+        status = sched.solve_partitioned(callback, max_workers=2)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(status, cp_model.FEASIBLE)
+        self.assertTrue(callback.solution_count())
+
+    def test_added_solution_objective(self):
+        """ Solutions that worker processes pass to the callback keep its best
+            objective value up to date.
+        """
+        build = functools.partial(build_sched, [{'0': 6, '1': 4, '2': 4}, {'0': 6, '3': 6}],
+                                  5, 12, optional_intervals=True)
+        for method in ('solve_partitioned', 'solve_decomposed', 'solve_shared_first'):
+            sched = build()
+            sched.add_soft_start_time_constraints(3, 9, 1, 1)
+            callback = serializer(sched, 1)
+            status = getattr(sched, method)(callback, max_workers=2)
+            self.assertIn(status, (cp_model.OPTIMAL, cp_model.FEASIBLE), method)
+            sched = build()
+            sched.add_soft_start_time_constraints(3, 9, 1, 1)
+            solution = callback.solutions['solutions'][0]
+            self.assertTrue(is_solution(sched, json.dumps(solution['curricula'])), method)
+            self.assertEqual(callback.best_objective,
+                             round(sched.solver.ObjectiveValue()), method)
+
     def test_course_lock(self):
         """ Test course locking.
         """
@@ -624,6 +1383,83 @@ class TestCourseSched(unittest.TestCase):
         else:
             self.fail("Expected to find some solutions")
 
+    def test_course_locks_fixed(self):
+        """ Courses locked when the scheduler is created have the same solutions
+            as courses locked with `add_course_lock`, and locks that violate
+            lecture constraints make the model infeasible.
+        """
+        build = functools.partial(build_sched, [{'0': 6, '1': 4}, {'0': 6, '2': 4}], 5, 8,
+                                  lecture_patterns=False, unavailability=[('1', 1, [(0, 4)])])
+        course_1_lock = [{'day': 1, 'duration': 2, 'start': 5},
+                         {'day': 3, 'duration': 2, 'start': 5}]
+
+        locked = build(course_locks={'1': course_1_lock})
+        locked.add_course_lock('1', course_1_lock)  # matches the lock, no-op
+        added = build()
+        added.add_course_lock('1', course_1_lock)
+        self.assertLess(len(locked.model.Proto().constraints),
+                        len(added.model.Proto().constraints))
+        expected = sorted(timetables(added))
+        self.assertTrue(expected)
+        self.assertEqual(sorted(timetables(locked)), expected)
+
+        invalid_locks = [
+            [{'day': 1, 'duration': 2, 'start': 5}],  # too short
+            [{'day': 1, 'duration': 2, 'start': 5},   # not symmetric
+             {'day': 3, 'duration': 2, 'start': 4}],
+            [{'day': 1, 'duration': 2, 'start': 2},   # unavailable
+             {'day': 3, 'duration': 2, 'start': 2}]]
+        for lock in invalid_locks:
+            for canonical in (True, False):
+                self.assertEqual(timetables(build(course_locks={'1': lock},
+                                                  canonical=canonical)), [])
+
+    def test_optional_intervals(self):
+        """ Optional intervals layout has the same solutions as the default layout
+            and doesn't need auxiliary variables to reify lecture durations.
+        """
+        build = functools.partial(build_sched, [{'0': 6, '1': 4}, {'0': 6, '2': 4}], 5, 6,
+                                  lecture_patterns=False, unavailability=[('2', 1, [(0, 1)])])
+        optional = build(optional_intervals=True)
+        default = build(optional_intervals=False)
+        self.assertLess(len(optional.model.Proto().variables),
+                        len(default.model.Proto().variables))
+        optional_timetables = timetables(optional)
+        self.assertTrue(optional_timetables)
+        self.assertEqual(len(set(optional_timetables)), len(optional_timetables))
+        self.assertEqual(sorted(optional_timetables), sorted(timetables(default)))
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([(5, 8), (0, 2), (3, 3), (7, 10)]),
+                         [(0, 3), (5, 10)])
+        self.assertEqual(merge_intervals([(4, 4), (0, 1)]), [(0, 1), (4, 4)])
+        self.assertEqual(merge_intervals([]), [])
+
+    def test_compile_unavailability(self):
+        """ Compiled unavailability constraints allow the same solutions
+            as unavailability constraints with fixed intervals.
+        """
+        n_days = 4
+        unavailability = [('0', 0, [(0, 2), (6, 7)]), ('0', 0, [(3, 3)]),
+                          ('0', 2, [(0, 7)]), ('2', 1, [(1, 2), (2, 4)])]
+        solutions = {}
+        for compile_unavailability in (True, False):
+            sched = build_sched([{'0': 6, '1': 4}, {'0': 6, '2': 4}], n_days, 8,
+                                lecture_patterns=False, lecture_symmetry=False,
+                                unavailability=unavailability,
+                                compile_unavailability=compile_unavailability)
+            sched.add_course_lock('1', [{'day': 3, 'duration': 2, 'start': 4},
+                                        {'day': 1, 'duration': 2, 'start': 5}])
+            n_no_overlap = len([ct for ct in sched.model.Proto().constraints
+                                if ct.HasField('no_overlap')])
+            # one NoOverlap per curriculum per day if unavailability is compiled
+            self.assertEqual(n_no_overlap == n_days * len(sched.curricula),
+                             compile_unavailability)
+            solutions[compile_unavailability] = sorted(timetables(sched))
+
+        self.assertTrue(solutions[True])
+        self.assertEqual(solutions[True], solutions[False])
+
     def test_soft_constraint_total_time(self):
         """ Checks that there are not too many or too few periods scheduled for each day.
         """
@@ -666,6 +1502,76 @@ class TestCourseSched(unittest.TestCase):
         else:
             self.fail("Expected to find some solutions")
 
+    def test_soft_constraint_total_time_cost(self):
+        """ Objective of daily load soft constraints is the cost of lectures
+            that take place in the solution.
+        """
+        c0, c1, c2 = Course('0', 4), Course('1', 4), Course('2', 6)
+        cur0 = Curriculum('0', [c0, c1, c2])
+        n_days = 5
+        n_periods = 10
+        soft_min, soft_max = 5, 6
+
+        sched = CourseSched(n_days, n_periods, [cur0])
+        sched.add_no_overlap_constraints()
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+        sched.add_soft_total_time_constraints(soft_min, soft_max, 1, 1)
+
+        def day_cost(lectures):
+            starts, ends, durations = zip(*lectures)
+            return max(soft_min - sum(durations), 0) + \
+                max(max(ends) - min(starts) - soft_max, 0)
+
+        test_callback = TestDayCostCallback(sched.model_vars,
+                                            sched.curricula,
+                                            sched.n_days,
+                                            sched.n_periods,
+                                            day_cost,
+                                            N_SOL_PER_TEST)
+
+        sched.solve(test_callback, obj_proximity_delta=n_periods)
+        self.assertEqual(len(test_callback.costs), N_SOL_PER_TEST)
+        for objective_value, cost in test_callback.costs:
+            self.assertEqual(objective_value, cost)
+        self.assertGreater(len(set(test_callback.costs)), 1)
+
+    def test_soft_start_time_constraints_cost(self):
+        """ Objective of start time soft constraints is the cost of the first and
+            the last lecture of every curriculum-day.
+        """
+        c0, c1, c2 = Course('0', 4), Course('1', 4), Course('2', 6)
+        cur0 = Curriculum('0', [c0, c1, c2])
+        cur1 = Curriculum('1', [c0, c1])
+        n_days = 5
+        n_periods = 10
+        soft_min, soft_max = 2, 7
+
+        sched = CourseSched(n_days, n_periods, [cur0, cur1], share_course_vars=True)
+        sched.add_no_overlap_constraints()
+        sched.add_course_len_constraints()
+        sched.add_lecture_len_constraints()
+        sched.add_soft_start_time_constraints(soft_min, soft_max, 1, 1)
+        # one early and one late cost per curriculum-day
+        self.assertEqual(len(sched.obj_int_vars), 2 * n_days * len(sched.curricula))
+
+        def day_cost(lectures):
+            starts, ends, _ = zip(*lectures)
+            return max(soft_min - min(starts), 0) + max(max(ends) - soft_max, 0)
+
+        test_callback = TestDayCostCallback(sched.model_vars,
+                                            sched.curricula,
+                                            sched.n_days,
+                                            sched.n_periods,
+                                            day_cost,
+                                            N_SOL_PER_TEST)
+
+        sched.solve(test_callback, obj_proximity_delta=n_periods)
+        self.assertEqual(len(test_callback.costs), N_SOL_PER_TEST)
+        for objective_value, cost in test_callback.costs:
+            self.assertEqual(objective_value, cost)
+        self.assertGreater(len(set(test_callback.costs)), 1)
+
     def test_soft_start_time_constraints(self):
         """ Test soft constraints around first class start time and last class end time.
         """
@@ -5,7 +5,14 @@ from schema import SchemaError
 from api_schema.api_schema import response_schema
 import json
 from api import app
+from api_executor import SolverPool
+from api_util import build_sched, solve_request, solve_sched, solve_stats, solver_status
+from course_sched.course_sched import CourseSched, SchedPartialSolutionSerializer
+from unittest import mock
+from werkzeug.exceptions import HTTPException
+from ortools.sat.python import cp_model
 import sys
+import time
 
 class TestIntegrations(TestCase):
     def setUp(self):
@@ -21,6 +28,123 @@ class TestIntegrations(TestCase):
         self.assertEqual(response.status_code, 200 )
             
 
+    def test_api_single_solution(self):
+        self.payload['n_solutions'] = 1
+        response = self.app.post('/sched' , json=self.payload )
+        json_response = response.get_json()
+        self.assertEqual(response.status_code, 200 )
+        self.assertEqual(json_response['n_solutions'], 1 )
+        self.assertEqual(len(json_response['solutions']), 1 )
+
+    def test_api_independent_curricula(self):
+        self.payload['n_solutions'] = 5
+        self.payload['curricula'][1]['courses'][3]['course_id'] = 'BbjRKtortAflVFLM'
+        response = self.app.post('/sched' , json=self.payload )
+        json_response = response.get_json()
+        self.assertEqual(response.status_code, 200 )
+        self.assertEqual(json_response['n_solutions'], 5 )
+        response_schema.validate(json_response)
+        curriculum_ids = [cur['curriculum_id'] for cur in json_response['solutions'][0]['curricula']]
+        self.assertEqual(curriculum_ids, [cur['curriculum_id'] for cur in self.payload['curricula']])
+
+    def test_api_cache(self):
+        self.payload['n_solutions'] = 3
+        response = self.app.post('/sched' , json=self.payload )
+        self.assertEqual(response.status_code, 200 )
+        etag = response.headers['ETag']
+        self.payload['constraints'].reverse()
+        cached = self.app.post('/sched' , json=self.payload )
+        self.assertEqual(cached.status_code, 200 )
+        self.assertEqual(cached.get_data(), response.get_data())
+        self.assertEqual(cached.headers['ETag'], etag)
+        not_modified = self.app.post('/sched' , json=self.payload,
+                                     headers={'If-None-Match': etag} )
+        self.assertEqual(not_modified.status_code, 304 )
+        self.assertEqual(not_modified.get_data(), b'')
+
+    def test_api_stream(self):
+        self.payload['n_solutions'] = 5
+        response = self.app.post('/sched/stream' , json=self.payload )
+        self.assertEqual(response.status_code, 200 )
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data().splitlines()]
+        solutions, summary = lines[:-1], lines[-1]
+        self.assertEqual(len(solutions), 5 )
+        self.assertEqual(summary['n_solutions'], 5 )
+        self.assertEqual(summary['status'], 'FEASIBLE' )
+        self.assertEqual(summary['symmetry_classes'], [] )
+        response_schema.validate({'n_solutions': 5, 'solutions': solutions})
+
+        # a course doesn't fit into any day
+        self.payload['constraints'] = [{'course_id': 'BbjRKtortAflVFLL', 'day': d,
+                                        'intervals': [{'start': 0, 'end': 26}]}
+                                       for d in range(5)]
+        response = self.app.post('/sched/stream' , json=self.payload )
+        summary, = [json.loads(line) for line in response.get_data().splitlines()]
+        self.assertEqual(summary['n_solutions'], 0 )
+        self.assertEqual(summary['status'], 'INFEASIBLE' )
+
+    def test_api_jobs(self):
+        self.payload['n_solutions'] = 5
+        response = self.app.post('/jobs' , json=self.payload )
+        self.assertEqual(response.status_code, 202 )
+        job_id = response.get_json()['job_id']
+        self.assertTrue(response.headers['Location'].endswith(f'/jobs/{job_id}'))
+        for _ in range(600):
+            json_response = self.app.get(f'/jobs/{job_id}').get_json()
+            if json_response['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.1)
+        self.assertEqual(json_response['status'], 'done' )
+        self.assertEqual(json_response['progress']['n_solutions'], 5 )
+        response_schema.validate(json_response['result'])
+
+    def test_api_job_cancel(self):
+        # the large neighbourhood search runs for SOLVER_LNS_TIME unless it is stopped;
+        # the initial solution of the original model is already optimal
+        self.payload['n_solutions'] = 1
+        with mock.patch.dict(os.environ, {'SOLVER_SINGLE_MODE': 'lns',
+                                          'SOLVER_LNS_TIME': '60',
+                                          'SOLVER_LECTURE_PATTERNS': '1'}):
+            job_id = self.app.post('/jobs' , json=self.payload ).get_json()['job_id']
+            for _ in range(100):
+                if self.app.get(f'/jobs/{job_id}').get_json()['status'] == 'running':
+                    break
+                time.sleep(0.1)
+            time.sleep(2)  # the initial solution is found
+            cancelled = time.monotonic()
+            self.assertEqual(self.app.delete(f'/jobs/{job_id}').status_code, 200 )
+            for _ in range(100):
+                json_response = self.app.get(f'/jobs/{job_id}').get_json()
+                if json_response['status'] not in ('queued', 'running'):
+                    break
+                time.sleep(0.1)
+        self.assertLess(time.monotonic() - cancelled, 5)
+        self.assertEqual(json_response['status'], 'cancelled' )
+        self.assertEqual(json_response['result']['n_solutions'], 1 )
+        self.assertTrue(json_response['stats']['lns_trace'])
+        response_schema.validate(json_response['result'])
+
+    def test_api_job_not_found(self):
+        self.assertEqual(self.app.get('/jobs/nonexistent').status_code, 404 )
+        self.assertEqual(self.app.delete('/jobs/nonexistent').status_code, 404 )
+
+    def test_api_metrics(self):
+        self.payload['n_solutions'] = 4
+        self.assertEqual(self.app.post('/sched' , json=self.payload ).status_code, 200 )
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200 )
+        self.assertEqual(response.mimetype, 'text/plain')
+        text = response.get_data(as_text=True)
+        self.assertIn('sched_http_requests_total{endpoint="/sched",method="POST",status="200"}', text)
+        self.assertIn('sched_http_request_duration_seconds_count{endpoint="/sched"}', text)
+        self.assertIn('sched_solver_status_total{status="FEASIBLE"}', text)
+        for name in ('sched_model_variables_count', 'sched_model_constraints_count',
+                     'sched_solve_duration_seconds_count', 'sched_first_solution_seconds_count',
+                     'sched_solutions_found_bucket{le="10.0"}', 'sched_jobs{status="queued"}',
+                     'sched_process_resident_memory_bytes'):
+            self.assertIn(name, text)
+
     def test_api_response_schema(self):
         del self.payload['n_solutions']
         response = self.app.post('/sched' , json=self.payload )
@@ -63,5 +187,157 @@ class TestIntegrations(TestCase):
             {'message': "Bad request ; request isn't json"}
         )       
 
+class TestSolverPool(TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), 'examples', 'example_sched_request.json')) as f:
+            self.payload = json.load(f)
+        self.payload['n_solutions'] = 3
+        self.pool = SolverPool(1, max_jobs=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_solver_pool(self):
+        body, stats = self.pool.solve(self.payload, 5, 27, 'portfolio')
+        self.assertEqual(body, solve_request(self.payload, 5, 27, 'portfolio')[0])
+        self.assertEqual(stats['n_solutions'], 3)
+        self.assertGreater(stats['worker_rss_bytes'], 0)
+
+    def test_solver_pool_recycle(self):
+        self.pool.solve(self.payload, 5, 27, 'portfolio')
+        pids = {process.pid for process in self.pool._workers}
+        self.pool.solve(self.payload, 5, 27, 'portfolio')  # second job, worker is replaced
+        self.assertEqual(len(self.pool._workers), 1)
+        self.assertTrue(pids.isdisjoint(process.pid for process in self.pool._workers))
+
+    def test_solver_pool_recycle_rss(self):
+        self.pool.shutdown()
+        self.pool = SolverPool(1, max_rss_mb=1)  # every worker uses more than 1 MB
+        self.pool.solve(self.payload, 5, 27, 'portfolio')
+        pids = {process.pid for process in self.pool._workers}
+        self.pool.solve(self.payload, 5, 27, 'portfolio')
+        self.assertTrue(pids.isdisjoint(process.pid for process in self.pool._workers))
+
+    def test_solver_pool_invalid_request(self):
+        self.payload['course_locks'].append(self.payload['course_locks'][0])
+        with app.test_request_context():
+            with self.assertRaises(HTTPException) as cm:
+                self.pool.solve(self.payload, 5, 27, 'portfolio')
+        self.assertEqual(cm.exception.code, 400)
+
+class TestSolveSched(TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), 'examples', 'example_sched_request.json')) as f:
+            self.payload = json.load(f)
+        # curricula don't share courses
+        self.payload['curricula'][1]['courses'][3]['course_id'] = 'BbjRKtortAflVFLM'
+
+    def solve(self, n_solutions, single_mode):
+        self.payload['n_solutions'] = n_solutions
+        self.sched = sched = build_sched(self.payload, 5, 27)
+        callback = SchedPartialSolutionSerializer(sched.model_vars, sched.curricula,
+                                                  sched.n_days, sched.n_periods,
+                                                  n_solutions)
+        with mock.patch.dict(os.environ, {'SOLVER_LNS_TIME': '2'}):
+            status = solve_sched(sched, callback, n_solutions, single_mode)
+        return status, callback
+
+    def test_model_encodings(self):
+        sched = build_sched(self.payload, 5, 27)
+        calls = [name for name, _, _ in sched._calls]
+        for name in ('add_course_len_constraints', 'add_lecture_len_constraints',
+                     'add_lecture_symmetry_constraints'):
+            self.assertIn(name, calls)
+        self.assertNotIn('add_lecture_pattern_constraints', calls)
+        self.assertEqual((sched.canonical, sched.share_course_vars,
+                          sched.compile_unavailability, sched.optional_intervals),
+                         (True, False, False, False))
+
+        toggles = {'SOLVER_CANONICAL': '0', 'SOLVER_LECTURE_PATTERNS': '1',
+                   'SOLVER_SHARE_COURSE_VARS': '1', 'SOLVER_COMPILE_UNAVAILABILITY': '1',
+                   'SOLVER_OPTIONAL_INTERVALS': '1'}
+        with mock.patch.dict(os.environ, toggles):
+            sched = build_sched(self.payload, 5, 27)
+        calls = [name for name, _, _ in sched._calls]
+        self.assertIn('add_lecture_pattern_constraints', calls)
+        self.assertNotIn('add_lecture_len_constraints', calls)
+        self.assertEqual((sched.canonical, sched.share_course_vars,
+                          sched.compile_unavailability, sched.optional_intervals),
+                         (False, True, True, True))
+
+    def test_single_mode_precedes_decomposition(self):
+        self.assertEqual(len(build_sched(self.payload, 5, 27).connected_components()), 2)
+        modes = {'shared_first': 'solve_shared_first',
+                 'coarse_to_fine': 'solve_coarse_to_fine', 'lns': 'improve_lns',
+                 'portfolio': 'solve_decomposed'}
+        for single_mode, method in modes.items():
+            with mock.patch.object(CourseSched, method, autospec=True,
+                                   side_effect=getattr(CourseSched, method)) as solve:
+                _, callback = self.solve(1, single_mode)
+            solve.assert_called_once()
+            self.assertEqual(callback.solution_count(), 1, single_mode)
+
+    def test_two_stage(self):
+        # soft constraints of the request: solved like portfolio
+        with mock.patch.object(CourseSched, 'solve_two_stage') as solve_two_stage:
+            _, callback = self.solve(1, 'two_stage')
+        solve_two_stage.assert_not_called()
+        self.assertEqual(callback.solution_count(), 1)
+
+        with mock.patch.dict(os.environ, {'SOLVER_TWO_STAGE_TIME': '5'}), \
+                mock.patch.object(CourseSched, 'solves_two_stage', return_value=True), \
+                mock.patch.object(CourseSched, 'solve_two_stage',
+                                  return_value=cp_model.FEASIBLE) as solve_two_stage:
+            _, callback = self.solve(1, 'two_stage')
+        solve_two_stage.assert_called_once_with(callback, max_time=5)
+
+    def test_lns(self):
+        started = time.monotonic()
+        with mock.patch.dict(os.environ, {'SOLVER_NUM_WORKERS': '2'}), \
+                mock.patch.object(CourseSched, 'improve_lns', autospec=True,
+                                  side_effect=CourseSched.improve_lns) as improve_lns:
+            status, callback = self.solve(1, 'lns')
+        self.assertEqual(improve_lns.call_args[1]['num_search_workers'], 2)
+        stats = solve_stats(self.sched, callback, started, status)
+        self.assertTrue(stats['lns_trace'])
+        self.assertEqual(stats['lns_trace'][-1][1],
+                         round(self.sched.solver.ObjectiveValue()))
+
+        status, callback = self.solve(1, 'portfolio')
+        self.assertNotIn('lns_trace', solve_stats(self.sched, callback, started, status))
+
+    def test_symmetry_classes(self):
+        # courses without constraints or locks are interchangeable
+        self.payload['constraints'] = []
+        self.payload['course_locks'] = []
+        started = time.monotonic()
+        status, callback = self.solve(1, 'portfolio')
+        stats = solve_stats(self.sched, callback, started, status)
+        self.assertTrue(stats['symmetry_classes'])
+        self.assertEqual(stats['symmetry_classes'], self.sched.symmetry_classes)
+
+        with mock.patch.dict(os.environ, {'SOLVER_SYMMETRY_BREAKING': '0'}):
+            status, callback = self.solve(1, 'portfolio')
+        self.assertEqual(solve_stats(self.sched, callback, started, status)['symmetry_classes'], [])
+
+    def test_infeasible_status(self):
+        # a course of the first curriculum doesn't fit into any day
+        self.payload['constraints'] = [{'course_id': 'BbjRKtortAflVFLL', 'day': d,
+                                        'intervals': [{'start': 0, 'end': 26}]}
+                                       for d in range(5)]
+        cases = [(1, single_mode) for single_mode in
+                 ('two_stage', 'shared_first', 'coarse_to_fine', 'lns', 'portfolio')]
+        for n_solutions, single_mode in cases + [(2, 'portfolio')]:  # decomposed
+            status, callback = self.solve(n_solutions, single_mode)
+            self.assertEqual(status, cp_model.INFEASIBLE, single_mode)
+            self.assertEqual(solver_status(status, callback), 'INFEASIBLE')
+        # curricula share a course: single, enumeration and partitioned search
+        self.payload['curricula'][1]['courses'][3]['course_id'] = 'BbjRKtortAflVFLL'
+        for n_solutions in (1, 2, 500):
+            status, callback = self.solve(n_solutions, 'portfolio')
+            self.assertEqual(status, cp_model.INFEASIBLE, n_solutions)
+            self.assertEqual(solver_status(status, callback), 'INFEASIBLE')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import json
+import tempfile
+import time
+
+from unittest import mock
+
+from api_cache import ResultCache, request_key
+from api_util import result_settings
+
+SETTINGS = {'periods_per_day': 27, 'n_days': 5}
+
+
+class TestRequestKey(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), 'examples', 'example_sched_request.json')) as f:
+            self.payload = json.load(f)
+        self.payload['constraints'].append({'course_id': 'EECS2011', 'day': 1,
+                                            'intervals': [{'start': 3, 'end': 5},
+                                                          {'start': 0, 'end': 1}]})
+
+    def test_request_key_ignores_order(self):
+        key = request_key(self.payload, SETTINGS)
+        self.payload['constraints'].reverse()
+        self.payload['constraints'][0]['intervals'].reverse()
+        self.payload['course_locks'].reverse()
+        for course_lock in self.payload['course_locks']:
+            course_lock['locks'].reverse()
+        self.assertEqual(request_key(self.payload, SETTINGS), key)
+
+    def test_request_key_keeps_curricula_order(self):
+        key = request_key(self.payload, SETTINGS)
+        self.payload['curricula'].reverse()
+        self.assertNotEqual(request_key(self.payload, SETTINGS), key)
+
+    def test_request_key_settings(self):
+        key = request_key(self.payload, SETTINGS)
+        self.assertNotEqual(request_key(self.payload, {**SETTINGS, 'n_days': 4}), key)
+        self.payload['n_solutions'] += 1
+        self.assertNotEqual(request_key(self.payload, SETTINGS), key)
+
+
+    def test_request_key_result_settings(self):
+        key = request_key(self.payload, result_settings())
+        with mock.patch.dict(os.environ, {'SOLVER_NUM_WORKERS': '2'}):
+            self.assertNotEqual(request_key(self.payload, result_settings()), key)
+        with mock.patch('api_util.CODE_VERSION', 'other'):
+            self.assertNotEqual(request_key(self.payload, result_settings()), key)
+        self.assertEqual(request_key(self.payload, result_settings()), key)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_size=2)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        self.assertEqual(cache.get('a'), b'1')  # 'b' is now least recently used
+        cache.put('c', b'3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.get('c'), b'3')
+
+    def test_ttl_eviction(self):
+        cache = ResultCache(ttl=0.05)
+        cache.put('a', b'1')
+        self.assertEqual(cache.get('a'), b'1')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_disk_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ResultCache(directory=directory).put('a', b'1')
+            cache = ResultCache(max_size=0, directory=directory)  # new process, no LRU
+            self.assertEqual(cache.get('a'), b'1')
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNone(ResultCache(ttl=-1, directory=directory).get('a'))
+            self.assertFalse(os.listdir(directory))  # expired entry was removed
+
+    def test_disk_size_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_size=0, directory=directory, max_disk_bytes=10)
+            for i, key in enumerate('abc'):
+                cache.put(key, b'1234')
+                os.utime(os.path.join(directory, key + '.json'), (i, i))
+            cache.put('d', b'1234')  # 'a' is the oldest file
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(sorted(os.listdir(directory)), ['c.json', 'd.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
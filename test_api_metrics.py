@@ -0,0 +1,51 @@
+import unittest
+
+from api_metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter('requests_total', 'Requests.', ['endpoint', 'status'])
+        counter.inc(endpoint='/sched', status='200')
+        counter.inc(2, endpoint='/sched', status='200')
+        counter.inc(endpoint='/sched', status='400')
+        self.assertEqual(counter.render().splitlines(),
+                         ['# HELP requests_total Requests.',
+                          '# TYPE requests_total counter',
+                          'requests_total{endpoint="/sched",status="200"} 3',
+                          'requests_total{endpoint="/sched",status="400"} 1'])
+
+    def test_counter_labels(self):
+        counter = Counter('requests_total', 'Requests.', ['endpoint'])
+        with self.assertRaises(AssertionError):
+            counter.inc(status='200')
+
+    def test_gauge(self):
+        gauge = Gauge('rss_bytes', 'RSS.')
+        gauge.set(10)
+        gauge.set(5)
+        self.assertEqual(gauge.render().splitlines()[-1], 'rss_bytes 5')
+
+    def test_histogram(self):
+        histogram = Histogram('duration_seconds', 'Duration.', buckets=(1, 0.5))
+        for value in (0.1, 0.7, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.render().splitlines()[2:],
+                         ['duration_seconds_bucket{le="0.5"} 1',
+                          'duration_seconds_bucket{le="1.0"} 2',
+                          'duration_seconds_bucket{le="+Inf"} 3',
+                          'duration_seconds_sum 3.8',
+                          'duration_seconds_count 3'])
+
+    def test_registry(self):
+        registry = Registry()
+        registry.register(Gauge('a', 'A.')).set(1)
+        registry.register(Gauge('b', 'B "quoted".')).set(2)
+        text = registry.render()
+        self.assertTrue(text.endswith('\nb 2\n'))
+        self.assertIn('# HELP b B \\"quoted\\".\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()